@@ -0,0 +1,98 @@
+"""Measure the cost of manip color adjustments as more of them are enabled
+
+All enabled adjustments are composed into a single lookup table, so the time taken should stay
+flat no matter how many are enabled. For comparison the same adjustments are also applied as
+separate passes using :mod:`PIL.ImageEnhance`, which grows with each adjustment.
+
+::
+
+  poetry run python benchmarks/adjustments.py --size 2000
+"""
+import argparse
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+
+import PIL.Image
+import PIL.ImageEnhance
+
+from kodak import configuration
+from kodak import manipulations
+
+
+STACKS: Dict[str, Dict[str, object]] = {
+    "none": {},
+    "brightness": {"brightness": 10},
+    "brightness+contrast": {"brightness": 10, "contrast": 20},
+    "brightness+contrast+bw": {
+        "brightness": 10,
+        "contrast": 20,
+        "black_and_white": True,
+    },
+    "brightness+contrast+sepia": {"brightness": 10, "contrast": 20, "sepia": True},
+}
+
+
+def separate(
+    image: PIL.Image.Image, config: configuration.ManipConfig
+) -> PIL.Image.Image:
+    """Apply the adjustments of a manip one pass at a time"""
+    if config.brightness:
+        image = PIL.ImageEnhance.Brightness(image).enhance(1 + config.brightness / 100)
+    if config.contrast:
+        image = PIL.ImageEnhance.Contrast(image).enhance(1 + config.contrast / 100)
+    if config.black_and_white or config.sepia:
+        image = image.convert("L")
+    if config.sepia:
+        image = PIL.Image.merge(
+            "RGB",
+            [
+                image.point(lambda value: min(value * 1.351, 255)),
+                image.point(lambda value: min(value * 1.203, 255)),
+                image.point(lambda value: min(value * 0.937, 255)),
+            ],
+        )
+    return image
+
+
+def measure(
+    func: Callable[[PIL.Image.Image, configuration.ManipConfig], PIL.Image.Image],
+    image: PIL.Image.Image,
+    config: configuration.ManipConfig,
+    repeat: int,
+) -> float:
+    """Return the average time in milliseconds to apply the adjustments"""
+    timings: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(image, config)
+        timings.append(time.perf_counter() - start)
+    return sum(timings) / len(timings) * 1000
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--size", type=int, default=2000, help="Width and height of the test image"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=10, help="Number of times to run each stack"
+    )
+    args = parser.parse_args()
+
+    image = PIL.Image.effect_mandelbrot(
+        (args.size, args.size), (-2, -1.5, 1, 1.5), 100
+    ).convert("RGB")
+
+    print(f"{'adjustments':<28} {'lut ms':>10} {'separate ms':>12}")
+    for name, settings in STACKS.items():
+        config = configuration.ManipConfig(name=name, **settings)  # type: ignore
+        print(
+            f"{name:<28} {measure(manipulations.adjust, image, config, args.repeat):>10.1f} {measure(separate, image, config, args.repeat):>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
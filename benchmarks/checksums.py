@@ -0,0 +1,70 @@
+"""Compare source image checksum throughput across hashing algorithms and buffer sizes
+
+Every file in the sample corpus is checksummed with each combination of algorithm and buffer
+size. The corpus is read once before timing starts so that, as long as it fits in memory, the
+results measure hashing rather than disk throughput.
+
+::
+
+  poetry run python benchmarks/checksums.py ~/pictures --algorithm sha256 blake2b sha1
+"""
+import argparse
+import hashlib
+import time
+from pathlib import Path
+
+from kodak import constants
+from kodak import database
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", type=Path, help="Directory of sample images")
+    parser.add_argument(
+        "--algorithm",
+        nargs="+",
+        default=["sha256", "sha512", "sha1", "blake2b", "blake2s", "sha3_256", "md5"],
+        choices=sorted(hashlib.algorithms_available),
+        help="Hashing algorithms to compare",
+    )
+    parser.add_argument(
+        "--buffer",
+        type=int,
+        nargs="+",
+        default=[64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024],
+        help="Buffer sizes, in bytes, to compare",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of times to checksum each file"
+    )
+    args = parser.parse_args()
+
+    paths = [
+        path
+        for path in sorted(args.corpus.rglob("*"))
+        if path.suffix.lower() in constants.IMAGE_FILE_EXTENSIONS
+    ]
+    if not paths:
+        parser.error(f"No images found in {args.corpus}")
+
+    total = 0
+    for path in paths:
+        total += len(path.read_bytes())
+
+    print(f"{len(paths)} files, {total / 1024 / 1024:.1f} MiB")
+    print(f"{'algorithm':<12} {'buffer':>10} {'MiB/s':>10}")
+    for algorithm in args.algorithm:
+        for buffer_size in args.buffer:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                for path in paths:
+                    database.Checksum.from_path(path, algorithm, buffer_size)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{algorithm:<12} {buffer_size:>10} {total * args.repeat / 1024 / 1024 / elapsed:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Compare encoded size and encode time of manip encoder profiles
+
+Each image in the sample corpus is decoded and scaled once, then encoded with every profile. The
+total encoded bytes and encode time of each profile across the corpus are reported.
+
+::
+
+  poetry run python benchmarks/encoders.py ~/pictures --width 1200
+"""
+import argparse
+import io
+import time
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import PIL.Image
+import PIL.ImageOps
+
+from kodak import configuration
+from kodak import constants
+from kodak import engine
+
+
+PROFILES: Dict[str, Tuple[constants.ImageFormat, configuration.ManipConfig]] = {
+    "jpeg-default": (
+        constants.ImageFormat.JPEG,
+        configuration.ManipConfig(name="jpeg-default"),
+    ),
+    "jpeg-optimized": (
+        constants.ImageFormat.JPEG,
+        configuration.ManipConfig(
+            name="jpeg-optimized",
+            jpeg=configuration.ManipJpegConfig(optimize=True),
+        ),
+    ),
+    "jpeg-progressive": (
+        constants.ImageFormat.JPEG,
+        configuration.ManipConfig(
+            name="jpeg-progressive",
+            jpeg=configuration.ManipJpegConfig(progressive=True, optimize=True),
+        ),
+    ),
+    "jpeg-q85-444": (
+        constants.ImageFormat.JPEG,
+        configuration.ManipConfig(
+            name="jpeg-q85-444",
+            jpeg=configuration.ManipJpegConfig(
+                quality=85,
+                optimize=True,
+                subsampling=constants.ChromaSubsampling.NONE,
+            ),
+        ),
+    ),
+    "png-default": (
+        constants.ImageFormat.PNG,
+        configuration.ManipConfig(name="png-default"),
+    ),
+    "png-fast": (
+        constants.ImageFormat.PNG,
+        configuration.ManipConfig(
+            name="png-fast", png=configuration.ManipPngConfig(compress_level=1)
+        ),
+    ),
+    "png-optimized": (
+        constants.ImageFormat.PNG,
+        configuration.ManipConfig(
+            name="png-optimized", png=configuration.ManipPngConfig(optimize=True)
+        ),
+    ),
+    "webp-default": (
+        constants.ImageFormat.WEBP,
+        configuration.ManipConfig(name="webp-default"),
+    ),
+    "webp-q60-m6": (
+        constants.ImageFormat.WEBP,
+        configuration.ManipConfig(
+            name="webp-q60-m6", webp=configuration.ManipWebpConfig(quality=60, method=6)
+        ),
+    ),
+}
+
+
+def load(corpus: Path, width: int) -> List[PIL.Image.Image]:
+    """Decode and scale every image in the sample corpus"""
+    images = []
+    for path in sorted(corpus.rglob("*")):
+        if path.suffix.lower() not in constants.IMAGE_FILE_EXTENSIONS:
+            continue
+        with PIL.Image.open(path) as image:
+            image = PIL.ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((width, width), PIL.Image.LANCZOS)
+        images.append(image)
+    return images
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", type=Path, help="Directory of sample images")
+    parser.add_argument(
+        "--width", type=int, default=1200, help="Size to scale the images down to"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of times to encode each image"
+    )
+    args = parser.parse_args()
+
+    images = load(args.corpus, args.width)
+    if not images:
+        parser.error(f"No images found in {args.corpus}")
+
+    print(f"{'profile':<20} {'bytes':>12} {'ratio':>7} {'ms/image':>10}")
+    baseline = None
+    for name, (format_, manip) in PROFILES.items():
+        options = engine.encoder_options(manip, format_)
+        size = 0
+        elapsed = 0.0
+        for image in images:
+            for _ in range(args.repeat):
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                image.save(buffer, format_.name, **options)
+                elapsed += time.perf_counter() - start
+            size += buffer.tell()
+
+        baseline = baseline or size
+        print(
+            f"{name:<20} {size:>12} {size / baseline:>7.2f} {elapsed / (len(images) * args.repeat) * 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Measure the latency of the image and manip record lookups made by every manip request
+
+For each library size a fresh database is populated with that many image records, each with one
+manip record, and random images are then looked up by name followed by their manip by parent,
+name, and format. The lookups are timed with the schema indexes in place and again after they
+have been dropped, to show the full table scans that the indexes avoid.
+
+::
+
+  poetry run python benchmarks/lookups.py --rows 10000 100000 1000000
+
+The benchmark always uses a temporary SQLite database.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from kodak import configuration
+from kodak import constants
+from kodak import database
+
+
+INDEXES = (
+    "imagerecord_name",
+    "imagerecord_source",
+    "maniprecord_parent_id_name_format_",
+)
+
+
+def populate(rows: int) -> None:
+    """Insert image records and one manip record per image"""
+    checksum = database.Checksum("sha256", "0" * 64)
+    for start in range(0, rows, 10000):
+        batch = range(start, min(start + 10000, rows))
+        with database.interface.atomic():
+            database.ImageRecord.insert_many(
+                [
+                    {
+                        "name": f"album{item % 100}-image{item}",
+                        "source": Path(f"album{item % 100}", f"image{item}.jpg"),
+                        "format_": constants.ImageFormat.JPEG,
+                        "checksum": checksum,
+                    }
+                    for item in batch
+                ]
+            ).execute()
+            database.ManipRecord.insert_many(
+                [
+                    {
+                        "parent": item + 1,
+                        "name": "thumb",
+                        "file": Path(f"album{item % 100}-image{item}", "thumb.jpeg"),
+                        "format_": constants.ImageFormat.JPEG,
+                        "checksum": checksum,
+                    }
+                    for item in batch
+                ]
+            ).execute()
+
+
+def lookup(rows: int, count: int) -> List[float]:
+    """Time lookups of random images and their manips, returning the latencies in seconds"""
+    latencies = []
+    for item in random.sample(range(rows), min(count, rows)):
+        start = time.perf_counter()
+        with database.interface.atomic():
+            parent = database.ImageRecord.get(
+                database.ImageRecord.name == f"album{item % 100}-image{item}"
+            )
+            database.ManipRecord.get(
+                database.ManipRecord.parent == parent,
+                database.ManipRecord.name == "thumb",
+                database.ManipRecord.format_ == constants.ImageFormat.JPEG,
+            )
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(rows: int, label: str, latencies: List[float]) -> None:
+    """Print a summary of lookup latencies"""
+    latencies = sorted(latencies)
+    print(
+        f"{rows:>10} {label:<10} {statistics.median(latencies) * 1000:>10.3f} {latencies[int(len(latencies) * 0.99)] * 1000:>10.3f}"
+    )
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[10000, 100000, 1000000],
+        help="Numbers of image records to benchmark with",
+    )
+    parser.add_argument(
+        "--lookups", type=int, default=200, help="Number of lookups to time"
+    )
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'schema':<10} {'p50 ms':>10} {'p99 ms':>10}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tempdir:
+            config = configuration.KodakConfig()
+            config.database.backend = constants.DatabaseBackend.SQLITE
+            config.database.sqlite.path = Path(tempdir, "kodak.db")
+            database.initialize(config)
+
+            populate(rows)
+            report(rows, "indexed", lookup(rows, args.lookups))
+
+            for index in INDEXES:
+                database.interface.execute_sql(f'DROP INDEX "{index}"')
+            database.interface.execute_sql("ANALYZE")
+            report(rows, "unindexed", lookup(rows, min(args.lookups, 20)))
+
+            database.interface.close()
+
+
+if __name__ == "__main__":
+    main()
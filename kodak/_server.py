@@ -1,8 +1,17 @@
+import math
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Type
+
 import flask
+import flask_restful
+from playhouse import pool
 
 from kodak import configuration
 from kodak import database
 from kodak import exceptions
+from kodak import index
 
 
 def make_the_tea() -> None:
@@ -16,9 +25,74 @@ def make_the_tea() -> None:
         )
 
 
+def make_api_errors() -> Dict[str, Dict[str, Any]]:
+    """Build the error mapping for the API so that application exceptions get their status
+
+    See the ``errors`` parameter of :class:`flask_restful.Api`
+    """
+
+    def _walk(error: Type[exceptions.KodakException]) -> Dict[str, Dict[str, Any]]:
+        errors = {}
+        for child in error.__subclasses__():
+            errors[child.__name__] = {
+                "status": child.status,
+                "message": (child.__doc__ or "").strip().splitlines()[0],
+            }
+            errors.update(_walk(child))
+        return errors
+
+    return _walk(exceptions.KodakException)
+
+
+class KodakApi(flask_restful.Api):
+    """Extend the default API object to add error response headers
+
+    Exceptions that carry a ``retry_after`` attribute (such as
+    :class:`exceptions.RenderAdmissionError`) have it sent to the client in the ``Retry-After``
+    header of the error response. Running out of pooled database connections is reported as a
+    :class:`exceptions.DatabaseBusyError` rather than as an unhandled error.
+    """
+
+    def handle_error(self, e):
+        if isinstance(e, pool.MaxConnectionsExceeded):
+            e = exceptions.DatabaseBusyError(
+                str(e),
+                retry_after=max(
+                    math.ceil(
+                        flask.current_app.appconfig.database.mariadb.pool_timeout
+                    ),
+                    1,
+                ),
+            )
+        response = super().handle_error(e)
+        retry_after = getattr(e, "retry_after", None)
+        if retry_after is not None:
+            response.headers["Retry-After"] = str(retry_after)
+        return response
+
+
 def initialize_database() -> None:
     """Initialize the database connection"""
     database.initialize(flask.current_app.appconfig)
+    # Return the connection used to initialize the database to the pool, so that the first
+    # request only checks one out if it needs one
+    database.interface.close()
+
+
+def close_database(_: Optional[BaseException] = None) -> None:
+    """Return the current request's database connection to the pool
+
+    Connections are not checked out when a request starts: the database connects on first use,
+    so requests served entirely from the record cache (see :class:`cache.RecordCache`) never
+    check out a connection at all.
+    """
+    if database.interface.obj is not None and not database.interface.is_closed():
+        database.interface.close()
+
+
+def start_index() -> None:
+    """Start building the source image index in the background"""
+    index.start(flask.current_app.appconfig)
 
 
 class KodakFlask(flask.Flask):
@@ -30,3 +104,4 @@ class KodakFlask(flask.Flask):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.appconfig: configuration.KodakConfig = configuration.load()
+        self.teardown_request(close_database)
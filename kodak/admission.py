@@ -0,0 +1,192 @@
+"""Render admission control based on a pixel budget shared between processes
+
+Decoding an image takes memory proportional to the number of pixels decoded, so a handful of
+concurrent renders of very large images can exhaust the memory available to the server even
+though any one of them alone would be fine. Before a render is dispatched the dimensions of the
+source image are read from its header and the number of pixels that will be decoded is estimated.
+The render is only admitted while the total of all admitted renders, across every process sharing
+the content directory, stays within the configured budget.
+
+Admitted renders are recorded in a ledger file alongside the PID of the process that admitted
+them, so reservations held by a process that has exited are discarded the next time the ledger
+is read rather than permanently consuming the budget.
+
+::
+
+  from kodak import admission
+
+  pixels = admission.estimate(source, manips, config.render.max_pixels)
+  with admission.PixelBudget.from_config(config).admit(pixels):
+      ...
+"""
+import contextlib
+import json
+import logging
+import math
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from PIL import Image
+
+from kodak import configuration
+from kodak import constants
+from kodak import exceptions
+from kodak import locking
+from kodak import manipulations
+
+
+def estimate(
+    source: Path, manips: Sequence[configuration.ManipConfig], max_pixels: int = 0
+) -> int:
+    """Estimate the number of pixels that will be decoded to render manipulations of an image
+
+    Only the image header is read; the pixel data is not decoded. The image is opened in the
+    calling process, so Pillow's decompression bomb check applies in addition to ``max_pixels``.
+
+    :param source: Path to the source image file
+    :param manips: Manipulation configurations that will be rendered from the image
+    :param max_pixels: Maximum number of pixels a source image may have. If zero then any size
+                       of image is allowed.
+    :raises exceptions.ImageTooLargeError: When the source image has more than ``max_pixels``
+                                           pixels, or is rejected by Pillow's decompression bomb
+                                           check
+    :returns: Estimated number of pixels of the decoded source image
+    """
+    try:
+        with Image.open(source) as image:
+            width, height = manipulations.oriented_size(image)
+            format_ = image.format
+    except Image.DecompressionBombError as err:
+        raise exceptions.ImageTooLargeError(
+            f"Source image {source} is too large to open: {err}"
+        ) from None
+
+    if max_pixels and width * height > max_pixels:
+        raise exceptions.ImageTooLargeError(
+            f"Source image {source} is {width}x{height} ({width * height} pixels), exceeding the limit of {max_pixels} pixels"
+        )
+
+    request = manipulations.draft_size((width, height), *manips)
+    if format_ != "JPEG" or request is None:
+        return width * height
+
+    # Mirror the reduction that Pillow's JPEG draft mode will select for the request
+    ratio = min(width // request[0], height // request[1])
+    reduction = next(item for item in (8, 4, 2, 1) if ratio >= item)
+    return math.ceil(width / reduction) * math.ceil(height / reduction)
+
+
+class PixelBudget:
+    """Budget of decoded pixels shared between every process using a content directory
+
+    :param directory: Content directory that the budget is shared through
+    :param budget: Maximum total number of pixels that may be decoded by admitted renders at
+                   once. If zero then every render is admitted immediately.
+    :param timeout: Number of seconds to wait for enough of the budget to become available
+    """
+
+    def __init__(self, directory: Path, budget: int, timeout: float):
+        self.budget = budget
+        self.timeout = timeout
+        self.ledger = directory / constants.LOCK_DIRECTORY_NAME / "admission.json"
+        self.lock = directory / constants.LOCK_DIRECTORY_NAME / "admission.lock"
+
+    @classmethod
+    def from_config(cls, config: configuration.KodakConfig):
+        """Build the budget from the application configuration"""
+        return cls(
+            config.content_dir, config.render.pixel_budget, config.render.timeout
+        )
+
+    def _read(self) -> Dict[str, Tuple[int, int]]:
+        try:
+            with self.ledger.open() as infile:
+                entries = {
+                    token: (pid, pixels)
+                    for token, (pid, pixels) in json.load(infile).items()
+                }
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError) as err:
+            logging.getLogger(__name__).warning(
+                f"Discarding unreadable admission ledger {self.ledger}: {err}"
+            )
+            return {}
+
+        live = {}
+        for token, (pid, pixels) in entries.items():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                logging.getLogger(__name__).warning(
+                    f"Releasing {pixels} pixels admitted by process {pid}, which no longer exists"
+                )
+                continue
+            except PermissionError:
+                pass
+            live[token] = (pid, pixels)
+        return live
+
+    def _write(self, entries: Dict[str, Tuple[int, int]]) -> None:
+        temp = self.ledger.with_name(f".{self.ledger.name}.{os.getpid()}.tmp")
+        with temp.open("w") as outfile:
+            json.dump(entries, outfile)
+        os.replace(temp, self.ledger)
+
+    def _reserve(self, pixels: int) -> Optional[str]:
+        with locking.FileLock(self.lock):
+            entries = self._read()
+            used = sum(item[1] for item in entries.values())
+            # A render larger than the whole budget is admitted once nothing else is running,
+            # otherwise it could never be admitted at all
+            if entries and used + pixels > self.budget:
+                return None
+            token = uuid.uuid4().hex
+            entries[token] = (os.getpid(), pixels)
+            self._write(entries)
+
+        logging.getLogger(__name__).debug(
+            f"Admitted render of {pixels} pixels ({used + pixels}/{self.budget} pixels in use)"
+        )
+        return token
+
+    def _release(self, token: str) -> None:
+        with locking.FileLock(self.lock):
+            entries = self._read()
+            entries.pop(token, None)
+            self._write(entries)
+
+    @contextlib.contextmanager
+    def admit(self, pixels: int) -> Iterator[None]:
+        """Reserve part of the budget for the duration of the context
+
+        :param pixels: Number of pixels to reserve
+        :raises exceptions.RenderAdmissionError: When the budget did not free up within the
+                                                 configured timeout
+        """
+        if not self.budget:
+            yield
+            return
+
+        deadline = time.monotonic() + self.timeout
+        token = self._reserve(pixels)
+        while token is None:
+            if time.monotonic() >= deadline:
+                raise exceptions.RenderAdmissionError(
+                    f"Render of {pixels} pixels was not admitted within {self.timeout} seconds (budget of {self.budget} pixels)",
+                    retry_after=max(math.ceil(self.timeout), 1),
+                )
+            time.sleep(constants.ADMISSION_POLL_INTERVAL)
+            token = self._reserve(pixels)
+
+        try:
+            yield
+        finally:
+            self._release(token)
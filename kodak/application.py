@@ -1,19 +1,19 @@
-import flask_restful
-
-from kodak import index
 from kodak import resources
 from kodak._server import initialize_database
+from kodak._server import KodakApi
 from kodak._server import KodakFlask
+from kodak._server import make_api_errors
 from kodak._server import make_the_tea
+from kodak._server import start_index
 
 
 APPLICATION = KodakFlask(__name__)
-API = flask_restful.Api(APPLICATION, catch_all_404s=True)
+API = KodakApi(APPLICATION, catch_all_404s=True, errors=make_api_errors())
 
 
 APPLICATION.before_request(make_the_tea)
 APPLICATION.before_first_request(initialize_database)
-APPLICATION.before_first_request(index.build)
+APPLICATION.before_first_request(start_index)
 
 for resource in resources.RESOURCES:
     API.add_resource(resource, *resource.routes)
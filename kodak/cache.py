@@ -0,0 +1,309 @@
+"""In-memory caches local to a single process
+
+Traffic is typically heavily skewed towards a small number of images: when a new image is
+published every manip of it tends to be requested within a short period of time. Decoding the
+source image is the single most expensive step of rendering a manip, so keeping recently decoded
+source images in memory lets a burst of requests for one image skip the repeated decodes.
+
+Once a manip has been rendered, serving it only requires looking up its record, so keeping
+recently used database records in memory lets requests for rendered manips skip the database
+entirely.
+"""
+import collections
+import logging
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+import PIL.Image
+
+
+class CacheStats(NamedTuple):
+    """Snapshot of cache usage counters
+
+    :param hits: Number of lookups that were served from the cache
+    :param misses: Number of lookups that were not served from the cache
+    :param entries: Number of items currently in the cache
+    :param size: Current size of the cache
+    :param capacity: Maximum size of the cache
+    """
+
+    hits: int
+    misses: int
+    entries: int
+    size: int
+    capacity: int
+
+    @property
+    def ratio(self) -> float:
+        """Proportion of lookups that were served from the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SourceEntry(NamedTuple):
+    """Decoded source image stored in the cache
+
+    :param image: Decoded source image with its EXIF orientation applied. This may be a reduced
+                  resolution decode of the source (see :func:`manipulations.draft`).
+    :param size: Width and height of the full resolution (oriented) source image
+    """
+
+    image: PIL.Image.Image
+    size: Tuple[int, int]
+
+
+def image_bytes(image: PIL.Image.Image) -> int:
+    """Estimate the number of bytes of memory used by the pixel data of an image"""
+    pixel = 4 if len(image.getbands()) > 1 or image.mode in ("I", "F") else 1
+    return image.width * image.height * pixel
+
+
+class SourceCache:
+    """Least-recently-used cache of decoded source images
+
+    The cache is bounded by the total memory used by the pixel data of the images it holds rather
+    than by the number of entries, since source images vary wildly in size.
+
+    .. note:: Images returned from the cache are shared and must not be modified in place
+
+    :param capacity: Maximum number of bytes of pixel data to hold. Set to zero to disable the
+                     cache.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[Hashable, SourceEntry]" = (
+            collections.OrderedDict()
+        )
+
+    def get(
+        self,
+        key: Hashable,
+        minimum: Optional[Callable[[Tuple[int, int]], Tuple[int, int]]] = None,
+    ) -> Optional[SourceEntry]:
+        """Retrieve a decoded source image
+
+        :param key: Unique identifier of the source image
+        :param minimum: Callable that is passed the full resolution size of the cached image and
+                        returns the minimum width and height the cached image must have to be
+                        usable. If the cached image was decoded at a lower resolution than this
+                        then it is treated as a miss. Defaults to requiring the full resolution
+                        image.
+        :returns: The cached entry, or ``None`` if there is no usable entry for the key
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                width, height = minimum(entry.size) if minimum else entry.size
+                if entry.image.width >= width and entry.image.height >= height:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, image: PIL.Image.Image, size: Tuple[int, int]) -> None:
+        """Store a decoded source image, evicting the least recently used entries to make room
+
+        :param key: Unique identifier of the source image
+        :param image: Decoded source image with its EXIF orientation applied
+        :param size: Width and height of the full resolution (oriented) source image
+        """
+        cost = image_bytes(image)
+        if cost > self.capacity:
+            return
+
+        with self._lock:
+            existing = self._entries.pop(key, None)
+            if existing is not None:
+                self._size -= image_bytes(existing.image)
+
+            while self._entries and self._size + cost > self.capacity:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= image_bytes(evicted.image)
+
+            self._entries[key] = SourceEntry(image=image, size=size)
+            self._size += cost
+
+    def clear(self) -> None:
+        """Remove every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> CacheStats:
+        """Retrieve a snapshot of the cache usage counters"""
+        with self._lock:
+            return CacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                size=self._size,
+                capacity=self.capacity,
+            )
+
+
+class RecordCache:
+    """Least-recently-used cache of database records
+
+    Records are only modified by index builds, which increment a generation counter stored in the
+    database whenever they make changes (see :class:`database.GenerationRecord`). The cache reads
+    the counter at most once per ``interval`` and discards every entry when it has changed, so a
+    lookup served from the cache makes no database queries at all and records are never more than
+    ``interval`` seconds out of date.
+
+    A record read from the database while the counter is being changed may already be out of date
+    by the time it is stored, so callers read the generation (see :meth:`generation`) before
+    reading a record from the database and pass it to :meth:`put`, which discards the record if
+    the generation has changed since.
+
+    ::
+
+      generation = RECORDS.generation()
+      record = RECORDS.get(key)
+      if record is None:
+          record = ImageRecord.get(ImageRecord.name == name)
+          RECORDS.put(key, record, generation)
+
+    :param capacity: Maximum number of records to hold. Set to zero to disable the cache.
+    :param interval: Minimum number of seconds between reads of the generation counter
+    :param generation: Callable that returns the current value of the generation counter
+    """
+
+    def __init__(self, capacity: int, interval: float, generation: Callable[[], int]):
+        self.capacity = capacity
+        self.interval = interval
+        self.hits = 0
+        self.misses = 0
+        self._generation_func = generation
+        self._generation: Optional[int] = None
+        self._checked = -float("inf")
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[Hashable, Any]" = (
+            collections.OrderedDict()
+        )
+
+    def _check(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.interval:
+            return
+        # Claim the check before making it so that concurrent lookups do not all query the counter
+        self._checked = now
+        generation = self._generation_func()
+        with self._lock:
+            if generation != self._generation:
+                if self._entries:
+                    logging.getLogger(__name__).debug(
+                        f"Record generation changed from {self._generation} to {generation}, discarding {len(self._entries)} cached records"
+                    )
+                self._entries.clear()
+                self._generation = generation
+
+    def generation(self) -> Optional[int]:
+        """Retrieve the generation that records are currently cached under
+
+        :returns: The generation counter as of the most recent read, or ``None`` if the cache is
+                  disabled
+        """
+        if not self.capacity:
+            return None
+        self._check()
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Retrieve a record
+
+        :param key: Unique identifier of the record
+        :returns: The cached record, or ``None`` if the record is not cached
+        """
+        if self.capacity:
+            self._check()
+        with self._lock:
+            record = self._entries.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return record
+
+    def put(self, key: Hashable, record: Any, generation: Optional[int]) -> None:
+        """Store a record, evicting the least recently used record if the cache is full
+
+        :param key: Unique identifier of the record
+        :param record: Record to store
+        :param generation: Generation returned by :meth:`generation` before the record was read
+                           from the database. If the generation has changed since then the record
+                           may be out of date and is not stored.
+        """
+        if not self.capacity:
+            return
+        with self._lock:
+            if generation is None or generation != self._generation:
+                return
+            self._entries[key] = record
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        """Retrieve a snapshot of the cache usage counters"""
+        with self._lock:
+            return CacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                size=len(self._entries),
+                capacity=self.capacity,
+            )
+
+
+SOURCES = SourceCache(0)
+
+RECORDS = RecordCache(0, 0, lambda: 0)
+
+
+def configure_records(
+    capacity: int, interval: float, generation: Callable[[], int]
+) -> None:
+    """Configure the database record cache for the current process
+
+    :param capacity: Maximum number of records to cache
+    :param interval: Minimum number of seconds between reads of the generation counter
+    :param generation: Callable that returns the current value of the generation counter
+    """
+    global RECORDS  # pylint: disable=global-statement
+
+    logging.getLogger(__name__).debug(
+        f"Configuring record cache with capacity of {capacity} records"
+    )
+    RECORDS = RecordCache(capacity, interval, generation)
+
+
+def configure(source_capacity: int) -> None:
+    """Configure the caches for the current process
+
+    :param source_capacity: Maximum number of bytes of decoded source image data to cache
+    """
+    global SOURCES  # pylint: disable=global-statement
+
+    if source_capacity != SOURCES.capacity:
+        logging.getLogger(__name__).debug(
+            f"Configuring source image cache with capacity of {source_capacity} bytes"
+        )
+        SOURCES = SourceCache(source_capacity)
@@ -6,6 +6,8 @@ from kodak import __about__
 from kodak import configuration
 from kodak import database
 from kodak import index
+from kodak import warm
+from kodak import watch
 
 
 def get_args() -> argparse.Namespace:
@@ -27,6 +29,33 @@ def get_args() -> argparse.Namespace:
     parser.add_argument(
         "--index", action="store_true", help="Rebuild the source image index"
     )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Watch the source directory and keep the source image index up to date",
+    )
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Pre-generate every image manip that has not been generated yet",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes to render manips with when warming",
+    )
+    parser.add_argument(
+        "--image",
+        metavar="GLOB",
+        default="*",
+        help="Only warm manips of images with names matching a glob pattern",
+    )
+    parser.add_argument(
+        "--manip",
+        metavar="NAME",
+        action="append",
+        help="Only warm the named manip; may be given multiple times",
+    )
 
     return parser.parse_args()
 
@@ -62,6 +91,27 @@ def main() -> int:
         index.build(config)
         return 0
 
+    if args.watch:
+        config = configuration.load()
+        database.initialize(config)
+        try:
+            watch.watch(config)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.warm:
+        config = configuration.load()
+        unknown = set(args.manip or []) - set(config.manips.keys())
+        if unknown:
+            print(f"Unknown manips: {', '.join(sorted(unknown))}", file=sys.stderr)
+            return 1
+        if args.workers is not None:
+            config.render.workers = args.workers
+        database.initialize(config)
+        _, failed = warm.warm(config, args.image, args.manip)
+        return 1 if failed else 0
+
     if args.server:
         from kodak import application  # pylint: disable=import-outside-toplevel
 
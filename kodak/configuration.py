@@ -1,4 +1,5 @@
 import enum
+import hashlib
 import json
 import os
 from dataclasses import dataclass
@@ -76,6 +77,13 @@ class DatabaseMariaConfig:
     :param password: Password for the account to use for connecting to the database server
     :param port: Port on the host that the database server is listening on
     :param schema: Database schema that the application should use
+    :param max_connections: Maximum number of connections each process may hold open at once.
+                            Set to zero to allow any number of connections.
+    :param stale_timeout: Number of seconds after which an idle connection is closed rather than
+                          reused. This should be less than the server's ``wait_timeout``.
+    :param pool_timeout: Number of seconds to wait for a connection to become available when
+                         ``max_connections`` connections are already in use
+    :param pre_ping: Whether to check that a pooled connection is still alive before reusing it
     """
 
     hostname: str = "localhost"
@@ -83,6 +91,10 @@ class DatabaseMariaConfig:
     password: Optional[str] = None
     port: int = 3306
     schema: str = "kodak"
+    max_connections: int = 16
+    stale_timeout: float = 300.0
+    pool_timeout: float = 10.0
+    pre_ping: bool = True
 
     @classmethod
     def from_env(cls):
@@ -93,6 +105,16 @@ class DatabaseMariaConfig:
             password=os.environ.get("KODAK_DATABASE_MARIADB_PASSWORD", cls.password),
             port=_get_int("KODAK_DATABASE_MARIADB_PORT", cls.port),
             schema=os.getenv("KODAK_DATABASE_MARIADB_SCHEMA", cls.schema),
+            max_connections=_get_int(
+                "KODAK_DATABASE_MARIADB_MAX_CONNECTIONS", cls.max_connections
+            ),
+            stale_timeout=_get_float(
+                "KODAK_DATABASE_MARIADB_STALE_TIMEOUT", cls.stale_timeout
+            ),
+            pool_timeout=_get_float(
+                "KODAK_DATABASE_MARIADB_POOL_TIMEOUT", cls.pool_timeout
+            ),
+            pre_ping=_get_bool("KODAK_DATABASE_MARIADB_PRE_PING", cls.pre_ping),
         )
 
 
@@ -103,11 +125,17 @@ class DatabaseConfig:
     :param backend: Enum selecting the backend to use for storing data
     :param sqlite: Container of SQLite settings
     :param mariadb: Container of MariaDB settings
+    :param cache_size: Maximum number of image and manip records each process caches in memory.
+                       Set to zero to disable the cache.
+    :param cache_interval: Number of seconds that a cached record may be out of date by; changes
+                           made by an index build are seen by every process within this time
     """
 
     backend: constants.DatabaseBackend = constants.DatabaseBackend.SQLITE
     sqlite: DatabaseSqliteConfig = field(default_factory=DatabaseSqliteConfig.from_env)
     mariadb: DatabaseMariaConfig = field(default_factory=DatabaseMariaConfig.from_env)
+    cache_size: int = 10000
+    cache_interval: float = 1.0
 
     @classmethod
     def from_env(cls):
@@ -115,7 +143,11 @@ class DatabaseConfig:
         return cls(
             backend=_get_enum_by_name(
                 "KODAK_DATABASE_BACKEND", constants.DatabaseBackend, cls.backend
-            )
+            ),
+            cache_size=_get_int("KODAK_DATABASE_CACHE_SIZE", cls.cache_size),
+            cache_interval=_get_float(
+                "KODAK_DATABASE_CACHE_INTERVAL", cls.cache_interval
+            ),
         )
 
 
@@ -186,6 +218,88 @@ class ManipScaleConfig:
         )
 
 
+@dataclass
+class ManipJpegConfig:
+    """Settings for encoding an image in JPEG format
+
+    :param quality: Encoder quality setting, on a scale from 1 (worst) to 95 (best)
+    :param progressive: Whether to encode the image as a progressive JPEG
+    :param optimize: Whether to make an extra pass over the image to select optimal encoder
+                     settings
+    :param subsampling: Chroma subsampling mode to use. If ``None`` then the encoder default is
+                        used.
+    """
+
+    quality: int = 75
+    progressive: bool = False
+    optimize: bool = False
+    subsampling: Optional[constants.ChromaSubsampling] = None
+
+    @classmethod
+    def from_env(cls, key: str):
+        """Build dataclass from environment"""
+        return cls(
+            quality=_get_int(f"KODAK_MANIP_{key}_JPEG_QUALITY", cls.quality),
+            progressive=_get_bool(
+                f"KODAK_MANIP_{key}_JPEG_PROGRESSIVE", cls.progressive
+            ),
+            optimize=_get_bool(f"KODAK_MANIP_{key}_JPEG_OPTIMIZE", cls.optimize),
+            subsampling=_get_enum_by_value(  # type: ignore
+                f"KODAK_MANIP_{key}_JPEG_SUBSAMPLING",
+                constants.ChromaSubsampling,
+                cls.subsampling,  # type: ignore
+            ),
+        )
+
+
+@dataclass
+class ManipPngConfig:
+    """Settings for encoding an image in PNG format
+
+    :param compress_level: ZLIB compression level, on a scale from 0 (no compression) to 9 (best
+                           compression)
+    :param optimize: Whether to make an extra pass over the image to select the smallest possible
+                     encoding. This overrides ``compress_level``.
+    """
+
+    compress_level: int = 6
+    optimize: bool = False
+
+    @classmethod
+    def from_env(cls, key: str):
+        """Build dataclass from environment"""
+        return cls(
+            compress_level=_get_int(
+                f"KODAK_MANIP_{key}_PNG_COMPRESS_LEVEL", cls.compress_level
+            ),
+            optimize=_get_bool(f"KODAK_MANIP_{key}_PNG_OPTIMIZE", cls.optimize),
+        )
+
+
+@dataclass
+class ManipWebpConfig:
+    """Settings for encoding an image in WEBP format
+
+    :param quality: Encoder quality setting, on a scale from 0 (worst) to 100 (best). When
+                    ``lossless`` is enabled this instead controls the encoder effort.
+    :param lossless: Whether to use lossless compression
+    :param method: Encoder speed/size tradeoff, on a scale from 0 (fastest) to 6 (smallest)
+    """
+
+    quality: int = 80
+    lossless: bool = False
+    method: int = 4
+
+    @classmethod
+    def from_env(cls, key: str):
+        """Build dataclass from environment"""
+        return cls(
+            quality=_get_int(f"KODAK_MANIP_{key}_WEBP_QUALITY", cls.quality),
+            lossless=_get_bool(f"KODAK_MANIP_{key}_WEBP_LOSSLESS", cls.lossless),
+            method=_get_int(f"KODAK_MANIP_{key}_WEBP_METHOD", cls.method),
+        )
+
+
 @dataclass
 class ManipConfig:
     """Image manipulation configuration settings
@@ -195,6 +309,14 @@ class ManipConfig:
     :param scale: Container of settings for scaling an image
     :param formats: Set of image formats that the source can be dynamically converted into
     :param black_and_white: Whether the image should be converted to black and white
+    :param brightness: Percentage of the full brightness range to brighten (positive) or darken
+                       (negative) the image by, from -100 to 100
+    :param contrast: Percentage to increase (positive) or decrease (negative) the contrast of the
+                     image by, from -100 to 100
+    :param sepia: Whether the image should be converted to sepia tone
+    :param jpeg: Container of settings for encoding the image in JPEG format
+    :param png: Container of settings for encoding the image in PNG format
+    :param webp: Container of settings for encoding the image in WEBP format
     """
 
     name: str
@@ -204,22 +326,31 @@ class ManipConfig:
         default_factory=lambda: constants.DEFAULT_SUPPORTED_FORMATS
     )
     black_and_white: bool = False
-
-    # TODO: Implement support for these settings
-    # brightness: int = 0
-    # contrast: int = 0
-    # sepia: bool = False
+    brightness: int = 0
+    contrast: int = 0
+    sepia: bool = False
+    jpeg: ManipJpegConfig = field(default_factory=ManipJpegConfig)
+    png: ManipPngConfig = field(default_factory=ManipPngConfig)
+    webp: ManipWebpConfig = field(default_factory=ManipWebpConfig)
 
     @classmethod
     def from_env(cls, key: str):
         """Build dataclass from environment"""
         name = os.getenv(f"KODAK_MANIP_{key}_NAME", key.lower())
 
-        if name == "original":
+        if name == constants.SOURCE_LINK_NAME:
             raise exceptions.ConfigurationError(
-                "Manipulation name 'original' is reserved for application usage"
+                f"Manipulation name '{constants.SOURCE_LINK_NAME}' is reserved for application usage"
             )
 
+        brightness = _get_int(f"KODAK_MANIP_{key}_BRIGHTNESS", cls.brightness)
+        contrast = _get_int(f"KODAK_MANIP_{key}_CONTRAST", cls.contrast)
+        for setting, value in (("brightness", brightness), ("contrast", contrast)):
+            if not -100 <= value <= 100:
+                raise exceptions.ConfigurationError(
+                    f"Manipulation {setting} must be between -100 and 100, got {value}"
+                )
+
         return cls(
             name=name,
             crop=ManipCropConfig.from_env(key),
@@ -233,6 +364,120 @@ class ManipConfig:
             black_and_white=_get_bool(
                 f"KODAK_MANIP_{key}_BLACK_AND_WHITE", cls.black_and_white
             ),
+            brightness=brightness,
+            contrast=contrast,
+            sepia=_get_bool(f"KODAK_MANIP_{key}_SEPIA", cls.sepia),
+            jpeg=ManipJpegConfig.from_env(key),
+            png=ManipPngConfig.from_env(key),
+            webp=ManipWebpConfig.from_env(key),
+        )
+
+
+@dataclass
+class RenderConfig:
+    """Render engine configuration settings
+
+    :param workers: Maximum number of renders that can run at once across every process sharing
+                    the content directory. Each process serving requests has its own pool of up
+                    to this many worker processes, each with its own source cache, so memory use
+                    grows with the number of serving processes. On Python 3.7 and 3.8 every
+                    worker process of a pool is started by its first render. Set to zero to
+                    render images in the requesting process instead.
+    :param queue_size: Maximum number of renders that can be queued or in progress at once across
+                       every process sharing the content directory
+    :param timeout: Number of seconds to wait for a render to be queued, started, and completed
+                    before giving up on it. A render that is given up on keeps running in the
+                    background until it completes.
+    :param source_cache_size: Maximum number of bytes of decoded source images that each worker
+                              process should keep in memory for reuse by later renders. Set to
+                              zero to disable the cache.
+    :param pixel_budget: Maximum total number of source image pixels that may be decoded at once
+                         across every process sharing the content directory. Renders that would
+                         exceed the budget wait for it to free up, for up to ``timeout`` seconds.
+                         Each decoded pixel takes up to four bytes of memory. Set to zero to
+                         disable admission control.
+    :param max_pixels: Maximum number of pixels a source image may have to be rendered. Source
+                       images are checked against this before they are dispatched to the render
+                       workers, where Pillow's own decompression bomb check is disabled. Pillow's
+                       check still applies when the image is checked, so this can only lower
+                       Pillow's limit. Set to zero to apply only Pillow's limit.
+    """
+
+    workers: int = os.cpu_count() or 1
+    queue_size: int = 64
+    timeout: float = 60.0
+    source_cache_size: int = 0
+    pixel_budget: int = 0
+    max_pixels: int = constants.DEFAULT_MAX_IMAGE_PIXELS
+
+    @classmethod
+    def from_env(cls):
+        """Build dataclass from environment"""
+        return cls(
+            workers=_get_int("KODAK_RENDER_WORKERS", cls.workers),
+            queue_size=_get_int("KODAK_RENDER_QUEUE_SIZE", cls.queue_size),
+            timeout=_get_float("KODAK_RENDER_TIMEOUT", cls.timeout),
+            source_cache_size=_get_int(
+                "KODAK_RENDER_SOURCE_CACHE_SIZE", cls.source_cache_size
+            ),
+            pixel_budget=_get_int("KODAK_RENDER_PIXEL_BUDGET", cls.pixel_budget),
+            max_pixels=_get_int("KODAK_RENDER_MAX_PIXELS", cls.max_pixels),
+        )
+
+
+@dataclass
+class IndexConfig:
+    """Source image index configuration settings
+
+    :param workers: Number of threads to checksum source image files with
+    :param max_in_flight: Maximum total size, in bytes, of the files queued to be checksummed at
+                          once
+    :param batch_size: Number of new image records to save to the database at a time
+    :param checksum: Name of the hashlib algorithm to checksum source image files with. Existing
+                     records checksummed with a different algorithm are checksummed again by the
+                     next index build.
+    :param watch_debounce: Number of seconds the source directory must be quiet for before
+                           changes are applied to the index when watching it
+    :param watch_max_delay: Maximum number of seconds to delay applying changes to the index when
+                            watching the source directory, even if it is not quiet
+    :param watch_reconcile_interval: Number of seconds between full rebuilds of the index when
+                                     watching the source directory. Set to zero to only rebuild
+                                     the index when changes may have been missed.
+    """
+
+    workers: int = min(32, (os.cpu_count() or 1) + 4)
+    max_in_flight: int = 512 * 1024 * 1024
+    batch_size: int = 1000
+    checksum: str = "sha256"
+    watch_debounce: float = 1.0
+    watch_max_delay: float = 30.0
+    watch_reconcile_interval: float = 3600.0
+
+    @classmethod
+    def from_env(cls):
+        """Build dataclass from environment"""
+        checksum = os.getenv("KODAK_INDEX_CHECKSUM", cls.checksum).lower()
+        if checksum not in hashlib.algorithms_available:
+            raise exceptions.ConfigurationError(
+                f"Checksum algorithm '{checksum}' is not supported; must be one of {', '.join(sorted(hashlib.algorithms_available))}"
+            )
+        if hashlib.new(checksum).digest_size == 0:
+            raise exceptions.ConfigurationError(
+                f"Checksum algorithm '{checksum}' has a variable length digest and cannot be used"
+            )
+
+        return cls(
+            workers=_get_int("KODAK_INDEX_WORKERS", cls.workers),
+            max_in_flight=_get_int("KODAK_INDEX_MAX_IN_FLIGHT", cls.max_in_flight),
+            batch_size=_get_int("KODAK_INDEX_BATCH_SIZE", cls.batch_size),
+            checksum=checksum,
+            watch_debounce=_get_float("KODAK_INDEX_WATCH_DEBOUNCE", cls.watch_debounce),
+            watch_max_delay=_get_float(
+                "KODAK_INDEX_WATCH_MAX_DELAY", cls.watch_max_delay
+            ),
+            watch_reconcile_interval=_get_float(
+                "KODAK_INDEX_WATCH_RECONCILE_INTERVAL", cls.watch_reconcile_interval
+            ),
         )
 
 
@@ -241,6 +486,8 @@ class KodakConfig:
     """Global application configuration settings
 
     :param database: Container of database backend settings
+    :param render: Container of render engine settings
+    :param index: Container of source image index settings
     :param manips: Mapping of manipulation config names to image manipulation configurations
     :param source_dir: Path to where source images should be loaded from
     :param content_dir: Path to where the application should store generated images
@@ -249,6 +496,8 @@ class KodakConfig:
     """
 
     database: DatabaseConfig = field(default_factory=DatabaseConfig.from_env)
+    render: RenderConfig = field(default_factory=RenderConfig.from_env)
+    index: IndexConfig = field(default_factory=IndexConfig.from_env)
     manips: Dict[str, ManipConfig] = field(default_factory=dict)
     source_dir: Path = Path.cwd() / "pictures"
     content_dir: Path = Path.cwd() / "content"
@@ -2,6 +2,7 @@ import enum
 from typing import Any
 from typing import Dict
 from typing import Set
+from typing import Tuple
 
 import peewee
 
@@ -25,7 +26,7 @@ class CropAnchor(enum.Enum):
 
     TL = "top-left"
     TC = "top-center"
-    TR = "top-center"
+    TR = "top-right"
     CL = "center-left"
     C = "center"
     CR = "center-right"
@@ -39,6 +40,20 @@ class ImageFormat(enum.Enum):
 
     JPEG = ("jpg", "jpeg")
     PNG = ("png",)
+    WEBP = ("webp",)
+
+    @property
+    def mimetype(self) -> str:
+        """MIME type of the image format"""
+        return f"image/{self.name.lower()}"
+
+
+class ChromaSubsampling(enum.Enum):
+    """Chroma subsampling modes for JPEG encoding"""
+
+    NONE = "4:4:4"
+    HALF = "4:2:2"
+    QUARTER = "4:2:0"
 
 
 DEFAULT_SQLITE_PRAGMAS: Dict[str, Any] = {
@@ -51,8 +66,65 @@ DEFAULT_SQLITE_PRAGMAS: Dict[str, Any] = {
 
 SQLITE_VARIABLE_LIMIT = 999
 
+# Bytes of ``max_allowed_packet`` left unused by bulk statements, to allow for the packet header
+# and for values that grow when they are escaped
+MARIADB_PACKET_HEADROOM = 64 * 1024
+
+# Maximum number of records updated by a single bulk update statement. Each record adds an arm to
+# a ``CASE`` expression that the database evaluates linearly for every updated row, so the cost
+# of a statement grows with the square of its size.
+BULK_UPDATE_BATCH_SIZE = 200
+
 DEFAULT_SUPPORTED_FORMATS: Set[ImageFormat] = {ImageFormat.JPEG, ImageFormat.PNG}
 
+# Order of preference for formats that a client only accepts via a wildcard (such as ``image/*``).
+# These are ordered by client compatibility rather than size, since a wildcard does not guarantee
+# that the client can actually decode every image format.
+WILDCARD_FORMAT_PREFERENCE: Tuple[ImageFormat, ...] = (
+    ImageFormat.JPEG,
+    ImageFormat.PNG,
+    ImageFormat.WEBP,
+)
+
+EXIF_ORIENTATION_TAG: int = 0x0112
+
+RESAMPLE_REDUCING_GAP: float = 2.0
+
+# Multipliers applied to the red, green, and blue channels of a luminance value to produce a sepia
+# tone. These are the row sums of the commonly used sepia color matrix.
+SEPIA_TONE: Tuple[float, float, float] = (1.351, 1.203, 0.937)
+
+# Names of hashlib algorithms in the IANA HTTP Digest Algorithm registry, used by the
+# Content-Digest header. See https://www.iana.org/assignments/http-digest-hash-alg/
+DIGEST_ALGORITHM_NAMES: Dict[str, str] = {
+    "sha256": "sha-256",
+    "sha512": "sha-512",
+    "sha1": "sha",
+    "md5": "md5",
+}
+
+LOCK_DIRECTORY_NAME: str = ".kodak"
+
+# Name of the link to an image's source file in the image's content directory, which is also
+# reserved as a manip name
+SOURCE_LINK_NAME: str = "original"
+
+LOCK_POLL_INTERVAL: float = 0.05
+
+ADMISSION_POLL_INTERVAL: float = 0.1
+
+# Minimum number of seconds between updates to the shared index build progress
+INDEX_STATUS_INTERVAL: float = 1.0
+
+# Number of seconds to wait before retrying a failed background index build, doubling after each
+# failure up to the maximum
+INDEX_RETRY_INTERVAL: float = 5.0
+INDEX_RETRY_MAX_INTERVAL: float = 300.0
+
+# Pillow refuses to open images larger than twice its ``MAX_IMAGE_PIXELS`` default; the same
+# threshold is used as the default hard cap on source image size
+DEFAULT_MAX_IMAGE_PIXELS: int = 2 * 89478485
+
 IMAGE_PATH_NAME_SEPARATOR: str = "-"
 
 IMAGE_FILE_EXTENSIONS: Set[str] = set()
@@ -1,67 +1,263 @@
 import logging
+import sqlite3
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import List
+from typing import Optional
 from typing import Sequence
 from typing import Tuple
 from typing import Type
+from typing import TypeVar
 
 import peewee
+from playhouse import migrate
+from playhouse import pool
 
+from kodak import cache
 from kodak import constants
 from kodak import exceptions
 from kodak.configuration import KodakConfig
 from kodak.database._shared import Checksum
+from kodak.database._shared import Fingerprint
 from kodak.database._shared import INTERFACE as interface
 from kodak.database._shared import KodakModel
 from kodak.database.access import AccessRecord
+from kodak.database.generation import GenerationRecord
 from kodak.database.image import ImageRecord
 from kodak.database.manip import ManipRecord
 
 
-MODELS: Tuple[Type[KodakModel], ...] = (ImageRecord, ManipRecord, AccessRecord)
+MODELS: Tuple[Type[KodakModel], ...] = (
+    ImageRecord,
+    ManipRecord,
+    AccessRecord,
+    GenerationRecord,
+)
 
+T = TypeVar("T")
 
-def calc_batch_size(
-    backend: constants.DatabaseBackend, models: Sequence[KodakModel]
-) -> int:
-    """Determine the batch size that should be used when performing queries
 
-    This is intended to work around the query variable limit in SQLite. Critically this is a
-    limit to the number of _variables_, not _records_ that can be referenced in a single query.
+class Batcher:
+    """Split bulk writes into the fewest statements that the database will accept
 
-    The "correct" way to calculate this is to iterate over the model list and tally the number of
-    changed fields, then add one for the table name, and each time you reach the
-    ``SQLITE_VARIABLE_LIMIT`` (which is a known constant) cut a new batch until all the models are
-    processed. This is very complicated because peewee doesn't provide a simple way to reliably
-    identify changed fields.
-
-    The naive way to calculate this (i.e. the way this function does it) is to determine the
-    maximum number of variables that _could be_ used to modify a record and use that as the
-    constant batch limiter. The theoretical maximum number of variables associated with a single
-    record is equal to the number of fields on that record, plus 1 (for the table name). This gives
-    the batch size (i.e. number of records that can be modified in a single query) as:
+    SQLite limits the number of variables that can be bound to a single statement and MariaDB
+    limits the size of a single statement (``max_allowed_packet``), so a bulk write of many
+    records has to be split across several statements. Rather than assuming the worst case for
+    every record, the number of variables that a statement binds per record is counted by
+    compiling it for one and for two records, and each batch is grown until adding another record
+    would exceed a limit. When the size of a statement is limited, the size of each record is
+    estimated from every value that the statement binds for it, by compiling the statement for
+    that record alone. Bulk updates are additionally capped at
+    :data:`constants.BULK_UPDATE_BATCH_SIZE` records per statement, since the ``CASE`` expression
+    they are built from gets quadratically slower to evaluate as it grows.
 
     ::
 
-      999 / (len(fields) + 1)
+      batcher = Batcher.from_database(interface.obj)
+      batcher.bulk_create(ImageRecord, records)
+
+    :param variables: Maximum number of variables that can be bound to a single statement. If
+                      ``None`` then the number of variables is not limited.
+    :param packet: Maximum size, in bytes, of a single statement including its bound values. If
+                   ``None`` then the size of a statement is not limited.
+    """
+
+    def __init__(self, variables: Optional[int] = None, packet: Optional[int] = None):
+        self.variables = variables
+        self.packet = packet
+
+    @classmethod
+    def from_database(cls, database: peewee.Database):
+        """Build a batcher using the limits of a connected database
+
+        :param database: Initialized database that the statements will be executed against
+        """
+        if isinstance(database, peewee.SqliteDatabase):
+            return cls(variables=_sqlite_variable_limit(database))
+        packet = database.execute_sql("SELECT @@max_allowed_packet").fetchone()[0]
+        return cls(packet=int(packet) - constants.MARIADB_PACKET_HEADROOM)
+
+    def batches(
+        self,
+        statement: Callable[[Sequence[T]], peewee.Query],
+        items: Sequence[T],
+        size: Optional[int] = None,
+    ) -> Iterator[Sequence[T]]:
+        """Split items into batches that each fit in a single statement
+
+        :param statement: Function building the statement that will be executed for a batch
+        :param items: Items to split into batches
+        :param size: Maximum number of items in a batch. If ``None`` then batches are only limited
+                     by the limits of the database.
+        :returns: Iterator of batches of the items, in order
+        """
+        if len(items) < 2:
+            if items:
+                yield items
+            return
+
+        single, single_params = statement(items[:1]).sql()
+        double, double_params = statement(items[:2]).sql()
+        item_variables = len(double_params) - len(single_params)
+        item_length = len(double) - len(single)
+        base_variables = len(single_params) - item_variables
+        base_length = len(single) - item_length
+
+        batch: List[T] = []
+        variables = base_variables
+        length = base_length
+        for item in items:
+            item_size = (
+                item_length + _params_size(statement([item]).sql()[1])
+                if self.packet
+                else 0
+            )
+            if batch and (
+                (size and len(batch) >= size)
+                or (self.variables and variables + item_variables > self.variables)
+                or (self.packet and length + item_size > self.packet)
+            ):
+                yield batch
+                batch = []
+                variables = base_variables
+                length = base_length
+            batch.append(item)
+            variables += item_variables
+            length += item_size
+
+        yield batch
+
+    def bulk_create(
+        self, model: Type[KodakModel], records: Sequence[KodakModel]
+    ) -> None:
+        """Insert records using as few statements as possible
+
+        This is equivalent to :meth:`peewee.Model.bulk_create`. As with that method, the primary
+        keys of the inserted records are not populated.
+
+        :param model: Model of the records to insert
+        :param records: Records to insert
+        """
+        # pylint: disable=protected-access
+        fields = [
+            field
+            for field in model._meta.sorted_fields
+            if not (model._meta.auto_increment and field is model._meta.primary_key)
+        ]
+
+        def statement(batch: Sequence[KodakModel]) -> peewee.Query:
+            return model.insert_many(
+                [
+                    [getattr(record, _attr(field)) for field in fields]
+                    for record in batch
+                ],
+                fields=fields,
+            )
 
-    Where ``fields`` is an array of the fields that could be written on the record.
+        for batch in self.batches(statement, records):
+            statement(batch).execute()
 
-    .. note:: This function (pretty safely) assumes that all the records in ``models`` are of the
-              same model type; i.e. they all relate to the same table. This is a pretty safe
-              assumption since there's no way to do multi-table updates in a single query while
-              using sane SQL practices.
+    def bulk_update(
+        self,
+        model: Type[KodakModel],
+        records: Sequence[KodakModel],
+        fields: Sequence[peewee.Field],
+    ) -> int:
+        """Update fields of records using as few statements as possible
 
-    .. note:: This function just returns ``len(models)`` if the backend is anything other than
-              ``SQLITE``. This is because the limitation this works around is only applicable to
-              SQLite so on other platforms we can just make the batch size as large as possible.
+        This is equivalent to :meth:`peewee.Model.bulk_update`. At most
+        :data:`constants.BULK_UPDATE_BATCH_SIZE` records are updated by each statement.
 
-    :param backend: Backend being used by the application
-    :param models: Sequence of models that need to be batched
-    :returns: Number of models that can be processed in a single batch
+        :param model: Model of the records to update
+        :param records: Records to update
+        :param fields: Fields to update on each record
+        :returns: Number of rows updated
+        """
+        primary_key = model._meta.primary_key  # pylint: disable=protected-access
+
+        def statement(batch: Sequence[KodakModel]) -> peewee.Query:
+            return model.update(
+                {
+                    field: peewee.Case(
+                        primary_key,
+                        [
+                            (
+                                primary_key.to_value(record._pk),
+                                field.to_value(getattr(record, _attr(field))),
+                            )
+                            for record in batch
+                        ],
+                    )
+                    for field in fields
+                }
+            ).where(primary_key.in_([record._pk for record in batch]))
+
+        return sum(
+            statement(batch).execute()
+            for batch in self.batches(
+                statement, records, size=constants.BULK_UPDATE_BATCH_SIZE
+            )
+        )
+
+
+def _attr(field: peewee.Field) -> str:
+    return (
+        field.object_id_name
+        if isinstance(field, peewee.ForeignKeyField)
+        else field.name
+    )
+
+
+def _params_size(params: Sequence[Any]) -> int:
+    """Estimate the size, in bytes, of bound values once they are quoted into a statement
+
+    Values that are bound regardless of the batch are counted for every item, which errs on the
+    side of smaller batches.
     """
-    # oof, the ratio of lines-of-docstring to lines-of-code in this function is 35:3
-    if models and backend == constants.DatabaseBackend.SQLITE:
-        return int(constants.SQLITE_VARIABLE_LIMIT / (len(models[0].fields) + 1))
-    return len(models)
+    size = 0
+    for value in params:
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        # Allow for the quotes around the value and the separator after it
+        size += len(value) + 3
+    return size
+
+
+def _sqlite_variable_limit(database: peewee.SqliteDatabase) -> int:
+    """Determine the maximum number of variables that can be bound to a SQLite statement
+
+    :param database: Initialized SQLite database
+    :returns: Variable limit of the connection, falling back to the limit the SQLite library was
+              compiled with
+    """
+    connection = database.connection()
+    if hasattr(connection, "getlimit"):
+        return connection.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+
+    for (option,) in database.execute_sql("PRAGMA compile_options"):
+        if option.startswith("MAX_VARIABLE_NUMBER="):
+            return int(option.partition("=")[2])
+
+    # The default limit was raised from 999 in SQLite 3.32.0
+    if sqlite3.sqlite_version_info >= (3, 32, 0):
+        return 32766
+    return constants.SQLITE_VARIABLE_LIMIT
+
+
+class _PooledMySQLDatabase(pool.PooledMySQLDatabase):
+    """Pooled MySQL database that can skip checking connections before reusing them
+
+    :param pre_ping: Whether to ping pooled connections before handing them out
+    """
+
+    def __init__(self, *args, pre_ping: bool = True, **kwargs):
+        self.pre_ping = pre_ping
+        super().__init__(*args, **kwargs)
+
+    def _is_closed(self, conn) -> bool:
+        return super()._is_closed(conn) if self.pre_ping else False
 
 
 def initialize(config: KodakConfig):
@@ -71,6 +267,10 @@ def initialize(config: KodakConfig):
     `unconfigured proxy object <http://docs.peewee-orm.com/en/latest/peewee/database.html#setting-the-database-at-run-time>`_
     allows it to be configured at runtime based on the config values.
 
+    Connections are pooled: closing a connection returns it to the pool to be reused by the next
+    caller, so callers should open a connection for each unit of work (such as a request) and
+    close it afterwards rather than holding one open indefinitely.
+
     :param config: Populated configuration container object
     """
 
@@ -79,8 +279,12 @@ def initialize(config: KodakConfig):
     if config.database.backend == constants.DatabaseBackend.SQLITE:
         logger.debug("Using SQLite database backend")
         logger.debug(f"Applying SQLite pragmas: {config.database.sqlite.pragmas}")
-        database = peewee.SqliteDatabase(
-            config.database.sqlite.path, pragmas=config.database.sqlite.pragmas
+        database: peewee.Database = pool.PooledSqliteDatabase(
+            config.database.sqlite.path,
+            pragmas=config.database.sqlite.pragmas,
+            max_connections=None,
+            # Pooled connections are handed to whichever thread checks them out next
+            check_same_thread=False,
         )
     elif config.database.backend == constants.DatabaseBackend.MARIADB:
         logger.debug("Using MariaDB database backend")
@@ -89,13 +293,17 @@ def initialize(config: KodakConfig):
             f" {config.database.mariadb.username}@{config.database.mariadb.hostname}:{config.database.mariadb.port},"
             f" with database '{config.database.mariadb.schema}'"
         )
-        database = peewee.MySQLDatabase(
+        database = _PooledMySQLDatabase(
             config.database.mariadb.schema,
             host=config.database.mariadb.hostname,
             port=config.database.mariadb.port,
             user=config.database.mariadb.username,
             password=config.database.mariadb.password,
             charset="utf8mb4",
+            max_connections=config.database.mariadb.max_connections or None,
+            stale_timeout=config.database.mariadb.stale_timeout,
+            timeout=config.database.mariadb.pool_timeout,
+            pre_ping=config.database.mariadb.pre_ping,
         )
     else:
         raise exceptions.ConfigurationError(
@@ -105,4 +313,138 @@ def initialize(config: KodakConfig):
     interface.initialize(database)
 
     with interface.atomic():
-        interface.create_tables(MODELS)
+        # Indexes on existing tables are created by the migration, after any rows that would
+        # violate them have been removed
+        tables = set(database.get_tables())
+        interface.create_tables(
+            [
+                model
+                for model in MODELS
+                if model._meta.table_name  # pylint: disable=protected-access
+                not in tables
+            ]
+        )
+        _migrate(database, config.content_dir)
+
+    cache.configure_records(
+        config.database.cache_size,
+        config.database.cache_interval,
+        GenerationRecord.current,
+    )
+
+
+def _migrate(database: peewee.Database, content_dir: Path) -> None:
+    """Apply schema changes to tables created by earlier versions of the application
+
+    ``create_tables`` only creates tables that do not exist yet, so columns and indexes added to
+    an existing model have to be added to existing tables explicitly. Before a unique index is
+    added, rows that would violate it are removed (see :func:`_deduplicate`). Indexes added by
+    another process migrating the database at the same time are tolerated. Partial indexes (see
+    :meth:`KodakModel.partial_indexes`) are only added on SQLite, since MariaDB does not support
+    them.
+
+    :param database: Initialized database to migrate
+    :param content_dir: Content directory that rendered manips are stored in
+    """
+    logger = logging.getLogger(__name__)
+
+    if isinstance(database, peewee.SqliteDatabase):
+        migrator: migrate.SchemaMigrator = migrate.SqliteMigrator(database)
+    else:
+        migrator = migrate.MySQLMigrator(database)
+
+    operations = []
+    for model in MODELS:
+        table = model._meta.table_name  # pylint: disable=protected-access
+        columns = {column.name for column in database.get_columns(table)}
+        for field in model._meta.sorted_fields:  # pylint: disable=protected-access
+            if field.column_name not in columns:
+                if not field.null:
+                    raise RuntimeError(
+                        f"Cannot add required column '{field.column_name}' to existing table '{table}'"
+                    )
+                logger.info(f"Adding column '{field.column_name}' to table '{table}'")
+                operations.append(migrator.add_column(table, field.column_name, field))
+
+    if operations:
+        migrate.migrate(*operations)
+
+    # Peewee does not expose index metadata publicly
+    # pylint: disable=protected-access
+    for model in MODELS:
+        table = model._meta.table_name
+        indexes = {index.name for index in database.get_indexes(table)}
+        expected = model._meta.fields_to_index()
+        if isinstance(database, peewee.SqliteDatabase):
+            expected += model.partial_indexes()
+        for index in expected:
+            if index._name in indexes:
+                continue
+            if index._unique:
+                _deduplicate(model, index._expressions, content_dir)
+            logger.info(f"Adding index '{index._name}' to table '{table}'")
+            try:
+                database.execute(index.safe(database.safe_create_index))
+            except peewee.DatabaseError:
+                # Several processes migrate the database when they start, and not every backend
+                # supports "IF NOT EXISTS", so another process may have just added the index
+                if index._name not in {
+                    item.name for item in database.get_indexes(table)
+                }:
+                    raise
+                logger.debug(f"Index '{index._name}' was added by another process")
+
+
+def _deduplicate(
+    model: Type[KodakModel], fields: Sequence[peewee.Field], content_dir: Path
+) -> None:
+    """Remove rows that share values for a set of fields, keeping one row of each set
+
+    The oldest row of each set is kept, except that rows that are not marked as deleted are kept
+    in preference to rows that are, so that a live image is not hidden behind a deleted one. Rows
+    of other models that reference a removed row are removed too. Manips of a removed image are
+    stored under the same name as the manips of the image that is kept, so their files are removed
+    along with every record that points at them, to be rendered again from the kept image.
+
+    :param model: Model of the table to remove rows from
+    :param fields: Fields that should be unique together
+    :param content_dir: Content directory that rendered manips are stored in
+    """
+    logger = logging.getLogger(__name__)
+
+    # pylint: disable=protected-access
+    order = [model.deleted, model.id] if "deleted" in model._meta.fields else [model.id]
+    duplicates = (
+        model.select(*fields)
+        .group_by(*fields)
+        .having(peewee.fn.COUNT(model.id) > 1)
+        .tuples()
+    )
+    for values in list(duplicates):
+        ids = [
+            item.id
+            for item in model.select(model.id)
+            .where(*[field == value for field, value in zip(fields, values)])
+            .order_by(*order)
+        ]
+        logger.warning(
+            f"Removing {len(ids) - 1} duplicate rows with {', '.join(field.name for field in fields)} of {values} from model {model.__name__}"
+        )
+        for reference in model._meta.backrefs:
+            if reference.model is ManipRecord:
+                files = {
+                    item.file
+                    for item in ManipRecord.select(ManipRecord.file).where(
+                        reference.in_(ids[1:])
+                    )
+                }
+                for file in files:
+                    logger.info(
+                        f"Removing manip {content_dir / file} of a removed duplicate row"
+                    )
+                    (content_dir / file).unlink(missing_ok=True)
+                ManipRecord.delete().where(
+                    reference == ids[0], ManipRecord.file.in_(list(files))
+                ).execute()
+            reference.model.delete().where(reference.in_(ids[1:])).execute()
+        model.delete().where(model.id.in_(ids[1:])).execute()
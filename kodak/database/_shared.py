@@ -2,17 +2,21 @@ import datetime
 import enum
 import hashlib
 import logging
+import os
 import typing
 import uuid
 from pathlib import Path
-from typing import Callable
 from typing import Dict
+from typing import List
 from typing import NamedTuple
+from typing import Optional
 from typing import Type
 from typing import Union
 
 import peewee
 
+from kodak import constants
+
 if typing.TYPE_CHECKING:
     import _hashlib
 
@@ -36,17 +40,26 @@ class Checksum(NamedTuple):
         return cls(algorithm=data.name, digest=data.hexdigest())
 
     @classmethod
-    def from_path(cls, path: Union[str, Path], constructor: Callable = hashlib.sha256):
+    def from_path(
+        cls,
+        path: Union[str, Path],
+        algorithm: str = "sha256",
+        buffer_size: int = 1024 * 1024,
+    ):
         """Construct from a file path, generating the hash of the file
 
         .. note:: This method attempts to _efficiently_ compute a hash of large image files. The
                   hashing code was adapted from here:
 
                   https://stackoverflow.com/a/44873382/5361209
+
+        :param path: Path to the file to hash
+        :param algorithm: Name of the hashlib algorithm to hash the file with
+        :param buffer_size: Number of bytes of the file to read and hash at a time
         """
 
-        hasher = constructor()
-        view = memoryview(bytearray(1024 * 1024))
+        hasher = hashlib.new(algorithm)
+        view = memoryview(bytearray(buffer_size))
         with Path(path).open("rb", buffering=0) as infile:
             for chunk in iter(lambda: infile.readinto(view), 0):  # type: ignore
                 hasher.update(view[:chunk])
@@ -58,17 +71,45 @@ class Checksum(NamedTuple):
         return cls.from_hash(hasher)
 
     def as_header(self) -> str:
-        """Format the checksum for the Content-Digest HTTP header"""
-        if self.algorithm.startswith("sha"):
-            alg = f"sha-{self.algorithm[3:]}"
-        elif self.algorithm.startswith("id"):
-            alg = f"id-sha-{self.algorithm[3:]}"
-        else:
-            alg = self.algorithm
+        """Format the checksum for the Content-Digest HTTP header
 
+        Algorithms with an entry in the IANA HTTP Digest Algorithm registry use the registered
+        name; any other algorithm uses its hashlib name, with underscores replaced by hyphens so
+        that it is a valid header key.
+        """
+        alg = constants.DIGEST_ALGORITHM_NAMES.get(
+            self.algorithm, self.algorithm.replace("_", "-")
+        )
         return f"{alg}={self.digest}"
 
 
+class Fingerprint(NamedTuple):
+    """File stat fingerprint container
+
+    A change to the fingerprint of a file indicates that its contents may have changed, without
+    having to read the file. The inverse is not guaranteed, but is reliable enough in practice to
+    decide whether a file needs to be checksummed again.
+
+    :param size: Size of the file in bytes
+    :param mtime_ns: Modification time of the file in nanoseconds
+    :param inode: Inode number of the file
+    """
+
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def from_stat(cls, stat: os.stat_result):
+        """Construct from the result of a stat call"""
+        return cls(size=stat.st_size, mtime_ns=stat.st_mtime_ns, inode=stat.st_ino)
+
+    @classmethod
+    def from_path(cls, path: Union[str, Path]):
+        """Construct from a file path, following symlinks"""
+        return cls.from_stat(os.stat(path))
+
+
 class EnumField(peewee.CharField):
     """Custom field for storing enums"""
 
@@ -138,6 +179,23 @@ class ChecksumField(peewee.CharField):
         return Checksum(algorithm=alg, digest=digest)
 
 
+class FingerprintField(peewee.CharField):
+    """Field for storing file stat fingerprints in the database"""
+
+    def db_value(self, value: Optional[Fingerprint]) -> Optional[str]:
+        """Serialize the fingerprint to a database string"""
+        if value is None:
+            return None
+        return super().db_value(f"{value.size}:{value.mtime_ns}:{value.inode}")
+
+    def python_value(self, value: Optional[str]) -> Optional[Fingerprint]:
+        """Deserialize a string to a fingerprint container"""
+        if value is None:
+            return None
+        size, mtime_ns, inode = super().python_value(value).split(":")
+        return Fingerprint(size=int(size), mtime_ns=int(mtime_ns), inode=int(inode))
+
+
 class KodakModel(peewee.Model):
     """Base model for defining common fields and attaching database"""
 
@@ -147,6 +205,11 @@ class KodakModel(peewee.Model):
     uuid = peewee.UUIDField(null=False, unique=True, default=uuid.uuid4)
     created = peewee.DateTimeField(null=False, default=datetime.datetime.utcnow)
 
+    @classmethod
+    def partial_indexes(cls) -> List[peewee.ModelIndex]:
+        """Indexes with a condition, which are only created on backends that support them"""
+        return []
+
     @classmethod
     @property
     def fields(cls) -> Dict[str, peewee.Field]:
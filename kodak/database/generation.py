@@ -0,0 +1,28 @@
+import peewee
+
+from kodak.database._shared import INTERFACE
+from kodak.database._shared import KodakModel
+
+
+class GenerationRecord(KodakModel):
+    """Model for a counter that is incremented whenever the index is changed
+
+    Processes cache records read from the database (see :class:`cache.RecordCache`) and discard
+    their cache whenever the counter changes.
+    """
+
+    value = peewee.IntegerField(null=False, default=0)
+
+    @classmethod
+    def current(cls) -> int:
+        """Read the current value of the counter"""
+        with INTERFACE.atomic():
+            record = cls.select(cls.value).order_by(cls.id).first()
+        return record.value if record else 0
+
+    @classmethod
+    def bump(cls) -> None:
+        """Increment the counter"""
+        with INTERFACE.atomic():
+            if not cls.update(value=cls.value + 1).execute():
+                cls.create(value=1)
@@ -1,14 +1,19 @@
 import logging
 import os
 from pathlib import Path
+from typing import List
 
 import peewee
 
+from kodak import cache
 from kodak import configuration
 from kodak import constants
 from kodak.database._shared import Checksum
 from kodak.database._shared import ChecksumField
 from kodak.database._shared import EnumField
+from kodak.database._shared import Fingerprint
+from kodak.database._shared import FingerprintField
+from kodak.database._shared import INTERFACE
 from kodak.database._shared import KodakModel
 from kodak.database._shared import PathField
 
@@ -16,11 +21,56 @@ from kodak.database._shared import PathField
 class ImageRecord(KodakModel):
     """Model for source images"""
 
-    name = peewee.CharField(null=False)
-    source = PathField(null=False)
+    name = peewee.CharField(null=False, unique=True)
+    source = PathField(null=False, index=True)
     format_ = EnumField(constants.ImageFormat, null=False)
     deleted = peewee.BooleanField(null=False, default=False)
     checksum = ChecksumField(null=False)
+    fingerprint = FingerprintField(null=True)
+
+    @classmethod
+    def partial_indexes(cls) -> List[peewee.ModelIndex]:
+        """Index the records of source images that have not been deleted
+
+        Index builds iterate over every image that has not been deleted in primary key order, so
+        this lets them skip over deleted images without visiting them.
+        """
+        return [
+            cls.index(
+                cls.id, name="imagerecord_id_live", where=peewee.SQL('"deleted" = 0')
+            )
+        ]
+
+    @classmethod
+    def from_name(cls, name: str):
+        """Retrieve an image record by name, using the record cache if possible
+
+        See :class:`cache.RecordCache` for details
+
+        :param name: Name of the image
+        :raises peewee.DoesNotExist: When there is no image with the name
+        :returns: The image record
+        """
+        key = (cls.__name__, name)
+        generation = cache.RECORDS.generation()
+        record = cache.RECORDS.get(key)
+        if record is None:
+            with INTERFACE.atomic():
+                record = cls.get(cls.name == name)
+            cache.RECORDS.put(key, record, generation)
+        return record
+
+    @staticmethod
+    def make_name(config: configuration.KodakConfig, path: Path) -> str:
+        """Determine the name of the image for a source file
+
+        :param config: Populated application configuration object
+        :param path: Full path to the image file
+        :returns: Name that the image is exposed with
+        """
+        return str(path.relative_to(config.source_dir)).replace(
+            os.sep, constants.IMAGE_PATH_NAME_SEPARATOR
+        )[: -len(path.suffix)]
 
     @classmethod
     def from_path(cls, config: configuration.KodakConfig, path: Path):
@@ -45,9 +95,7 @@ class ImageRecord(KodakModel):
         else:
             raise RuntimeError
 
-        name = str(path.relative_to(config.source_dir)).replace(
-            os.sep, constants.IMAGE_PATH_NAME_SEPARATOR
-        )[: -len(extension)]
+        name = cls.make_name(config, path)
 
         logger.debug(f"Determined image name of file {path} to be '{name}'")
 
@@ -55,7 +103,10 @@ class ImageRecord(KodakModel):
             name=name,
             source=path.relative_to(config.source_dir),
             format_=format_,
-            checksum=Checksum.from_path(path),
+            # Fingerprint the file before checksumming it so that a modification made while the
+            # checksum is being calculated is picked up by the next index build
+            fingerprint=Fingerprint.from_path(path),
+            checksum=Checksum.from_path(path, config.index.checksum),
         )
 
     def create_link(self, config: configuration.KodakConfig) -> Path:
@@ -67,7 +118,7 @@ class ImageRecord(KodakModel):
         logger = logging.getLogger(__name__)
 
         Path(config.content_dir, self.name).mkdir(exist_ok=True)
-        link = Path(config.content_dir, self.name, "original")
+        link = Path(config.content_dir, self.name, constants.SOURCE_LINK_NAME)
         try:
             link.symlink_to(config.source_dir / self.source)
             logger.debug(
@@ -83,6 +134,6 @@ class ImageRecord(KodakModel):
         :param config: Populated application configuration object
         """
         logger = logging.getLogger(__name__)
-        link = Path(config.content_dir, self.name, "original")
+        link = Path(config.content_dir, self.name, constants.SOURCE_LINK_NAME)
         link.unlink(missing_ok=True)
         logger.debug(f"Removed link from {config.source_dir / self.source} to {link}")
@@ -1,15 +1,24 @@
+import contextlib
 import logging
+import time
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
 
 import peewee
-import PIL.Image
-import PIL.ImageOps
 
+from kodak import admission
+from kodak import cache
 from kodak import configuration
 from kodak import constants
-from kodak import manipulations
+from kodak import engine
+from kodak import locking
 from kodak.database._shared import Checksum
 from kodak.database._shared import ChecksumField
 from kodak.database._shared import EnumField
+from kodak.database._shared import INTERFACE
 from kodak.database._shared import KodakModel
 from kodak.database._shared import PathField
 from kodak.database.image import ImageRecord
@@ -18,6 +27,9 @@ from kodak.database.image import ImageRecord
 class ManipRecord(KodakModel):
     """Model for manipulated image records"""
 
+    class Meta:  # pylint: disable=too-few-public-methods,missing-class-docstring
+        indexes = ((("parent", "name", "format_"), True),)
+
     parent = peewee.ForeignKeyField(ImageRecord, null=False)
     name = peewee.CharField(null=False)
     file = PathField(null=False)
@@ -35,38 +47,228 @@ class ManipRecord(KodakModel):
         """Construct an image manip record
 
         :param parent: Parent image record that should be manipulated
-        :param config: Populated manipulation configuration object
+        :param config: Populated application configuration object
+        :param manip: Manipulation configuration to apply to the parent image
         :param format_: Image format that the manipulation should be saved in
-        :returns: Saved image manipulation record
+        :returns: Unsaved image manipulation record
+        """
+        return cls.from_parent_many(parent, config, [(manip, format_)])[0]
+
+    @classmethod
+    def from_parent_many(
+        cls,
+        parent: ImageRecord,
+        config: configuration.KodakConfig,
+        variants: Sequence[Tuple[configuration.ManipConfig, constants.ImageFormat]],
+        deadline: Optional[float] = None,
+    ):
+        """Construct several image manip records from a single decode of the parent image
+
+        :param parent: Parent image record that should be manipulated
+        :param config: Populated application configuration object
+        :param variants: Sequence of manipulation configurations and the image format that each
+                         should be saved in
+        :param deadline: Time, as returned by :func:`time.monotonic`, by which the render should
+                         have completed. Defaults to the configured render timeout from now.
+        :returns: List of unsaved image manipulation records, in the same order as ``variants``
         """
         logger = logging.getLogger(__name__)
 
         logger.info(
-            f"Constructing manip '{manip.name}' from source file {config.source_dir / parent.source}"
+            f"Constructing manips {', '.join(sorted(set(manip.name for manip, _ in variants)))} from source file {config.source_dir / parent.source}"
         )
 
-        filepath = (
-            config.content_dir / parent.name / f"{manip.name}.{format_.name.lower()}"
+        outputs = [
+            engine.Variant(
+                manip=manip,
+                format_=format_,
+                destination=config.content_dir
+                / parent.name
+                / f"{manip.name}.{format_.name.lower()}",
+            )
+            for manip, format_ in variants
+        ]
+
+        source = config.source_dir / parent.source
+        renderer = engine.get(config)
+        pixels = admission.estimate(
+            source, [manip for manip, _ in variants], config.render.max_pixels
         )
 
-        with PIL.Image.open(config.source_dir / parent.source) as image:
-            image = PIL.ImageOps.exif_transpose(image)
-            if manip.scale.horizontal is not None or manip.scale.vertical is not None:
-                image = manipulations.scale(image, manip)
+        with admission.PixelBudget.from_config(config).admit(pixels):
+            checksums = renderer.render(
+                source,
+                outputs,
+                key=(
+                    str(parent.uuid),
+                    parent.checksum.algorithm,
+                    parent.checksum.digest,
+                ),
+                deadline=deadline,
+            )
 
-            if manip.crop.horizontal is not None or manip.crop.vertical is not None:
-                image = manipulations.crop(image, manip)
+        return [
+            cls(
+                parent=parent,
+                name=output.manip.name,
+                file=output.destination.relative_to(config.content_dir),
+                checksum=Checksum(*checksum),
+                format_=output.format_,
+            )
+            for output, checksum in zip(outputs, checksums)
+        ]
 
-            if manip.black_and_white:
-                image = manipulations.black_and_white(image, manip)
+    def insert_or_get(self):
+        """Save a new record, or retrieve the existing record if one was saved concurrently
 
-            image.save(filepath, format_.name)
-        logger.debug(f"Saved manipulated image at {filepath} in {format_.name} format")
+        :returns: The saved record for this record's parent, name, and format
+        """
+        try:
+            with INTERFACE.atomic():
+                self.save(force_insert=True)
+            return self
+        except peewee.IntegrityError:
+            logging.getLogger(__name__).debug(
+                f"Manip {self.name} ({self.format_.name}) of image {self.parent.name} was saved concurrently"
+            )
+            return self.get(
+                ManipRecord.parent == self.parent,
+                ManipRecord.name == self.name,
+                ManipRecord.format_ == self.format_,
+            )
 
-        return cls(
-            parent=parent,
-            name=manip.name,
-            file=filepath.relative_to(config.content_dir),
-            checksum=Checksum.from_path(filepath),
-            format_=format_,
-        )
+    @classmethod
+    def get_or_render(
+        cls,
+        parent: ImageRecord,
+        config: configuration.KodakConfig,
+        manip: configuration.ManipConfig,
+        format_: constants.ImageFormat,
+    ):
+        """Retrieve an image manip record, rendering and saving it if it does not exist yet
+
+        See :meth:`get_or_render_many` for details
+
+        :param parent: Parent image record that should be manipulated
+        :param config: Populated application configuration object
+        :param manip: Manipulation configuration to apply to the parent image
+        :param format_: Image format that the manipulation should be saved in
+        :returns: Saved image manipulation record
+        """
+        return cls.get_or_render_many(parent, config, [(manip, format_)])[0]
+
+    @classmethod
+    def get_or_render_many(
+        cls,
+        parent: ImageRecord,
+        config: configuration.KodakConfig,
+        variants: Sequence[Tuple[configuration.ManipConfig, constants.ImageFormat]],
+        on_render: Optional[Callable[[int], None]] = None,
+    ):
+        """Retrieve image manip records, rendering and saving any that do not exist yet
+
+        Concurrent requests for the same missing manip are coalesced across all processes sharing
+        the content directory: the first caller renders the manip while every other caller waits
+        for the render to finish and then returns the record the first caller saved. Every
+        missing manip is rendered from a single decode of the parent image. Records that have
+        been returned before are served from the record cache (see :class:`cache.RecordCache`).
+
+        No transaction or database connection is held open while rendering: existing records are
+        read in one short query, the connection is returned to the pool, the missing manips are
+        rendered, and the new records are then inserted. If a record was inserted by another
+        caller in the meantime (for example, one that does not share the content directory) then
+        the unique constraint on the parent, name, and format rejects the duplicate and the
+        existing record is returned instead.
+
+        .. warning:: This must not be called inside of an open transaction, otherwise callers
+                     waiting on the render may not see the record saved by the rendering caller.
+
+        :param parent: Parent image record that should be manipulated
+        :param config: Populated application configuration object
+        :param variants: Sequence of manipulation configurations and the image format that each
+                         should be saved in
+        :param on_render: Callable that is passed the number of manips rendered by this call,
+                          excluding those that were found to have been rendered by another
+                          caller. It is only called if this call renders any manips.
+        :raises exceptions.LockTimeoutError: When another caller's render of the same manip did
+                                             not complete within the render timeout
+        :returns: List of saved image manipulation records, in the same order as ``variants``
+        """
+
+        def _existing() -> Dict[Tuple[str, constants.ImageFormat], ManipRecord]:
+            with INTERFACE.atomic():
+                query = cls.select().where(
+                    cls.parent == parent,
+                    cls.name.in_(list(set(manip.name for manip, _ in variants))),
+                )
+                return {(item.name, item.format_): item for item in query}
+
+        def _release() -> None:
+            # Return the connection to the pool while waiting on a render so that slow renders do
+            # not hold connections that other requests could use. The database reconnects when
+            # it is next used.
+            if not INTERFACE.is_closed():
+                INTERFACE.close()
+
+        keys = [
+            (cls.__name__, parent.id, manip.name, format_)
+            for manip, format_ in variants
+        ]
+        generation = cache.RECORDS.generation()
+        cached = [cache.RECORDS.get(key) for key in keys]
+        if all(record is not None for record in cached):
+            return cached
+
+        existing = _existing()
+        missing = [
+            (manip, format_)
+            for manip, format_ in variants
+            if (manip.name, format_) not in existing
+        ]
+
+        if missing:
+            _release()
+            # Waiting for other callers' renders and rendering share one deadline, however many
+            # manips are locked
+            deadline = time.monotonic() + config.render.timeout
+            with contextlib.ExitStack() as stack:
+                for path in sorted(
+                    set(
+                        locking.lock_path(
+                            config.content_dir, parent.name, manip.name, format_.name
+                        )
+                        for manip, format_ in missing
+                    )
+                ):
+                    stack.enter_context(
+                        locking.FileLock(
+                            path,
+                            timeout=max(deadline - time.monotonic(), 0),
+                            transient=True,
+                        )
+                    )
+
+                existing = _existing()
+                missing = [
+                    (manip, format_)
+                    for manip, format_ in missing
+                    if (manip.name, format_) not in existing
+                ]
+
+                if missing:
+                    _release()
+                    for record in cls.from_parent_many(
+                        parent, config, missing, deadline=deadline
+                    ):
+                        existing[(record.name, record.format_)] = record.insert_or_get()
+                    if on_render is not None:
+                        on_render(len(missing))
+                else:
+                    logging.getLogger(__name__).debug(
+                        f"Manips of {parent.name} were rendered by another worker"
+                    )
+
+        records = [existing[(manip.name, format_)] for manip, format_ in variants]
+        for key, record in zip(keys, records):
+            cache.RECORDS.put(key, record, generation)
+        return records
@@ -0,0 +1,488 @@
+"""Image render engine
+
+Rendering an image manipulation is CPU bound work that can take several seconds for large source
+images. Rather than running it in whichever thread happens to be handling the request, renders
+are dispatched to a pool of worker processes. The number of renders that run at once and the
+number that can be queued are bounded across every process sharing the content directory (see
+:class:`locking.Semaphore`), so render capacity does not grow with the number of HTTP workers.
+Each render is given a single deadline so that a pathological image cannot tie up a request
+indefinitely.
+
+::
+
+  from kodak import engine
+
+  engine.get(config).render(source, [engine.Variant(manip, format_, destination)])
+"""
+import concurrent.futures
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any
+from typing import BinaryIO
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import PIL.Image
+import PIL.ImageOps
+
+from kodak import cache
+from kodak import configuration
+from kodak import constants
+from kodak import exceptions
+from kodak import locking
+from kodak import manipulations
+
+if typing.TYPE_CHECKING:
+    import _hashlib
+
+
+class Variant(NamedTuple):
+    """Single output of a render
+
+    :param manip: Manipulation configuration to apply to the source image
+    :param format_: Image format that the manipulation should be saved in
+    :param destination: Path to the file the manipulated image should be written to
+    """
+
+    manip: configuration.ManipConfig
+    format_: constants.ImageFormat
+    destination: Path
+
+
+class _HashingWriter:
+    """Write-only file wrapper that hashes data as it is written through it
+
+    .. note:: This intentionally does not expose ``fileno()`` so that Pillow encoders write
+              through :meth:`write` rather than directly to the underlying file descriptor.
+    """
+
+    def __init__(self, outfile: BinaryIO, hasher: "_hashlib.HASH"):
+        self._outfile = outfile
+        self._hasher = hasher
+
+    def write(self, data: bytes) -> int:
+        """Hash the data and write it to the underlying file"""
+        self._hasher.update(data)
+        return self._outfile.write(data)
+
+    def flush(self) -> None:
+        """Flush the underlying file"""
+        self._outfile.flush()
+
+
+def encoder_options(
+    manip: configuration.ManipConfig, format_: constants.ImageFormat
+) -> Dict[str, Any]:
+    """Build the encoder parameters for saving a manipulation in a given format
+
+    :param manip: Manipulation configuration that defines the encoder settings
+    :param format_: Image format that the manipulation will be saved in
+    :returns: Keyword arguments to pass to :meth:`PIL.Image.Image.save`
+    """
+    if format_ == constants.ImageFormat.JPEG:
+        options: Dict[str, Any] = {
+            "quality": manip.jpeg.quality,
+            "progressive": manip.jpeg.progressive,
+            "optimize": manip.jpeg.optimize,
+        }
+        if manip.jpeg.subsampling is not None:
+            options["subsampling"] = manip.jpeg.subsampling.value
+        return options
+    if format_ == constants.ImageFormat.PNG:
+        return {
+            "compress_level": manip.png.compress_level,
+            "optimize": manip.png.optimize,
+        }
+    if format_ == constants.ImageFormat.WEBP:
+        return {
+            "quality": manip.webp.quality,
+            "lossless": manip.webp.lossless,
+            "method": manip.webp.method,
+        }
+    return {}
+
+
+# Permissions of rendered files, set from the file mode creation mask of the process by
+# :func:`initialize`
+_FILE_MODE = 0o644
+
+
+def encode(
+    image: PIL.Image.Image,
+    destination: Path,
+    format_: constants.ImageFormat,
+    options: Optional[Dict[str, Any]] = None,
+    mode: int = 0o644,
+) -> Tuple[str, str]:
+    """Encode an image to a file, hashing the encoded data as it is written
+
+    The image is encoded to a temporary file in the destination directory which is then atomically
+    renamed into place, so readers never see a partially written file and concurrent writers of
+    the same file cannot interleave their output.
+
+    :param image: Image to encode
+    :param destination: Path the encoded image should be written to
+    :param format_: Image format to encode the image in
+    :param options: Encoder parameters (see :func:`encoder_options`)
+    :param mode: Permissions to give the file
+    :returns: Tuple of the hashing algorithm name and hex digest of the encoded file
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    hasher = hashlib.sha256()
+
+    descriptor, temp = tempfile.mkstemp(
+        dir=destination.parent, prefix=f".{destination.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(descriptor, "wb") as outfile:
+            image.save(_HashingWriter(outfile, hasher), format_.name, **(options or {}))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        # Temporary files are created private to the user
+        os.chmod(temp, mode)
+        os.replace(temp, destination)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp)
+        raise
+
+    logging.getLogger(__name__).debug(
+        f"Saved manipulated image at {destination} in {format_.name} format ({hasher.name}:{hasher.hexdigest()})"
+    )
+
+    return hasher.name, hasher.hexdigest()
+
+
+def decode(
+    source: Path,
+    manips: Sequence[configuration.ManipConfig],
+    key: Optional[Hashable] = None,
+) -> Tuple[PIL.Image.Image, Tuple[int, int]]:
+    """Decode and orient a source image
+
+    If a cache key is provided then the decoded image is fetched from (or stored in) the process'
+    source image cache (see :data:`cache.SOURCES`).
+
+    :param source: Path to the source image file
+    :param manips: Manipulation configurations that will be applied to the decoded image; the
+                   image may be decoded at reduced resolution if they allow it
+    :param key: Unique identifier of the source file contents to cache the decoded image under
+    :returns: Tuple of the decoded image and the width and height of the full resolution image
+    """
+    if key is not None and cache.SOURCES.capacity > 0:
+        entry = cache.SOURCES.get(
+            key, lambda size: manipulations.draft_size(size, *manips) or size
+        )
+        logging.getLogger(__name__).debug(
+            f"Source image cache {'hit' if entry else 'miss'} for {source}: {cache.SOURCES.stats()}"
+        )
+        if entry is not None:
+            return entry.image, entry.size
+
+    with PIL.Image.open(source) as image:
+        size = manipulations.draft(image, *manips)
+        image = PIL.ImageOps.exif_transpose(image)
+
+    if key is not None and cache.SOURCES.capacity > 0:
+        cache.SOURCES.put(key, image, size)
+
+    return image, size
+
+
+def render(
+    source: Path, variants: Sequence[Variant], key: Optional[Hashable] = None
+) -> List[Tuple[str, str]]:
+    """Render one or more manipulations of a source image to files
+
+    The source image is decoded and oriented once no matter how many variants are requested.
+    Manipulations are then processed from largest to smallest output, and each one is resampled
+    from the smallest previously produced output that can still satisfy it (see
+    :func:`manipulations.reuse`) rather than from the full source image. Each manipulation is
+    encoded once per requested format using the encoder settings from its configuration.
+
+    .. note:: This is a module level function so that it can be dispatched to worker processes
+
+    :param source: Path to the source image file
+    :param variants: Outputs that should be rendered from the source image
+    :param key: Unique identifier of the source file contents, used to cache the decoded source
+                image between renders
+    :returns: List of the hashing algorithm name and hex digest of each rendered file, in the
+              same order as ``variants``
+    """
+    logger = logging.getLogger(__name__)
+
+    manips: Dict[str, configuration.ManipConfig] = {}
+    outputs: Dict[str, List[Variant]] = {}
+    for variant in variants:
+        manips[variant.manip.name] = variant.manip
+        outputs.setdefault(variant.manip.name, []).append(variant)
+
+    image, size = decode(source, list(manips.values()), key)
+
+    plans = sorted(
+        ((manipulations.plan(size, manip), manip) for manip in manips.values()),
+        key=lambda item: item[0].size[0] * item[0].size[1],
+        reverse=True,
+    )
+
+    intermediates: List[Tuple[manipulations.Geometry, PIL.Image.Image]] = []
+    checksums: Dict[Path, Tuple[str, str]] = {}
+    for geometry, manip in plans:
+        base, base_geometry, base_size = image, geometry, size
+        for candidate_geometry, candidate in intermediates:
+            reused = manipulations.reuse(geometry, candidate_geometry)
+            if reused is not None and (
+                candidate.width * candidate.height < base.width * base.height
+            ):
+                base, base_geometry, base_size = candidate, reused, candidate.size
+
+        if base is not image:
+            logger.debug(
+                f"Deriving manip '{manip.name}' from {base.width}x{base.height} intermediate"
+            )
+
+        output = manipulations.transform(base, base_geometry, base_size)
+        intermediates.append((geometry, output))
+
+        output = manipulations.adjust(output, manip)
+
+        for variant in outputs[manip.name]:
+            checksums[variant.destination] = encode(
+                output,
+                variant.destination,
+                variant.format_,
+                encoder_options(manip, variant.format_),
+                mode=_FILE_MODE,
+            )
+
+    return [checksums[variant.destination] for variant in variants]
+
+
+def initialize(config: configuration.RenderConfig) -> None:
+    """Prepare the current process for rendering images
+
+    Rendered files are given the permissions that the file mode creation mask of the process
+    allows. The mask can only be read by replacing it, so it is read once here, before any
+    renders run, rather than for every file.
+
+    :param config: Render engine configuration settings
+    """
+    global _FILE_MODE  # pylint: disable=global-statement
+
+    umask = os.umask(0o022)
+    os.umask(umask)
+    _FILE_MODE = 0o666 & ~umask
+    cache.configure(config.source_cache_size)
+
+
+def _initialize_worker(config: configuration.RenderConfig) -> None:
+    """Prepare a worker process of the render pool for rendering images
+
+    Pillow's decompression bomb check is disabled in worker processes only, since the size of
+    source images has already been checked by the process that dispatched the render (see
+    :func:`admission.estimate`).
+
+    :param config: Render engine configuration settings
+    """
+    PIL.Image.MAX_IMAGE_PIXELS = None
+    initialize(config)
+
+
+class RenderEngine:
+    """Dispatch image renders to a pool of worker processes
+
+    The process pool is created lazily on the first render. On Python 3.9 and later it starts
+    worker processes as they are needed, but on earlier versions it starts all ``config.workers``
+    of them at once. Every process serving requests has its own pool, so although no more than
+    ``config.workers`` renders run at once across the deployment, each serving process may keep
+    up to that many idle worker processes (and their source caches) in memory. If
+    ``config.workers`` is zero then renders are performed in the calling process instead.
+
+    A render that does not complete before its deadline is abandoned, not stopped: a worker
+    process cannot be interrupted, so the render runs to completion in the background and keeps
+    its slot until it does.
+
+    :param config: Render engine configuration settings
+    :param directory: Content directory that render capacity is shared through
+    """
+
+    def __init__(self, config: configuration.RenderConfig, directory: Path):
+        self.config = config
+        self.pid = os.getpid()
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queue = locking.Semaphore(
+            directory / constants.LOCK_DIRECTORY_NAME / "render-queue",
+            config.queue_size,
+        )
+        self._workers = locking.Semaphore(
+            directory / constants.LOCK_DIRECTORY_NAME / "render-worker", config.workers
+        )
+        if config.workers == 0:
+            initialize(config)
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                logging.getLogger(__name__).debug(
+                    f"Starting render engine with {self.config.workers} worker processes"
+                )
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.config.workers,
+                    initializer=_initialize_worker,
+                    initargs=(self.config,),
+                )
+            return self._executor
+
+    def _reset(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def submit(
+        self,
+        source: Path,
+        variants: Sequence[Variant],
+        key: Optional[Hashable] = None,
+        deadline: Optional[float] = None,
+    ) -> "concurrent.futures.Future[List[Tuple[str, str]]]":
+        """Queue a render without waiting for it to complete
+
+        This waits for a slot in the render queue and then for a free render worker, both shared
+        with every other process using the content directory.
+
+        Parameters are the same as :func:`render`, plus:
+
+        :param deadline: Time, as returned by :func:`time.monotonic`, by which the render should
+                         have started. Defaults to the configured timeout from now.
+        :raises exceptions.RenderQueueFullError: When the render queue did not free up before the
+                                                 deadline
+        :raises exceptions.RenderTimeoutError: When no render worker became free before the
+                                               deadline
+        :returns: Future that resolves to the checksums of the rendered files
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.config.timeout
+
+        queued = self._queue.acquire(timeout=max(deadline - time.monotonic(), 0))
+        if queued is None:
+            raise exceptions.RenderQueueFullError(
+                f"Render queue is full ({self.config.queue_size} renders in progress)"
+            )
+        slots = [queued]
+
+        try:
+            if self.config.workers > 0:
+                worker = self._workers.acquire(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+                if worker is None:
+                    raise exceptions.RenderTimeoutError(
+                        f"Render of {source} did not start within {self.config.timeout} seconds"
+                    )
+                slots.append(worker)
+                future = self._get_executor().submit(render, source, variants, key)
+            else:
+                future = concurrent.futures.Future()
+                try:
+                    future.set_result(render(source, variants, key))
+                except Exception as err:  # pylint: disable=broad-except
+                    future.set_exception(err)
+        except BaseException:
+            for slot in slots:
+                slot.release()
+            raise
+
+        def _release(_) -> None:
+            for slot in slots:
+                slot.release()
+
+        future.add_done_callback(_release)
+
+        return future
+
+    def render(
+        self,
+        source: Path,
+        variants: Sequence[Variant],
+        key: Optional[Hashable] = None,
+        deadline: Optional[float] = None,
+    ) -> List[Tuple[str, str]]:
+        """Render an image and wait for it to complete
+
+        Waiting for the render to be queued, to start, and to complete all count towards the
+        configured timeout. A render that times out is abandoned but keeps running (see
+        :class:`RenderEngine`).
+
+        Parameters are the same as :func:`render`, plus:
+
+        :param deadline: Time, as returned by :func:`time.monotonic`, by which the render should
+                         have completed. Defaults to the configured timeout from now.
+
+        :raises exceptions.RenderQueueFullError: When the render queue did not free up within
+                                                 the configured timeout
+        :raises exceptions.RenderTimeoutError: When the render did not complete within the
+                                               configured timeout
+        :returns: Checksums of the rendered files, as returned from :func:`render`
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.config.timeout
+        future = self.submit(source, variants, key, deadline)
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except concurrent.futures.TimeoutError:
+            raise exceptions.RenderTimeoutError(
+                f"Render of {source} did not complete within {self.config.timeout} seconds"
+            ) from None
+        except BrokenProcessPool:
+            logging.getLogger(__name__).error(
+                "Render engine worker process terminated unexpectedly, restarting worker pool"
+            )
+            self._reset()
+            raise
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the worker processes
+
+        :param wait: Whether to wait for queued renders to complete before returning
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+_ENGINE: Optional[RenderEngine] = None
+
+_ENGINE_LOCK = threading.Lock()
+
+
+def get(config: configuration.KodakConfig) -> RenderEngine:
+    """Retrieve the render engine for the current process, creating it if necessary
+
+    .. note:: The engine is recreated if the current process was forked from the process that
+              created it, since worker pools cannot be shared across a fork.
+
+    :param config: Populated application configuration object
+    :returns: Render engine for the current process
+    """
+    global _ENGINE  # pylint: disable=global-statement
+
+    with _ENGINE_LOCK:
+        if _ENGINE is None or _ENGINE.pid != os.getpid():
+            _ENGINE = RenderEngine(config.render, config.content_dir)
+        return _ENGINE
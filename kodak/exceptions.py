@@ -29,6 +29,12 @@ class ImageResourceDeletedError(ClientError):
     status = 410
 
 
+class UnacceptableFormatError(ClientError):
+    """Requested image format is not supported by the server"""
+
+    status = 422
+
+
 class IAmATeapotError(ClientError):
     """User tried to brew coffee, but application is a teapot"""
 
@@ -47,3 +53,53 @@ class ImageFileRemovedError(ServerError):
 
 class ConfigurationError(ServerError):
     """Failed to load the application configuration"""
+
+
+class RenderQueueFullError(ServerError):
+    """Render engine is at capacity and cannot accept more work"""
+
+    status = 503
+
+
+class RenderTimeoutError(ServerError):
+    """Render did not complete within the allowed time"""
+
+    status = 504
+
+
+class ImageTooLargeError(ClientError):
+    """Source image exceeds the maximum allowed size"""
+
+    status = 422
+
+
+class RenderAdmissionError(ServerError):
+    """Not enough render capacity is available to admit the render
+
+    :param retry_after: Number of seconds the client should wait before retrying the request
+    """
+
+    status = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DatabaseBusyError(ServerError):
+    """No database connection became available to serve the request
+
+    :param retry_after: Number of seconds the client should wait before retrying the request
+    """
+
+    status = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LockTimeoutError(ServerError):
+    """Timed out waiting for another process to release a shared resource"""
+
+    status = 503
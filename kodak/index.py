@@ -1,61 +1,490 @@
+import concurrent.futures
+import contextlib
+import datetime
+import functools
+import json
 import logging
+import os
 import shutil
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+from typing import TypeVar
+
+import peewee
 
 from kodak import configuration
 from kodak import constants
 from kodak import database
+from kodak import locking
 
 
-def identify(config: configuration.KodakConfig) -> List[database.ImageRecord]:
-    """Identify source images that will be made available
+T = TypeVar("T")
+
+_STARTED = datetime.datetime.utcnow()
+
+
+@dataclass
+class IndexStatus:
+    """Progress of the index build
+
+    :param building: Whether an index build is currently running
+    :param phase: Name of the step the running build is on
+    :param processed: Number of files processed by the current step of the running build
+    :param started: Time the most recent build started
+    :param completed: Time the most recent successful build completed
+    :param error: Error that caused the most recent build to fail, if it failed
+    """
+
+    building: bool = False
+    phase: Optional[str] = None
+    processed: int = 0
+    started: Optional[datetime.datetime] = None
+    completed: Optional[datetime.datetime] = None
+    error: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        """Deserialize the status from the output of :meth:`as_dict`"""
+        return cls(
+            building=data["building"],
+            phase=data["phase"],
+            processed=data["processed"],
+            started=datetime.datetime.fromisoformat(data["started"])
+            if data["started"]
+            else None,
+            completed=datetime.datetime.fromisoformat(data["completed"])
+            if data["completed"]
+            else None,
+            error=data["error"],
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Serialize the status to JSON-friendly types"""
+        return {
+            "building": self.building,
+            "phase": self.phase,
+            "processed": self.processed,
+            "started": self.started.isoformat() if self.started else None,
+            "completed": self.completed.isoformat() if self.completed else None,
+            "error": self.error,
+        }
+
+
+class StatusFile:
+    """Index build status shared between every process using a content directory
+
+    Only one process builds the index at a time (see :func:`leader`); that process publishes its
+    progress here so that every other process can report it.
+
+    :param directory: Content directory that the status is shared through
+    """
+
+    def __init__(self, directory: Path):
+        self.path = directory / constants.LOCK_DIRECTORY_NAME / "index.json"
+
+    def read(self) -> IndexStatus:
+        """Read the most recently published status
+
+        :returns: The published status, or an empty status if no build has been started
+        """
+        try:
+            with self.path.open() as infile:
+                content = json.load(infile)
+            pid = content["pid"]
+            status = IndexStatus.from_dict(content["status"])
+        except FileNotFoundError:
+            return IndexStatus()
+        except (ValueError, TypeError, KeyError) as err:
+            logging.getLogger(__name__).warning(
+                f"Discarding unreadable index status {self.path}: {err}"
+            )
+            return IndexStatus()
+
+        if status.building:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                status.building = False
+                status.phase = None
+                status.error = f"Index build in process {pid} exited before completing"
+            except PermissionError:
+                pass
+
+        return status
+
+    def write(self, status: IndexStatus) -> None:
+        """Publish a status
+
+        :param status: Status of the index build running in the current process
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with temp.open("w") as outfile:
+            json.dump({"pid": os.getpid(), "status": status.as_dict()}, outfile)
+        os.replace(temp, self.path)
+
+
+def leader(config: configuration.KodakConfig) -> locking.FileLock:
+    """Create the lock that must be held to modify the index
 
     :param config: Populated application configuration object
-    :returns: List of (unsaved) database models representing identified source image files
-    """
-
-    def _identify(path: Path) -> List[Path]:
-        identified = []
-        for item in path.iterdir():
-            if item.is_file() and item.suffix in constants.IMAGE_FILE_EXTENSIONS:
-                logger.debug(f"Including file {item}")
-                identified.append(item.resolve())
-            elif item.is_dir():
-                logger.debug(f"Entering subdirectory {item}")
-                identified += _identify(item)
-            else:
-                logger.debug(f"Skipping {item}")
-        return identified
+    :returns: Lock shared by every process using the content directory
+    """
+    return locking.FileLock(
+        config.content_dir / constants.LOCK_DIRECTORY_NAME / "index.lock"
+    )
+
+
+def status(config: configuration.KodakConfig) -> IndexStatus:
+    """Retrieve the status of the index build
+
+    :param config: Populated application configuration object
+    :returns: Status of the most recent build by any process using the content directory
+    """
+    return StatusFile(config.content_dir).read()
+
+
+def hash_files(
+    config: configuration.KodakConfig,
+    func: Callable[[Path], T],
+    paths: Iterable[Path],
+) -> Iterator[T]:
+    """Process files on a pool of threads, yielding the results as they complete
+
+    This is intended for checksumming files: hashlib releases the GIL while hashing large buffers,
+    so several files can be read and hashed at once. The total size of the files that have been
+    submitted to the pool but not yet processed is kept under ``config.index.max_in_flight`` so
+    that a long list of paths does not queue up an unbounded amount of work.
+
+    .. note:: Results are yielded in the order they complete, not the order of ``paths``
+
+    :param config: Populated application configuration object
+    :param func: Function to call with each path
+    :param paths: Paths of the files to process
+    :returns: Iterator of the results of ``func``
+    """
+    pending: Dict["concurrent.futures.Future[T]", int] = {}
+    in_flight = 0
+
+    def _collect(
+        return_when: str,
+    ) -> List["concurrent.futures.Future[T]"]:
+        nonlocal in_flight
+        done, _ = concurrent.futures.wait(pending, return_when=return_when)
+        for future in done:
+            in_flight -= pending.pop(future)
+        return list(done)
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=config.index.workers
+    ) as executor:
+        for path in paths:
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                size = 0
+
+            # A file larger than the limit is still processed, just on its own
+            while pending and (
+                in_flight + size > config.index.max_in_flight
+                or len(pending) >= config.index.workers * 2
+            ):
+                for future in _collect(concurrent.futures.FIRST_COMPLETED):
+                    yield future.result()
+
+            pending[executor.submit(func, path)] = size
+            in_flight += size
+
+        for future in _collect(concurrent.futures.ALL_COMPLETED):
+            yield future.result()
+
+
+def walk(path: Path) -> Iterator[Path]:
+    """Iterate over the image files in a directory tree
+
+    The tree is walked iteratively with :func:`os.scandir` so that neither the recursion depth nor
+    the memory used depends on the size of the tree. Symbolic links are followed, but each linked
+    directory is only entered once so that a link cycle cannot cause an infinite walk.
+
+    :param path: Root directory to walk
+    :returns: Iterator of the paths of the image files in the tree, in no particular order
+    """
+    logger = logging.getLogger(__name__)
+
+    root = path.stat()
+    visited: Set[Tuple[int, int]] = {(root.st_dev, root.st_ino)}
+    directories = [str(path)]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if entry.is_symlink():
+                            stat = entry.stat()
+                            if (stat.st_dev, stat.st_ino) in visited:
+                                logger.debug(f"Skipping visited directory {entry.path}")
+                                continue
+                            visited.add((stat.st_dev, stat.st_ino))
+                        logger.debug(f"Entering subdirectory {entry.path}")
+                        directories.append(entry.path)
+                    elif (
+                        entry.is_file()
+                        and os.path.splitext(entry.name)[1]
+                        in constants.IMAGE_FILE_EXTENSIONS
+                    ):
+                        yield Path(entry.path)
+                    else:
+                        logger.debug(f"Skipping {entry.path}")
+        except OSError as err:
+            logger.warning(f"Failed to read directory {directory}: {err}")
+
+
+def paginate(query: peewee.ModelSelect, size: int) -> Iterator[peewee.Model]:
+    """Iterate over the results of a query in pages
+
+    Rows are fetched a page at a time ordered by primary key, so only one page of results is held
+    in memory and no transaction is held open between pages.
+
+    :param query: Query of a single model to iterate over; must select the ``id`` field
+    :param size: Number of rows to fetch per page
+    :returns: Iterator of the query results
+    """
+    model = query.model
+    last = 0
+    while True:
+        with database.interface.atomic():
+            page = list(
+                query.where(model.id > last).order_by(model.id).limit(size).iterator()
+            )
+        yield from page
+        if len(page) < size:
+            return
+        last = page[-1].id
+
 
+def identify(config: configuration.KodakConfig) -> Iterator[database.ImageRecord]:
+    """Identify source images that will be made available
+
+    The source directory is walked lazily (see :func:`walk`) and each batch of files found is
+    compared against the index with queries on the image sources and names, and new source images
+    are checksummed in parallel (see :func:`hash_files`), so records are produced as the walk
+    progresses. Only the names of the new files found by this build are kept in memory, so memory
+    use grows with the number of new files rather than with the size of the index. The first
+    build of a library finds every file as new, however.
+
+    A new file whose image name is already used by an image that has not been deleted is skipped.
+    A new file whose image name was used by an image that has since been deleted takes over that
+    image's record instead, so the name becomes available again.
+
+    :param config: Populated application configuration object
+    :returns: Iterator of (unsaved) database models representing identified source image files.
+              Models that take over the record of a deleted image have its ``id`` set (see
+              :func:`save`).
+    """
     logger = logging.getLogger(__name__)
 
     logger.info(
         f"Identifying image files with extensions {', '.join(constants.IMAGE_FILE_EXTENSIONS)} under {config.source_dir}"
     )
 
-    images = _identify(config.source_dir)
+    claimed: Set[str] = set()
+    reusable: Dict[str, int] = {}
+
+    def _new() -> Iterator[Path]:
+        total = 0
+        new = 0
+        for batch in peewee.chunked(
+            walk(config.source_dir), constants.SQLITE_VARIABLE_LIMIT
+        ):
+            total += len(batch)
+            sources = {path: path.relative_to(config.source_dir) for path in batch}
+            names = {
+                path: database.ImageRecord.make_name(config, path) for path in batch
+            }
+
+            taken = set()
+            deleted = {}
+            with database.interface.atomic():
+                existing = {
+                    item.source
+                    for item in database.ImageRecord.select(
+                        database.ImageRecord.source
+                    ).where(
+                        database.ImageRecord.source.in_(list(sources.values())),
+                        database.ImageRecord.deleted  # pylint: disable=singleton-comparison
+                        == False,
+                    )
+                }
+                for item in database.ImageRecord.select(
+                    database.ImageRecord.id,
+                    database.ImageRecord.name,
+                    database.ImageRecord.deleted,
+                ).where(database.ImageRecord.name.in_(list(set(names.values())))):
+                    if item.deleted:
+                        deleted[item.name] = item.id
+                    else:
+                        taken.add(item.name)
+
+            for image in batch:
+                if sources[image] in existing:
+                    logger.debug(f"Skipping existing {image}")
+                    continue
+                name = names[image]
+                if name in taken or name in claimed:
+                    logger.warning(
+                        f"Skipping {image}: image name '{name}' is already used by another file"
+                    )
+                    continue
+                logger.debug(f"Including newly identified image {image}")
+                claimed.add(name)
+                if name in deleted:
+                    reusable[name] = deleted[name]
+                new += 1
+                yield image
+        logger.info(
+            f"Identified {total} files under {config.source_dir}, of which {new} are new"
+        )
+
+    return hash_files(config, functools.partial(_from_path, config, reusable), _new())
+
 
-    logger.info(f"Identified {len(images)} files under {config.source_dir}")
+def _from_path(
+    config: configuration.KodakConfig, reusable: Dict[str, int], path: Path
+) -> database.ImageRecord:
+    record = database.ImageRecord.from_path(config, path)
+    record.id = reusable.get(record.name)
+    return record
 
+
+def save(
+    batcher: database.Batcher, records: Sequence[database.ImageRecord]
+) -> List[database.ImageRecord]:
+    """Save newly identified image records
+
+    Records without an ``id`` are inserted. Records with an ``id`` take over the record of a
+    deleted image with the same name (see :func:`identify`): the record is updated to describe
+    the new source file and restored.
+
+    :param batcher: Batcher for the database the records are saved to
+    :param records: Image records returned by :func:`identify`
+    :returns: Records that took over the record of a deleted image. Any manips generated for the
+              deleted image are out of date and should be invalidated (see :func:`invalidate`).
+    """
+    reused = [record for record in records if record.id is not None]
     with database.interface.atomic():
-        existing = [
-            item.source
-            for item in database.ImageRecord.select(database.ImageRecord.source)
-        ]
+        batcher.bulk_create(
+            database.ImageRecord, [record for record in records if record.id is None]
+        )
+        batcher.bulk_update(
+            database.ImageRecord,
+            reused,
+            fields=[
+                database.ImageRecord.source,
+                database.ImageRecord.format_,
+                database.ImageRecord.checksum,
+                database.ImageRecord.fingerprint,
+                database.ImageRecord.deleted,
+            ],
+        )
+    return reused
 
-    logger.debug(f"Fetched {len(existing)} existing image records")
 
-    results = []
-    for image in images:
-        if image.relative_to(config.source_dir) in existing:
-            logger.debug(f"Skipping existing {image}")
+def refresh(
+    config: configuration.KodakConfig,
+) -> Tuple[List[database.ImageRecord], List[database.ImageRecord]]:
+    """Identify existing source images that have been modified since they were indexed
+
+    Files are only checksummed again when their stat fingerprint (see
+    :class:`database.Fingerprint`) no longer matches the one recorded when they were indexed, so
+    unchanged files are never opened. The exception is files whose recorded checksum was
+    calculated with a different algorithm than the one configured: these are checksummed again
+    with the configured algorithm, and if their fingerprint is unchanged their contents are
+    assumed to be unchanged too.
+
+    :param config: Populated application configuration object
+    :returns: Tuple of two lists of (unsaved) database models with updated fingerprints: the first
+              contains images whose contents are unchanged, the second contains images whose
+              checksum has changed
+    """
+
+    logger = logging.getLogger(__name__)
+
+    existing = paginate(
+        database.ImageRecord.select(
+            database.ImageRecord.id,
+            database.ImageRecord.source,
+            database.ImageRecord.checksum,
+            database.ImageRecord.fingerprint,
+        ).where(
+            database.ImageRecord.deleted  # pylint: disable=singleton-comparison
+            == False
+        ),
+        config.index.batch_size,
+    )
+
+    stale = {}
+    migrated = set()
+    for item in existing:
+        path = config.source_dir / item.source
+        try:
+            fingerprint = database.Fingerprint.from_path(path)
+        except FileNotFoundError:
+            continue
+
+        if fingerprint != item.fingerprint:
+            logger.debug(
+                f"Fingerprint of image file changed from {item.fingerprint} to {fingerprint}, recalculating checksum: {item.source}"
+            )
+            item.fingerprint = fingerprint
+            stale[path] = item
+        elif item.checksum.algorithm != config.index.checksum:
+            logger.debug(
+                f"Image file was checksummed with {item.checksum.algorithm}, recalculating checksum with {config.index.checksum}: {item.source}"
+            )
+            stale[path] = item
+            migrated.add(path)
+
+    if migrated:
+        logger.info(
+            f"Migrating checksums of {len(migrated)} image files to {config.index.checksum}"
+        )
+
+    touched = []
+    changed = []
+    for path, checksum in hash_files(
+        config,
+        lambda path: (path, database.Checksum.from_path(path, config.index.checksum)),
+        stale,
+    ):
+        item = stale[path]
+        if path in migrated:
+            item.checksum = checksum
+            touched.append(item)
+        elif checksum == item.checksum:
+            touched.append(item)
         else:
-            logger.debug(f"Including newly identified image {image}")
-            results.append(database.ImageRecord.from_path(config, image))
+            logger.debug(f"Image file contents changed: {item.source}")
+            item.checksum = checksum
+            changed.append(item)
 
-    return results
+    logger.info(
+        f"Identified {len(changed)} modified image files and {len(touched)} image files with unchanged contents but new fingerprints or checksums"
+    )
+
+    return touched, changed
 
 
 def clean(config: configuration.KodakConfig) -> List[database.ImageRecord]:
@@ -68,13 +497,17 @@ def clean(config: configuration.KodakConfig) -> List[database.ImageRecord]:
 
     logger = logging.getLogger(__name__)
 
-    with database.interface.atomic():
-        existing = database.ImageRecord.select(database.ImageRecord.source).where(
+    existing = paginate(
+        database.ImageRecord.select(
+            database.ImageRecord.id,
+            database.ImageRecord.name,
+            database.ImageRecord.source,
+        ).where(
             database.ImageRecord.deleted  # pylint: disable=singleton-comparison
             == False
-        )
-
-    logger.info(f"Identified {len(existing)} existing image records")
+        ),
+        config.index.batch_size,
+    )
 
     deleted = []
     for item in existing:
@@ -92,51 +525,459 @@ def clean(config: configuration.KodakConfig) -> List[database.ImageRecord]:
     return deleted
 
 
+def invalidate(
+    config: configuration.KodakConfig, images: List[database.ImageRecord]
+) -> None:
+    """Remove the generated manips of images whose source file has changed
+
+    :param config: Populated application configuration object
+    :param images: Image records whose manips are out of date
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.info(f"Invalidating generated manips of {len(images)} modified image files")
+
+    manips = []
+    with database.interface.atomic():
+        for batch in peewee.chunked(images, constants.SQLITE_VARIABLE_LIMIT):
+            manips += list(
+                database.ManipRecord.select(
+                    database.ManipRecord.id, database.ManipRecord.file
+                ).where(database.ManipRecord.parent.in_(batch))
+            )
+        for batch in peewee.chunked(manips, constants.SQLITE_VARIABLE_LIMIT):
+            database.ManipRecord.delete().where(
+                database.ManipRecord.id.in_([manip.id for manip in batch])
+            ).execute()
+        if manips:
+            database.GenerationRecord.bump()
+
+    for manip in manips:
+        logger.debug(f"Removing invalidated manip {config.content_dir / manip.file}")
+        with contextlib.suppress(FileNotFoundError):
+            (config.content_dir / manip.file).unlink()
+
+
+def remove(
+    config: configuration.KodakConfig, images: List[database.ImageRecord]
+) -> None:
+    """Remove the generated content of images whose source file has been removed
+
+    :param config: Populated application configuration object
+    :param images: Image records that have been marked as deleted
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.info(f"Removing generated assets for {len(images)} removed image files")
+
+    if images:
+        database.GenerationRecord.bump()
+
+    for image in images:
+        content = config.content_dir / image.name
+        logger.debug(f"Removing content directory {content}")
+        with contextlib.suppress(FileNotFoundError):
+            shutil.rmtree(str(content))
+
+
+def scan_links(config: configuration.KodakConfig) -> Dict[str, Path]:
+    """Read the source links that currently exist in the content directory
+
+    :param config: Populated application configuration object
+    :returns: Mapping of image names to the path that the image's source link points to
+    """
+    current = {}
+    try:
+        with os.scandir(config.content_dir) as entries:
+            for entry in entries:
+                if entry.name == constants.LOCK_DIRECTORY_NAME or not entry.is_dir(
+                    follow_symlinks=False
+                ):
+                    continue
+                try:
+                    current[entry.name] = Path(
+                        os.readlink(
+                            os.path.join(entry.path, constants.SOURCE_LINK_NAME)
+                        )
+                    )
+                except OSError:
+                    # No link, or the path is not a link
+                    continue
+    except FileNotFoundError:
+        pass
+    return current
+
+
+def _link(config: configuration.KodakConfig, name: str, target: Optional[Path]) -> None:
+    link = config.content_dir / name / constants.SOURCE_LINK_NAME
+    if target is None:
+        with contextlib.suppress(FileNotFoundError):
+            link.unlink()
+        return
+
+    link.parent.mkdir(exist_ok=True)
+    try:
+        link.symlink_to(target)
+    except FileExistsError:
+        # Retarget the existing link by atomically replacing it
+        temp = link.with_name(f".{link.name}.{os.getpid()}.{threading.get_ident()}")
+        with contextlib.suppress(FileNotFoundError):
+            temp.unlink()
+        temp.symlink_to(target)
+        os.replace(temp, link)
+
+
+def link(config: configuration.KodakConfig) -> int:
+    """Reconcile the source links in the content directory with the index
+
+    The links that currently exist are compared against the links that should exist, based on
+    ``config.expose_source`` and the images in the index, and only the difference is applied:
+    missing links are created, links that point to the wrong source file are replaced, and links
+    that should not exist are removed. Changes are applied on a pool of threads so that toggling
+    ``config.expose_source`` for a large library completes quickly.
+
+    :param config: Populated application configuration object
+    :returns: Number of links that were created, replaced, or removed
+    """
+    logger = logging.getLogger(__name__)
+
+    expected: Dict[str, Path] = {}
+    if config.expose_source:
+        with database.interface.atomic():
+            expected = {
+                name: config.source_dir / source
+                for name, source in database.ImageRecord.select(
+                    database.ImageRecord.name, database.ImageRecord.source
+                )
+                .where(
+                    database.ImageRecord.deleted  # pylint: disable=singleton-comparison
+                    == False
+                )
+                .tuples()
+                .iterator()
+            }
+
+    current = scan_links(config)
+
+    changes: List[Tuple[str, Optional[Path]]] = [
+        (name, target)
+        for name, target in expected.items()
+        if current.get(name) != target
+    ]
+    changes.extend((name, None) for name in current if name not in expected)
+
+    logger.info(
+        f"Applying {len(changes)} changes to source links ({len(current)} existing, {len(expected)} expected)"
+    )
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=config.index.workers
+    ) as executor:
+        for batch in peewee.chunked(changes, config.index.batch_size):
+            for (name, target), future in zip(
+                batch,
+                [
+                    executor.submit(_link, config, name, target)
+                    for name, target in batch
+                ],
+            ):
+                try:
+                    future.result()
+                except OSError as err:
+                    logger.warning(f"Failed to update source link of {name}: {err}")
+                else:
+                    logger.debug(
+                        f"Linked {name} to {target}"
+                        if target
+                        else f"Removed source link of {name}"
+                    )
+
+    return len(changes)
+
+
+def update(config: configuration.KodakConfig, paths: Iterable[Path]) -> None:
+    """Incrementally update the index for a set of source image files
+
+    Each path is compared against its existing image record, if there is one: files without a
+    record are indexed, files that no longer exist have their record marked as deleted and their
+    generated content removed, and files whose fingerprint changed are checksummed again (see
+    :func:`refresh`). Files that reappear after being deleted have their record restored. Paths
+    that are not image files are ignored.
+
+    :param config: Populated application configuration object
+    :param paths: Absolute paths of the source files to update
+    """
+    with leader(config):
+        _update(config, paths)
+
+
+def _update(config: configuration.KodakConfig, paths: Iterable[Path]) -> None:
+    logger = logging.getLogger(__name__)
+
+    sources = {
+        path.relative_to(config.source_dir): path
+        for path in paths
+        if path.suffix in constants.IMAGE_FILE_EXTENSIONS
+    }
+
+    records: Dict[Path, database.ImageRecord] = {}
+    with database.interface.atomic():
+        for batch in peewee.chunked(sources, constants.SQLITE_VARIABLE_LIMIT):
+            for record in database.ImageRecord.select().where(
+                database.ImageRecord.source.in_(batch)
+            ):
+                records[record.source] = record
+
+    new = []
+    removed = []
+    stale = {}
+    for source, path in sources.items():
+        record = records.get(source)
+        try:
+            fingerprint = database.Fingerprint.from_path(path)
+        except FileNotFoundError:
+            if record is not None and not record.deleted:
+                logger.debug(f"Image file removed, record will be deleted: {source}")
+                record.deleted = True
+                removed.append(record)
+            continue
+
+        if record is None:
+            logger.debug(f"Including newly identified image {path}")
+            new.append(path)
+        elif record.deleted or fingerprint != record.fingerprint:
+            logger.debug(f"Image file changed, recalculating checksum: {source}")
+            record.fingerprint = fingerprint
+            stale[path] = record
+
+    names = {path: database.ImageRecord.make_name(config, path) for path in new}
+    taken = set()
+    reusable: Dict[str, int] = {}
+    with database.interface.atomic():
+        for batch in peewee.chunked(
+            set(names.values()), constants.SQLITE_VARIABLE_LIMIT
+        ):
+            for item in database.ImageRecord.select(
+                database.ImageRecord.id,
+                database.ImageRecord.name,
+                database.ImageRecord.deleted,
+            ).where(database.ImageRecord.name.in_(batch)):
+                if item.deleted:
+                    reusable[item.name] = item.id
+                else:
+                    taken.add(item.name)
+    # A file renamed to another extension is removed and added in the same update, so the new file
+    # takes over the record of the removed one
+    removing = {record.name: record for record in removed}
+    unique = []
+    for path in new:
+        if names[path] in removing:
+            reusable[names[path]] = removing.pop(names[path]).id
+        elif names[path] in taken:
+            logger.warning(
+                f"Skipping {path}: image name '{names[path]}' is already used by another file"
+            )
+            continue
+        taken.add(names[path])
+        unique.append(path)
+    new = unique
+    removed = list(removing.values())
+
+    changed = []
+    for path, checksum in hash_files(
+        config,
+        lambda path: (path, database.Checksum.from_path(path, config.index.checksum)),
+        stale,
+    ):
+        record = stale[path]
+        if record.deleted or checksum != record.checksum:
+            logger.debug(f"Image file contents changed: {record.source}")
+            record.checksum = checksum
+            record.deleted = False
+            changed.append(record)
+
+    created = list(
+        hash_files(config, functools.partial(_from_path, config, reusable), new)
+    )
+
+    logger.info(
+        f"Updating index with {len(created)} new, {len(stale)} modified, and {len(removed)} removed image files"
+    )
+
+    reused = []
+    with database.interface.atomic():
+        batcher = database.Batcher.from_database(database.interface.obj)
+        for batch in peewee.chunked(created, config.index.batch_size):
+            reused += save(batcher, batch)
+        updated = list(stale.values()) + removed
+        batcher.bulk_update(
+            database.ImageRecord,
+            updated,
+            fields=[
+                database.ImageRecord.fingerprint,
+                database.ImageRecord.checksum,
+                database.ImageRecord.deleted,
+            ],
+        )
+        if created or updated:
+            database.GenerationRecord.bump()
+
+    invalidate(config, changed + reused)
+    remove(config, removed)
+
+    for image in created + changed:
+        if config.expose_source:
+            logger.debug(f"Linking {image.name} to {image.source}")
+            _link(config, image.name, config.source_dir / image.source)
+
+
 def build(config: Optional[configuration.KodakConfig] = None) -> None:
     """Build and update the file index
 
+    If another process is already modifying the index then this waits for it to finish before
+    starting the build.
+
     :param config: Populated application configuration object
     """
+    config = config or configuration.load()
+
+    with leader(config):
+        _lead(config)
+
+
+def _lead(config: configuration.KodakConfig) -> None:
     logger = logging.getLogger(__name__)
 
-    config = config or configuration.load()
+    shared = StatusFile(config.content_dir)
+    current = shared.read()
+    current.building = True
+    current.started = datetime.datetime.utcnow()
+    current.error = None
+    published = 0.0
+
+    def _progress(phase: str, processed: int = 0) -> None:
+        nonlocal published
+        changed = phase != current.phase
+        current.phase = phase
+        current.processed = processed
+        if changed or time.monotonic() - published >= constants.INDEX_STATUS_INTERVAL:
+            shared.write(current)
+            published = time.monotonic()
+
+    try:
+        _build(config, _progress)
+    except Exception as err:
+        current.error = str(err)
+        raise
+    else:
+        current.completed = datetime.datetime.utcnow()
+    finally:
+        current.building = False
+        current.phase = None
+        shared.write(current)
+
+    logger.info("Index build complete")
+
+
+def _build(
+    config: configuration.KodakConfig, progress: Callable[[str, int], None]
+) -> None:
+    logger = logging.getLogger(__name__)
 
-    new_images = identify(config)
+    batcher = database.Batcher.from_database(database.interface.obj)
+
+    progress("identifying", 0)
+    created = 0
+    for batch in peewee.chunked(identify(config), config.index.batch_size):
+        reused = save(batcher, batch)
+        if reused:
+            invalidate(config, reused)
+        created += len(batch)
+        progress("identifying", created)
+        logger.info(f"Indexed {created} new image files")
+
+    progress("refreshing", 0)
+    touched_images, changed_images = refresh(config)
     with database.interface.atomic():
-        database.ImageRecord.bulk_create(
-            new_images,
-            batch_size=database.calc_batch_size(config.database.backend, new_images),
+        batcher.bulk_update(
+            database.ImageRecord,
+            touched_images + changed_images,
+            fields=[database.ImageRecord.fingerprint, database.ImageRecord.checksum],
         )
+    progress("refreshing", len(touched_images) + len(changed_images))
+
+    invalidate(config, changed_images)
 
+    progress("cleaning", 0)
     removed_images = clean(config)
     with database.interface.atomic():
-        database.ImageRecord.bulk_update(
-            removed_images,
-            fields=[database.ImageRecord.deleted],
-            batch_size=database.calc_batch_size(
-                config.database.backend, removed_images
-            ),
+        batcher.bulk_update(
+            database.ImageRecord, removed_images, fields=[database.ImageRecord.deleted]
         )
 
-    logger.info(
-        f"Removing generated assets for {len(removed_images)} removed image files"
-    )
+    remove(config, removed_images)
+    pruned = locking.prune(config.content_dir)
+    if pruned:
+        logger.info(f"Removed {pruned} lock files that were left behind")
+    progress("cleaning", len(removed_images))
 
-    for image in removed_images:
-        content = config.content_dir / image.name
-        logger.debug(f"Removing content directory {content}")
-        shutil.rmtree(str(content))
+    progress("linking", 0)
+    progress("linking", link(config))
 
-    logger.info("Processing source links")
+    if created or touched_images or changed_images or removed_images:
+        database.GenerationRecord.bump()
 
-    with database.interface.atomic():
-        for image in database.ImageRecord.select().where(
-            database.ImageRecord.deleted  # pylint: disable=singleton-comparison
-            == False
-        ):
-            if config.expose_source:
-                logger.debug(f"Creating source link to {image.source}")
-                image.create_link(config)
-            else:
-                logger.debug(f"Removing source link to {image.source}")
-                image.remove_link(config)
+
+def start(config: configuration.KodakConfig) -> threading.Thread:
+    """Build the index in a background thread, unless another process is responsible for it
+
+    Every worker process of a deployment calls this when it starts up, but only one of them
+    should build the index. The first process to take the :func:`leader` lock builds the index
+    and the others start serving immediately; progress of the build is published for every
+    process to report (see :func:`status`). A process that takes the lock after another process
+    completed a build since this process started does not build the index again.
+
+    If the build fails then the process that started it retries, with an exponentially increasing
+    delay, until a build completes. The lock is released while waiting to retry.
+
+    :param config: Populated application configuration object
+    :returns: The thread that the build (if any) runs in
+    """
+
+    def _attempt(lock: locking.FileLock) -> bool:
+        logger = logging.getLogger(__name__)
+        try:
+            database.interface.connect(reuse_if_open=True)
+            completed = StatusFile(config.content_dir).read().completed
+            if completed is not None and completed >= _STARTED:
+                logger.info(
+                    f"Index was built by another process at {completed.isoformat()}"
+                )
+                return True
+            _lead(config)
+            return True
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Index build failed")
+            return False
+        finally:
+            if not database.interface.is_closed():
+                database.interface.close()
+            lock.release()
+
+    def _run():
+        logger = logging.getLogger(__name__)
+        lock = leader(config)
+        if not lock.acquire(blocking=False):
+            logger.info("Index is being built by another process")
+            return
+
+        delay = constants.INDEX_RETRY_INTERVAL
+        while not _attempt(lock):
+            logger.info(f"Retrying index build in {delay} seconds")
+            time.sleep(delay)
+            delay = min(delay * 2, constants.INDEX_RETRY_MAX_INTERVAL)
+            lock.acquire()
+
+    thread = threading.Thread(target=_run, name="kodak-index", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,196 @@
+"""Inter-process coordination using advisory file locks
+
+Kodak is typically deployed as several independent worker processes that share a content
+directory. These locks let those processes coordinate work on shared files without requiring any
+external service. Locks are taken with ``flock(2)``, so the kernel releases a lock as soon as the
+process holding it exits: a worker that crashes mid-render can never leave a lock behind.
+"""
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import random
+import string
+import time
+from pathlib import Path
+from typing import Optional
+
+from kodak import constants
+from kodak import exceptions
+
+
+def lock_path(directory: Path, *keys: str) -> Path:
+    """Determine the path of the lock file for a set of keys
+
+    Keys are hashed to produce the lock file name so that arbitrary strings (such as
+    user-configured manip names) can be used to identify a lock. There is one lock file for every
+    distinct set of keys, so these locks should be taken with ``transient=True`` (see
+    :class:`FileLock`) to remove the file again once the lock is released. Files left behind by a
+    process that exited while holding a lock are removed by :func:`prune`.
+
+    :param directory: Content directory that the lock coordinates access to
+    :param keys: Strings that together uniquely identify the locked resource
+    :returns: Path to the lock file
+    """
+    digest = hashlib.sha256("\0".join(keys).encode()).hexdigest()
+    return directory / constants.LOCK_DIRECTORY_NAME / f"{digest}.lock"
+
+
+def prune(directory: Path) -> int:
+    """Remove the files of keyed locks (see :func:`lock_path`) that are not currently held
+
+    :param directory: Content directory that the locks coordinate access to
+    :returns: Number of lock files that were removed
+    """
+    removed = 0
+    for path in (directory / constants.LOCK_DIRECTORY_NAME).glob("*.lock"):
+        if len(path.stem) != 64 or not all(
+            character in string.hexdigits for character in path.stem
+        ):
+            continue
+        lock = FileLock(path, transient=True)
+        if lock.acquire(blocking=False):
+            lock.release()
+            removed += 1
+    return removed
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, shared between processes and threads
+
+    ::
+
+      with FileLock(path, timeout=30):
+          ...
+
+    A lock file may be removed by the process holding the lock, so after taking the lock the file
+    is checked to still be the one at ``path``. If it is not then the lock is taken again on the
+    new file.
+
+    :param path: Path to the lock file; it will be created if it does not exist
+    :param timeout: Number of seconds to wait for the lock before giving up. If ``None`` then wait
+                    indefinitely.
+    :param transient: Whether to remove the lock file when the lock is released
+    """
+
+    def __init__(
+        self, path: Path, timeout: Optional[float] = None, transient: bool = False
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.transient = transient
+        self._fd: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        """Whether this instance currently holds the lock"""
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquire the lock
+
+        :param blocking: Whether to wait for the lock (up to the timeout) if it is already held
+        :returns: Whether the lock was acquired
+        """
+        if self._fd is not None:
+            raise RuntimeError(f"Lock {self.path} is already held by this instance")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not blocking or (
+                    deadline is not None and time.monotonic() >= deadline
+                ):
+                    os.close(fd)
+                    return False
+                time.sleep(constants.LOCK_POLL_INTERVAL)
+                continue
+
+            if self._is_current(fd):
+                self._fd = fd
+                return True
+
+            # The file was removed by the previous holder of the lock
+            os.close(fd)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _is_current(self, fd: int) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(fd)
+        return (stat.st_dev, stat.st_ino) == (opened.st_dev, opened.st_ino)
+
+    def release(self) -> None:
+        """Release the lock"""
+        if self._fd is None:
+            return
+        if self.transient:
+            # Removed while the lock is still held, so no other process can be using the file
+            with contextlib.suppress(FileNotFoundError):
+                self.path.unlink()
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise exceptions.LockTimeoutError(
+                f"Timed out after {self.timeout} seconds waiting for lock {self.path}"
+            )
+        logging.getLogger(__name__).debug(f"Acquired lock {self.path}")
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+
+class Semaphore:
+    """Counting semaphore shared between processes, made up of a fixed set of lock files
+
+    Each of the ``capacity`` slots is a :class:`FileLock` on its own file, so a slot held by a
+    process that exits is released by the kernel like any other lock.
+
+    ::
+
+      slot = Semaphore(path, capacity=4).acquire(timeout=30)
+      if slot is not None:
+          try:
+              ...
+          finally:
+              slot.release()
+
+    :param path: Path prefix of the slot lock files; slot ``n`` is locked through
+                 ``{path}.{n}.lock``
+    :param capacity: Number of slots that can be held at once
+    """
+
+    def __init__(self, path: Path, capacity: int):
+        self.path = path
+        self.capacity = capacity
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[FileLock]:
+        """Take one of the slots
+
+        :param timeout: Number of seconds to wait for a slot to become free. If ``None`` then wait
+                        indefinitely.
+        :returns: Lock on the slot that was taken, which must be released to give the slot back,
+                  or ``None`` if no slot became free within the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Start from a random slot so that waiting processes do not all contend for the first
+            for slot in random.sample(range(self.capacity), self.capacity):
+                lock = FileLock(self.path.with_name(f"{self.path.name}.{slot}.lock"))
+                if lock.acquire(blocking=False):
+                    return lock
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(constants.LOCK_POLL_INTERVAL)
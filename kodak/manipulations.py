@@ -1,4 +1,9 @@
 import logging
+import math
+from typing import Callable
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
 
 from PIL import Image
 
@@ -6,102 +11,387 @@ from kodak import configuration
 from kodak import constants
 
 
-def scale(image: Image.Image, config: configuration.ManipConfig) -> Image.Image:
-    """Scale an image to new dimensions"""
+def oriented_size(image: Image.Image) -> Tuple[int, int]:
+    """Determine the dimensions of an image once its EXIF orientation has been applied
+
+    This only reads the image metadata, so it can be called on a lazily opened image without
+    triggering a decode of the pixel data.
+    """
+    if image.getexif().get(constants.EXIF_ORIENTATION_TAG) in (5, 6, 7, 8):
+        return image.height, image.width
+    return image.width, image.height
+
+
+def scale_size(
+    size: Tuple[int, int], config: configuration.ManipConfig
+) -> Tuple[int, int]:
+    """Calculate the dimensions that an image will be scaled to
+
+    When only one scaling dimension is configured the image is shrunk (never enlarged) to fit
+    within the configured dimension while preserving its aspect ratio. When both dimensions are
+    configured the image is resized to exactly those dimensions.
+
+    :param size: Width and height of the (oriented) image that will be scaled
+    :param config: Manipulation configuration to calculate the new dimensions from
+    :returns: Width and height of the scaled image
+    """
+    width, height = size
 
     if config.scale.strategy == constants.ScaleStrategy.ABSOLUTE:
-        width = config.scale.horizontal or image.width
-        height = config.scale.vertical or image.height
+        new_width = config.scale.horizontal or width
+        new_height = config.scale.vertical or height
     elif config.scale.strategy == constants.ScaleStrategy.RELATIVE:
-        width = (
-            (config.scale.horizontal * image.width)
-            if config.scale.vertical
-            else image.width
+        new_width = (
+            (config.scale.horizontal * width) if config.scale.horizontal else width
         )
-        height = (
-            (config.scale.horizontal * image.height)
-            if config.scale.vertical
-            else image.height
+        new_height = (
+            (config.scale.vertical * height) if config.scale.vertical else height
         )
     else:
         raise ValueError("Here there be dragons")
 
+    if config.scale.horizontal is not None and config.scale.vertical is not None:
+        return max(round(new_width), 1), max(round(new_height), 1)
+
+    # Preserve the aspect ratio the same way :meth:`PIL.Image.Image.thumbnail` does so that the
+    # output dimensions are identical to what a thumbnail would produce
+    new_width, new_height = math.floor(new_width), math.floor(new_height)
+    if new_width >= width and new_height >= height:
+        return width, height
+
+    def _round_aspect(number: float, key: Callable[[int], float]) -> int:
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if new_width / new_height >= aspect:
+        new_width = _round_aspect(
+            new_height * aspect, key=lambda item: abs(aspect - item / new_height)
+        )
+    else:
+        new_height = _round_aspect(
+            new_width / aspect,
+            key=lambda item: 0 if item == 0 else abs(aspect - new_width / item),
+        )
+
+    return new_width, new_height
+
+
+def draft_size(
+    size: Tuple[int, int], *configs: configuration.ManipConfig
+) -> Optional[Tuple[int, int]]:
+    """Calculate the smallest image that can be used to produce a set of manipulations
+
+    The result is always at least :const:`constants.RESAMPLE_REDUCING_GAP` times larger than the
+    largest output so that the final resample still produces a high quality result.
+
+    :param size: Width and height of the full resolution (oriented) source image
+    :param configs: Manipulation configurations that will be applied to the image
+    :returns: Minimum width and height of the image, or ``None`` if the manipulations require
+              the full resolution image
+    """
+    request = (0, 0)
+    for config in configs:
+        if config.scale.horizontal is None and config.scale.vertical is None:
+            return None
+        width, height = scale_size(size, config)
+        request = (
+            max(request[0], math.ceil(width * constants.RESAMPLE_REDUCING_GAP)),
+            max(request[1], math.ceil(height * constants.RESAMPLE_REDUCING_GAP)),
+        )
+
+    if not configs or request[0] >= size[0] or request[1] >= size[1]:
+        return None
+
+    return request
+
+
+def draft(image: Image.Image, *configs: configuration.ManipConfig) -> Tuple[int, int]:
+    """Configure the image decoder to load the smallest image that can satisfy manipulations
+
+    JPEG images can be decoded at 1/2, 1/4, or 1/8 scale directly from the DCT coefficients,
+    which is dramatically faster (and uses dramatically less memory) than decoding the full
+    image just to shrink it afterwards. See :func:`draft_size` for how far the image is reduced.
+
+    .. note:: This must be called before the image data is loaded. It has no effect on formats
+              other than JPEG; those are reduced by :func:`transform` using ``reducing_gap``.
+
+    :param image: Lazily opened image that has not been loaded yet
+    :param configs: Manipulation configurations that will be applied to the image. The image
+                    is reduced only as far as the largest of the manipulations allows.
+    :returns: Width and height of the full resolution image with its EXIF orientation applied.
+              This should be used as the reference size for any further manipulations, since
+              the size of the image itself may be reduced by this function.
+    """
+    size = oriented_size(image)
+
+    if image.format != "JPEG":
+        return size
+
+    request = draft_size(size, *configs)
+    if request is None:
+        return size
+
+    if size != image.size:
+        request = request[1], request[0]
+
+    image.draft(None, request)
+
     logging.getLogger(__name__).debug(
-        f"Scaling image: old {image.width}x{image.height}; new {width}x{height})"
+        f"Requested draft decode of image: full {size[0]}x{size[1]}; decoding {image.width}x{image.height}"
     )
 
-    if config.scale.horizontal is None or config.scale.vertical is None:
-        image = image.copy()
-        image.thumbnail((width, height), Image.ANTIALIAS)
-    else:
-        image.resize((width, height))
+    return size
+
 
-    return image
+class Geometry(NamedTuple):
+    """Single geometric transform combining the scale and crop steps of a manipulation
 
+    :param box: Region of the source image to sample from, as a ``(left, upper, right, lower)``
+                tuple in the coordinates of the full resolution (oriented) source image
+    :param size: Width and height of the output image
+    """
 
-def crop(image: Image.Image, config: configuration.ManipConfig) -> Image.Image:
-    """Crop an image to new dimensions"""
+    box: Tuple[float, float, float, float]
+    size: Tuple[int, int]
 
-    # TODO: add safeguards for when config values are out of bounds for the image
 
-    width = config.crop.horizontal or image.width
-    height = config.crop.vertical or image.height
+def plan(size: Tuple[int, int], config: configuration.ManipConfig) -> Geometry:
+    """Plan the geometric transform that a manipulation applies to an image
 
-    if config.crop.anchor == constants.CropAnchor.TL:
+    Scaling is applied first, then cropping is applied relative to the scaled dimensions. Rather
+    than performing these as two passes over the image, the crop region is mapped back onto the
+    source image so that both steps can be performed by a single resample that never touches
+    pixels outside of the cropped region.
+
+    .. note:: Crop dimensions larger than the scaled image are clamped to the scaled image
+
+    :param size: Width and height of the (oriented) source image
+    :param config: Manipulation configuration to plan the transform for
+    :returns: Geometry describing the source region and output dimensions
+    """
+    width, height = size
+    scaled_width, scaled_height = scale_size(size, config)
+
+    crop_width = min(config.crop.horizontal or scaled_width, scaled_width)
+    crop_height = min(config.crop.vertical or scaled_height, scaled_height)
+
+    if config.crop.anchor in (
+        constants.CropAnchor.TL,
+        constants.CropAnchor.CL,
+        constants.CropAnchor.BL,
+    ):
         x_1 = 0
+    elif config.crop.anchor in (
+        constants.CropAnchor.TC,
+        constants.CropAnchor.C,
+        constants.CropAnchor.BC,
+    ):
+        x_1 = (scaled_width - crop_width) // 2
+    elif config.crop.anchor in (
+        constants.CropAnchor.TR,
+        constants.CropAnchor.CR,
+        constants.CropAnchor.BR,
+    ):
+        x_1 = scaled_width - crop_width
+    else:
+        raise ValueError("Ye gadds! This codepath is impossible!")
+
+    if config.crop.anchor in (
+        constants.CropAnchor.TL,
+        constants.CropAnchor.TC,
+        constants.CropAnchor.TR,
+    ):
         y_1 = 0
-        x_2 = width
-        y_2 = height
-    elif config.crop.anchor == constants.CropAnchor.TC:
-        x_1 = (image.width / 2) - (width / 2)
-        y_1 = 0
-        x_2 = (image.width / 2) + (width / 2)
-        y_2 = height
-    elif config.crop.anchor == constants.CropAnchor.TR:
-        x_1 = image.width - width
-        y_1 = 0
-        x_2 = image.width
-        y_2 = height
-    elif config.crop.anchor == constants.CropAnchor.CL:
-        x_1 = 0
-        y_1 = (image.height / 2) - (height / 2)
-        x_2 = width
-        y_2 = (image.height / 2) + (height / 2)
-    elif config.crop.anchor == constants.CropAnchor.C:
-        x_1 = (image.width / 2) - (width / 2)
-        y_1 = (image.height / 2) - (height / 2)
-        x_2 = (image.width / 2) + (width / 2)
-        y_2 = (image.height / 2) + (height / 2)
-    elif config.crop.anchor == constants.CropAnchor.BL:
-        x_1 = 0
-        y_1 = image.height - height
-        x_2 = width
-        y_2 = image.height
-    elif config.crop.anchor == constants.CropAnchor.BC:
-        x_1 = (image.width / 2) - (width / 2)
-        y_1 = image.height - height
-        x_2 = (image.width / 2) + (width / 2)
-        y_2 = image.height
-    elif config.crop.anchor == constants.CropAnchor.BR:
-        x_1 = image.width - width
-        y_1 = image.height - height
-        x_2 = image.width
-        y_2 = image.height
+    elif config.crop.anchor in (
+        constants.CropAnchor.CL,
+        constants.CropAnchor.C,
+        constants.CropAnchor.CR,
+    ):
+        y_1 = (scaled_height - crop_height) // 2
+    elif config.crop.anchor in (
+        constants.CropAnchor.BL,
+        constants.CropAnchor.BC,
+        constants.CropAnchor.BR,
+    ):
+        y_1 = scaled_height - crop_height
     else:
         raise ValueError("Ye gadds! This codepath is impossible!")
 
+    x_ratio = width / scaled_width
+    y_ratio = height / scaled_height
+
+    geometry = Geometry(
+        box=(
+            x_1 * x_ratio,
+            y_1 * y_ratio,
+            (x_1 + crop_width) * x_ratio,
+            (y_1 + crop_height) * y_ratio,
+        ),
+        size=(crop_width, crop_height),
+    )
+
     logging.getLogger(__name__).debug(
-        f"Cropping image: old {image.width}x{image.height}; new {width}x{height}; upper-0 anchor ({x_1}, {y_1}); lower-image.width anchor ({x_2}, {y_2})"
+        f"Planned image transform: source {width}x{height}; scaled {scaled_width}x{scaled_height}; output {crop_width}x{crop_height}; source box {geometry.box}"
     )
 
-    return image.crop((x_1, y_1, x_2, y_2))
+    return geometry
 
 
-def black_and_white(
-    image: Image.Image,
-    config: configuration.ManipConfig,  # pylint: disable=unused-argument
+def transform(
+    image: Image.Image, geometry: Geometry, size: Optional[Tuple[int, int]] = None
 ) -> Image.Image:
-    """Convert an image to full-depth black and white"""
+    """Apply a planned geometric transform to an image in a single pass
+
+    :param image: Image to transform
+    :param geometry: Transform to apply, as returned from :func:`plan`
+    :param size: Reference size of the source image that ``geometry`` was planned against. This
+                 should be the value returned from :func:`draft` if the image was drafted;
+                 defaults to the size of ``image``.
+    :returns: Transformed image
+    """
+    width, height = size or image.size
+    x_ratio = image.width / width
+    y_ratio = image.height / height
+
+    box = (
+        geometry.box[0] * x_ratio,
+        geometry.box[1] * y_ratio,
+        geometry.box[2] * x_ratio,
+        geometry.box[3] * y_ratio,
+    )
+
+    if geometry.size == image.size and box == (0, 0, image.width, image.height):
+        return image
+
+    if all(float(item).is_integer() for item in box) and geometry.size == (
+        box[2] - box[0],
+        box[3] - box[1],
+    ):
+        return image.crop(tuple(int(item) for item in box))
+
+    return image.resize(
+        geometry.size,
+        Image.LANCZOS,
+        box=box,
+        reducing_gap=constants.RESAMPLE_REDUCING_GAP,
+    )
+
+
+def reuse(geometry: Geometry, intermediate: Geometry) -> Optional[Geometry]:
+    """Map a planned transform onto the output of a different transform of the same image
+
+    The output of one manipulation can be used as the source for another, smaller, manipulation
+    rather than resampling the full source image again. This is only possible when the
+    intermediate output covers the entire region the transform samples from, at a resolution at
+    least :const:`constants.RESAMPLE_REDUCING_GAP` times higher than the transform needs so that
+    the result is indistinguishable from resampling the source image directly.
+
+    :param geometry: Transform that should be applied, as returned from :func:`plan`
+    :param intermediate: Transform that produced the candidate intermediate image
+    :returns: Transform to apply to the intermediate image to produce the same output as
+              ``geometry`` would from the source, or ``None`` if the intermediate is unsuitable
+    """
+    left, upper, right, lower = geometry.box
+    i_left, i_upper, i_right, i_lower = intermediate.box
+
+    if left < i_left or upper < i_upper or right > i_right or lower > i_lower:
+        return None
+
+    x_scale = intermediate.size[0] / (i_right - i_left)
+    y_scale = intermediate.size[1] / (i_lower - i_upper)
+
+    if (
+        x_scale < (geometry.size[0] / (right - left)) * constants.RESAMPLE_REDUCING_GAP
+        or y_scale
+        < (geometry.size[1] / (lower - upper)) * constants.RESAMPLE_REDUCING_GAP
+    ):
+        return None
+
+    return Geometry(
+        box=(
+            (left - i_left) * x_scale,
+            (upper - i_upper) * y_scale,
+            min((right - i_left) * x_scale, intermediate.size[0]),
+            min((lower - i_upper) * y_scale, intermediate.size[1]),
+        ),
+        size=geometry.size,
+    )
+
+
+def curve(config: configuration.ManipConfig) -> Optional[Callable[[int], int]]:
+    """Compose the brightness and contrast settings of a manipulation into a single tone curve
+
+    Brightness shifts every value by a percentage of the full range; contrast then scales values
+    away from (or towards) the midpoint by a percentage. Values are clamped after each step so
+    the result is the same as applying the adjustments one after the other.
+
+    :param config: Manipulation configuration to build the curve for
+    :returns: Function mapping an 8-bit input value to an 8-bit output value, or ``None`` if the
+              configuration does not adjust brightness or contrast
+    """
+    if not config.brightness and not config.contrast:
+        return None
+
+    offset = config.brightness * 255 / 100
+    factor = (100 + config.contrast) / 100
+
+    def _clamp(value: float) -> float:
+        return min(max(value, 0), 255)
+
+    def _curve(value: int) -> int:
+        value = _clamp(value + offset)
+        return round(_clamp((value - 128) * factor + 128))
+
+    return _curve
+
+
+def adjust(image: Image.Image, config: configuration.ManipConfig) -> Image.Image:
+    """Apply the color adjustments of a manipulation
+
+    Every enabled adjustment is composed into a single lookup table that is applied to the image
+    with one :meth:`Image.Image.point` call, so enabling more adjustments does not add any more
+    passes over the image. Black and white and sepia both require reducing the image to its
+    luminance first, which is one additional pass; the sepia tone is then produced by the lookup
+    table itself when mapping the single luminance channel back out to RGB.
+
+    :param image: Image to adjust; this is not modified
+    :param config: Manipulation configuration to apply
+    :returns: The adjusted image, or the original image if the configuration makes no adjustments
+    """
+    tone = curve(config)
+    if not tone and not config.black_and_white and not config.sepia:
+        return image
+
     logger = logging.getLogger(__name__)
-    logger.debug("Converting image to black and white")
-    return image.convert("L")
+    logger.debug(
+        f"Adjusting image colors: brightness {config.brightness}, contrast {config.contrast}, black and white {config.black_and_white}, sepia {config.sepia}"
+    )
+
+    base = [tone(value) if tone else value for value in range(256)]
+
+    if config.black_and_white or config.sepia:
+        if image.mode != "L":
+            image = image.convert("L")
+        if config.sepia:
+            return image.point(
+                [
+                    min(round(value * weight), 255)
+                    for weight in constants.SEPIA_TONE
+                    for value in base
+                ],
+                "RGB",
+            )
+        return image.point(base)
+
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert(
+            "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+        )
+
+    return image.point(
+        [
+            value if band == "A" else base[value]
+            for band in image.getbands()
+            for value in range(256)
+        ]
+    )
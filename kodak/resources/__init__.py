@@ -5,6 +5,7 @@ from kodak.resources._shared import KodakResource
 from kodak.resources.heartbeat import Heartbeat
 from kodak.resources.image import Image
 from kodak.resources.manip import ImageManip
+from kodak.resources.manip import ImageManipNegotiated
 from kodak.resources.openapi import OpenAPI
 
 
@@ -12,5 +13,6 @@ RESOURCES: Tuple[Type[KodakResource], ...] = (
     Heartbeat,
     Image,
     ImageManip,
+    ImageManipNegotiated,
     OpenAPI,
 )
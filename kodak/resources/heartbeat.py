@@ -1,4 +1,8 @@
+import flask
+
+from kodak import cache
 from kodak import database
+from kodak import index
 from kodak.resources._shared import KodakResource
 from kodak.resources._shared import ResponseTuple
 
@@ -9,10 +13,32 @@ class Heartbeat(KodakResource):
     routes = ("/heartbeat",)
 
     def get(self) -> ResponseTuple:
-        """Perform a trivial database operation and return a-ok"""
-        database.ImageRecord.select().count()
+        """Perform a trivial database operation and return a-ok
+
+        If the ``ready`` query parameter is given then the status of the source image index and
+        the usage of this process's record cache are returned as well, and the service is only
+        reported as ready once an index build has completed.
+        """
+        database.interface.execute_sql("SELECT 1")
+
+        if "ready" not in flask.request.args:
+            return self.make_response(None)
 
-        return self.make_response(None)
+        status = index.status(flask.current_app.appconfig).as_dict()
+        records = cache.RECORDS.stats()
+        return self.make_response(
+            {
+                "index": status,
+                "cache": {
+                    "hits": records.hits,
+                    "misses": records.misses,
+                    "entries": records.entries,
+                    "capacity": records.capacity,
+                    "ratio": records.ratio,
+                },
+            },
+            200 if status["completed"] else 503,
+        )
 
     def head(self) -> ResponseTuple:
         """Alias HEAD to GET"""
@@ -19,8 +19,7 @@ class Image(KodakResource):
         if not flask.current_app.appconfig.expose_source:
             raise RuntimeError
 
-        with database.interface.atomic():
-            image = database.ImageRecord.get(database.ImageRecord.name == image_name)
+        image = database.ImageRecord.from_name(image_name)
 
         # Note that this sends the original source file directly, rather than the symlink named
         # "original". This is because flask will serve the symlink file itself, not the linked file,
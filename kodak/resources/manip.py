@@ -1,15 +1,95 @@
+import contextlib
 import datetime
+from typing import Dict
+from typing import Iterable
+from typing import Optional
 
 import flask
-import peewee
+import werkzeug.datastructures
 
+from kodak import configuration
 from kodak import constants
 from kodak import database
+from kodak import exceptions
 from kodak.resources._shared import authenticated
 from kodak.resources._shared import KodakResource
 from kodak.resources._shared import ResponseTuple
 
 
+def negotiate(
+    accept: werkzeug.datastructures.MIMEAccept,
+    formats: Iterable[constants.ImageFormat],
+    rendered: Dict[constants.ImageFormat, int],
+) -> Optional[constants.ImageFormat]:
+    """Select the image format to send to a client based on its ``Accept`` header
+
+    Formats are ranked by the quality value the client assigns them, and formats the client names
+    explicitly are preferred over formats it only accepts via a wildcard. Between equally ranked
+    explicit formats the smallest variant that has already been rendered wins, followed by the
+    order the client listed them in. Formats only matched by a wildcard are selected in the order
+    of :data:`constants.WILDCARD_FORMAT_PREFERENCE` regardless of size, since a wildcard does not
+    mean the client can decode every format.
+
+    :param accept: Parsed ``Accept`` header of the request. If the client did not send the header
+                   then every format is treated as acceptable.
+    :param formats: Formats that the manipulation can be rendered in
+    :param rendered: Mapping of formats that have already been rendered to their size in bytes
+    :returns: The selected image format, or ``None`` if the client does not accept any of them
+    """
+    if not accept.provided:
+        accept = werkzeug.datastructures.MIMEAccept([("*/*", 1)])
+
+    explicit = [value.lower() for value, _ in accept]
+
+    ranked = []
+    for format_ in formats:
+        quality = accept.quality(format_.mimetype)
+        if quality <= 0:
+            continue
+        if format_.mimetype in explicit:
+            key = (
+                -quality,
+                False,
+                format_ not in rendered,
+                rendered.get(format_, 0),
+                explicit.index(format_.mimetype),
+            )
+        else:
+            key = (
+                -quality,
+                True,
+                False,
+                0,
+                constants.WILDCARD_FORMAT_PREFERENCE.index(format_),
+            )
+        ranked.append((key, format_))
+
+    return min(ranked, key=lambda item: item[0])[1] if ranked else None
+
+
+def _send_manip(
+    image_name: str,
+    manip_config: configuration.ManipConfig,
+    format_: constants.ImageFormat,
+) -> flask.Response:
+    parent = database.ImageRecord.from_name(image_name)
+
+    manip = database.ManipRecord.get_or_render(
+        parent, flask.current_app.appconfig, manip_config, format_
+    )
+
+    resp = flask.send_file(
+        (flask.current_app.appconfig.content_dir / manip.file),
+        mimetype=format_.mimetype,
+        cache_timeout=int(datetime.timedelta(days=365).total_seconds()),
+        add_etags=False,
+    )
+
+    resp.headers["Content-Digest"] = manip.checksum.as_header()
+
+    return resp
+
+
 class ImageManip(KodakResource):
     """Handle generating and returning a processed image manip"""
 
@@ -26,34 +106,63 @@ class ImageManip(KodakResource):
         except KeyError:
             raise RuntimeError("Manip or format doesn't exist") from None
 
+        return _send_manip(image_name, manip_config, format_)
+
+    def head(self, image_name: str, manip_name: str, format_name: str) -> ResponseTuple:
+        """Alias HEAD to GET"""
+        return self._head(self.get(image_name, manip_name, format_name))
+
+
+class ImageManipNegotiated(KodakResource):
+    """Handle returning a processed image manip in the best format the client accepts"""
+
+    routes = ("/image/<string:image_name>/<string:manip_name>",)
+
+    @authenticated
+    def get(  # pylint: disable=no-self-use
+        self, image_name: str, manip_name: str
+    ) -> flask.Response:
+        """Retrieve an image variation in a format selected from the ``Accept`` header"""
+        try:
+            manip_config = flask.current_app.appconfig.manips[manip_name]
+        except KeyError:
+            raise RuntimeError("Manip doesn't exist") from None
+
         with database.interface.atomic():
-            parent = database.ImageRecord.get(database.ImageRecord.name == image_name)
-
-            try:
-                manip = (
-                    database.ManipRecord.select()
-                    .where(
-                        database.ManipRecord.parent == parent,
-                        database.ManipRecord.name == manip_config.name,
-                        database.ManipRecord.format_ == format_,
-                    )
-                    .get()
+            query = (
+                database.ManipRecord.select(
+                    database.ManipRecord.format_, database.ManipRecord.file
                 )
-            except peewee.DoesNotExist:
-                manip = database.ManipRecord.from_parent(
-                    parent, flask.current_app.appconfig, manip_config, format_
+                .join(database.ImageRecord)
+                .where(
+                    database.ImageRecord.name == image_name,
+                    database.ManipRecord.name == manip_config.name,
                 )
+            )
+            records = list(query)
 
-        resp = flask.send_file(
-            (flask.current_app.appconfig.content_dir / manip.file),
-            cache_timeout=int(datetime.timedelta(days=365).total_seconds()),
-            add_etags=False,
+        rendered: Dict[constants.ImageFormat, int] = {}
+        for record in records:
+            with contextlib.suppress(FileNotFoundError):
+                rendered[record.format_] = (
+                    (flask.current_app.appconfig.content_dir / record.file)
+                    .stat()
+                    .st_size
+                )
+
+        format_ = negotiate(
+            flask.request.accept_mimetypes, manip_config.formats, rendered
         )
+        if format_ is None:
+            raise exceptions.UnacceptableFormatError(
+                f"None of the formats of manip '{manip_config.name}' are acceptable to the client"
+            )
 
-        resp.headers["Content-Digest"] = manip.checksum.as_header()
+        resp = _send_manip(image_name, manip_config, format_)
+        resp.vary.add("Accept")
 
         return resp
 
-    def head(self, image_name: str, manip_name: str, format_name: str) -> ResponseTuple:
+    def head(self, image_name: str, manip_name: str) -> ResponseTuple:
         """Alias HEAD to GET"""
-        return self._head(self.get(image_name, manip_name, format_name))
+        return self._head(self.get(image_name, manip_name))
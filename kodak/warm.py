@@ -0,0 +1,149 @@
+"""Pre-generate image manipulations ahead of client requests
+
+Manips are normally rendered the first time a client requests them, which means the first
+client to request every manip pays the full render latency. Warming the cache renders every
+missing manip up front so that client traffic only ever sees cached responses. Manips that have
+already been rendered are skipped, so an interrupted warm-up can be resumed by running it again.
+"""
+import concurrent.futures
+import datetime
+import fnmatch
+import logging
+import time
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from kodak import configuration
+from kodak import constants
+from kodak import database
+
+
+class WarmJob(NamedTuple):
+    """Container of the missing manips for a single source image
+
+    :param image: Source image record that the manips will be rendered from
+    :param variants: Sequence of manip configs and formats that need to be rendered
+    """
+
+    image: database.ImageRecord
+    variants: List[Tuple[configuration.ManipConfig, constants.ImageFormat]]
+
+
+def identify(
+    config: configuration.KodakConfig,
+    pattern: str = "*",
+    manips: Optional[Iterable[str]] = None,
+) -> List[WarmJob]:
+    """Identify the manips that have not been rendered yet
+
+    :param config: Populated application configuration object
+    :param pattern: Glob pattern that image names must match to be included
+    :param manips: Names of the manips to include; defaults to all configured manips
+    :returns: List of jobs for every image that has at least one missing manip
+    """
+    selected = [
+        config.manips[name] for name in (manips or sorted(config.manips.keys()))
+    ]
+
+    with database.interface.atomic():
+        existing: Set[Tuple[int, str, constants.ImageFormat]] = {
+            (item.parent_id, item.name, item.format_)
+            for item in database.ManipRecord.select(
+                database.ManipRecord.parent,
+                database.ManipRecord.name,
+                database.ManipRecord.format_,
+            )
+        }
+
+        images = database.ImageRecord.select().where(
+            database.ImageRecord.deleted  # pylint: disable=singleton-comparison
+            == False
+        )
+
+        jobs = []
+        for image in images:
+            if not fnmatch.fnmatchcase(image.name, pattern):
+                continue
+            variants = [
+                (manip, format_)
+                for manip in selected
+                for format_ in sorted(manip.formats, key=lambda item: item.name)
+                if (image.id, manip.name, format_) not in existing
+            ]
+            if variants:
+                jobs.append(WarmJob(image=image, variants=variants))
+
+    return jobs
+
+
+def warm(
+    config: configuration.KodakConfig,
+    pattern: str = "*",
+    manips: Optional[Iterable[str]] = None,
+) -> Tuple[int, int]:
+    """Render every missing manip
+
+    Renders are dispatched to the render engine, so the number of concurrent renders is
+    controlled by ``config.render.workers``. Progress counts every missing manip once it has been
+    rendered, found to have been rendered by another worker in the meantime, or failed to render.
+
+    :param config: Populated application configuration object
+    :param pattern: Glob pattern that image names must match to be included
+    :param manips: Names of the manips to include; defaults to all configured manips
+    :returns: Number of manips that were rendered, and number of manips that failed to render
+    """
+    logger = logging.getLogger(__name__)
+
+    jobs = identify(config, pattern, manips)
+    total = sum(len(job.variants) for job in jobs)
+
+    logger.info(f"Identified {total} missing manips of {len(jobs)} images")
+
+    def _warm(job: WarmJob) -> int:
+        rendered = [0]
+
+        def _on_render(count: int) -> None:
+            rendered[0] += count
+
+        with database.interface.connection_context():
+            database.ManipRecord.get_or_render_many(
+                job.image, config, job.variants, on_render=_on_render
+            )
+        return rendered[0]
+
+    rendered = 0
+    failed = 0
+    processed = 0
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(config.render.workers, 1)
+    ) as executor:
+        futures = {executor.submit(_warm, job): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            processed += len(job.variants)
+            try:
+                rendered += future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                failed += len(job.variants)
+                logger.error(
+                    f"Failed to render manips of image {job.image.name}: {err}"
+                )
+
+            elapsed = time.monotonic() - start
+            remaining = datetime.timedelta(
+                seconds=round(elapsed / processed * (total - processed))
+            )
+            logger.info(
+                f"Processed {processed}/{total} manips ({processed / total:.1%}), {failed} failed; ETA {remaining}"
+            )
+
+    logger.info(
+        f"Rendered {rendered} manips, {processed - rendered - failed} were rendered by another worker, and {failed} failed to render"
+    )
+
+    return rendered, failed
@@ -0,0 +1,350 @@
+"""Keep the source image index up to date by watching the source directory for changes
+
+Rather than periodically walking the entire source directory, the watcher subscribes to
+filesystem events for every directory in the tree using Linux's
+`inotify <https://man7.org/linux/man-pages/man7/inotify.7.html>`_ API (accessed through
+:mod:`ctypes`, so no additional dependencies are required). Events are collected until the source
+directory has been quiet for a short period and are then applied to the index in a single batch
+(see :func:`index.update`), so a file that is written in several chunks is only indexed once.
+
+Some events cannot be reliably applied incrementally: if the kernel's event queue overflows then
+events have been lost, and if a directory is moved then the paths of everything beneath it have
+changed. In either case the watcher falls back to a full rebuild of the index (see
+:func:`index.build`) and starts watching the tree from scratch.
+
+::
+
+  from kodak import watch
+
+  watch.watch(config)
+"""
+import ctypes
+import ctypes.util
+import enum
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Dict
+from typing import Iterator
+from typing import NamedTuple
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from kodak import configuration
+from kodak import index
+
+
+class InotifyFlag(enum.IntFlag):
+    """Flags used by the inotify API
+
+    See ``/usr/include/linux/inotify.h``
+    """
+
+    MODIFY = 0x00000002
+    CLOSE_WRITE = 0x00000008
+    MOVED_FROM = 0x00000040
+    MOVED_TO = 0x00000080
+    CREATE = 0x00000100
+    DELETE = 0x00000200
+    DELETE_SELF = 0x00000400
+    MOVE_SELF = 0x00000800
+    UNMOUNT = 0x00002000
+    Q_OVERFLOW = 0x00004000
+    IGNORED = 0x00008000
+    ONLYDIR = 0x01000000
+    ISDIR = 0x40000000
+    NONBLOCK = 0o4000
+    CLOEXEC = 0o2000000
+
+
+WATCH_MASK = (
+    InotifyFlag.CLOSE_WRITE
+    | InotifyFlag.MODIFY
+    | InotifyFlag.MOVED_FROM
+    | InotifyFlag.MOVED_TO
+    | InotifyFlag.CREATE
+    | InotifyFlag.DELETE
+    | InotifyFlag.DELETE_SELF
+    | InotifyFlag.MOVE_SELF
+    | InotifyFlag.ONLYDIR
+)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Event(NamedTuple):
+    """Single inotify event
+
+    :param path: Path of the file or directory that the event applies to. If the event applies to
+                 the watched directory itself then this is the path of the directory.
+    :param mask: Flags describing the event
+    """
+
+    path: Path
+    mask: InotifyFlag
+
+
+class Inotify:
+    """Minimal wrapper around an inotify instance
+
+    ::
+
+      with Inotify() as inotify:
+          inotify.add(path)
+          for event in inotify.read(timeout=1):
+              ...
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd: Optional[int] = None
+        # A directory reached through several paths (such as through a symbolic link) has a single
+        # watch, whose events are reported for each of the paths
+        self._watches: Dict[int, Set[Path]] = {}
+
+    def __enter__(self):
+        self._fd = self._libc.inotify_init1(InotifyFlag.NONBLOCK | InotifyFlag.CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(
+                errno, f"Failed to create inotify instance: {os.strerror(errno)}"
+            )
+        return self
+
+    def __exit__(self, *_):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+        self._watches = {}
+
+    @property
+    def watches(self) -> Set[Path]:
+        """Paths of the currently watched directories"""
+        return set().union(*self._watches.values())
+
+    def add(self, path: Path) -> None:
+        """Start watching a directory
+
+        :param path: Path to the directory to watch. Subdirectories are not watched. If the path
+                     is a symbolic link then the directory it points to is watched, and events are
+                     reported relative to the link.
+        """
+        descriptor = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), ctypes.c_uint32(WATCH_MASK)
+        )
+        if descriptor < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"Failed to watch {path}: {os.strerror(errno)}")
+        self._watches.setdefault(descriptor, set()).add(path)
+
+    def read(self, timeout: Optional[float] = None) -> Iterator[Event]:
+        """Read pending events, waiting for some to arrive if there are none
+
+        :param timeout: Number of seconds to wait for events. If ``None`` then wait indefinitely.
+        :returns: Iterator of the pending events
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            flags = InotifyFlag(mask)
+            if flags & InotifyFlag.Q_OVERFLOW:
+                yield Event(path=Path(), mask=flags)
+                continue
+
+            directories = (
+                self._watches.pop(descriptor, set())
+                if flags & InotifyFlag.IGNORED
+                else self._watches.get(descriptor, set())
+            )
+            for directory in sorted(directories):
+                yield Event(
+                    path=directory / os.fsdecode(name) if name else directory,
+                    mask=flags,
+                )
+
+
+class Watcher:
+    """Apply changes to the source directory to the index as they happen
+
+    :param config: Populated application configuration object
+    """
+
+    def __init__(self, config: configuration.KodakConfig):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self._pending: Set[Path] = set()
+        self._first_event: Optional[float] = None
+        self._last_event: Optional[float] = None
+        self._visited: Set[Tuple[int, int]] = set()
+
+    def _watch_tree(self, inotify: Inotify, path: Path) -> None:
+        """Watch a directory and every directory beneath it
+
+        Symbolic links are followed the same way as :func:`index.walk` follows them, so every
+        directory that is indexed is watched: each linked directory is only entered once so that
+        a link cycle cannot cause an infinite walk.
+        """
+        directories = [path]
+        while directories:
+            directory = directories.pop()
+            try:
+                inotify.add(directory)
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not entry.is_dir():
+                            continue
+                        if entry.is_symlink():
+                            stat = entry.stat()
+                            if (stat.st_dev, stat.st_ino) in self._visited:
+                                continue
+                            self._visited.add((stat.st_dev, stat.st_ino))
+                        directories.append(Path(entry.path))
+            except OSError as err:
+                self.logger.warning(f"Failed to watch directory {directory}: {err}")
+
+    def _handle(self, inotify: Inotify, event: Event) -> bool:
+        """Process a single event
+
+        :returns: Whether the index needs a full rebuild
+        """
+        if event.mask & InotifyFlag.Q_OVERFLOW:
+            self.logger.warning(
+                "Inotify event queue overflowed, changes may have been missed"
+            )
+            return True
+
+        # A symbolic link to a directory is reported as a file, but is walked like a directory
+        if (
+            event.mask & InotifyFlag.CREATE
+            and not event.mask & InotifyFlag.ISDIR
+            and event.path.is_symlink()
+            and event.path.is_dir()
+        ):
+            stat = event.path.stat()
+            if (stat.st_dev, stat.st_ino) in self._visited:
+                return False
+            self._visited.add((stat.st_dev, stat.st_ino))
+            event = Event(path=event.path, mask=event.mask | InotifyFlag.ISDIR)
+
+        if event.mask & InotifyFlag.ISDIR:
+            if event.mask & (InotifyFlag.MOVED_FROM | InotifyFlag.MOVED_TO):
+                self.logger.info(f"Directory {event.path} was moved")
+                return True
+            if event.mask & InotifyFlag.CREATE:
+                self.logger.debug(f"Watching new directory {event.path}")
+                self._watch_tree(inotify, event.path)
+                # Files may have been created in the directory before it was being watched
+                self._pending.update(index.walk(event.path))
+            return False
+
+        if event.mask & (InotifyFlag.DELETE_SELF | InotifyFlag.MOVE_SELF):
+            if event.path == self.config.source_dir:
+                self.logger.warning(
+                    f"Source directory {self.config.source_dir} was removed or moved"
+                )
+                return True
+            return False
+
+        if event.mask & InotifyFlag.IGNORED:
+            return False
+
+        self._pending.add(event.path)
+        return False
+
+    def _flush(self) -> None:
+        paths = self._pending
+        self._pending = set()
+        self._first_event = None
+        self._last_event = None
+        self.logger.info(f"Applying changes to {len(paths)} source files")
+        try:
+            index.update(self.config, paths)
+        except Exception:  # pylint: disable=broad-except
+            # The database may be locked by a build in another process, or a file may have
+            # vanished while it was being read: keep the changes and retry them once the debounce
+            # period has passed again rather than ending the watch
+            self.logger.exception(
+                f"Failed to apply changes to {len(paths)} source files, retrying later"
+            )
+            self._pending.update(paths)
+            self._first_event = self._last_event = time.monotonic()
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        now = time.monotonic()
+        return (
+            now - self._last_event >= self.config.index.watch_debounce
+            or now - self._first_event >= self.config.index.watch_max_delay
+        )
+
+    def run(self) -> None:
+        """Watch the source directory and update the index until interrupted"""
+        while True:
+            with Inotify() as inotify:
+                self.logger.info(f"Watching source directory {self.config.source_dir}")
+                root = self.config.source_dir.stat()
+                self._visited = {(root.st_dev, root.st_ino)}
+                self._watch_tree(inotify, self.config.source_dir)
+                self.logger.info(f"Watching {len(inotify.watches)} directories")
+
+                # The tree is only reconciled once it is being watched so that no change can be
+                # missed in between
+                self._pending = set()
+                index.build(self.config)
+                reconciled = time.monotonic()
+
+                rebuild = False
+                while not rebuild:
+                    for event in inotify.read(timeout=self.config.index.watch_debounce):
+                        now = time.monotonic()
+                        self._first_event = self._first_event or now
+                        self._last_event = now
+                        rebuild = self._handle(inotify, event) or rebuild
+
+                    if rebuild:
+                        break
+
+                    if self._due():
+                        self._flush()
+
+                    if (
+                        self.config.index.watch_reconcile_interval
+                        and time.monotonic() - reconciled
+                        >= self.config.index.watch_reconcile_interval
+                    ):
+                        self.logger.info("Starting periodic reconcile of the index")
+                        try:
+                            index.build(self.config)
+                        except Exception:  # pylint: disable=broad-except
+                            self.logger.exception(
+                                "Periodic reconcile of the index failed, retrying at the next interval"
+                            )
+                        reconciled = time.monotonic()
+
+            self.logger.info("Rebuilding the index and restarting the watcher")
+
+
+def watch(config: configuration.KodakConfig) -> None:
+    """Watch the source directory and keep the index up to date until interrupted
+
+    :param config: Populated application configuration object
+    """
+    Watcher(config).run()
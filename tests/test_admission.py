@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from PIL import Image
+
+from kodak import admission
+from kodak import configuration
+from kodak import constants
+from kodak import engine
+from kodak import exceptions
+
+
+def test_estimate(tmp_path):
+    """Test estimating the decoded size of source images"""
+    manip = configuration.ManipConfig(
+        name="test",
+        scale=configuration.ManipScaleConfig(
+            horizontal=100, strategy=constants.ScaleStrategy.ABSOLUTE
+        ),
+    )
+    Image.new("RGB", (1600, 1200)).save(tmp_path / "image.jpeg")
+    Image.new("RGB", (1600, 1200)).save(tmp_path / "image.png")
+
+    # JPEG images are drafted down to an eighth of their size; other formats are not
+    assert admission.estimate(tmp_path / "image.jpeg", [manip]) == 200 * 150
+    assert admission.estimate(tmp_path / "image.png", [manip]) == 1600 * 1200
+    assert (
+        admission.estimate(tmp_path / "image.jpeg", [configuration.ManipConfig("full")])
+        == 1600 * 1200
+    )
+
+    with pytest.raises(exceptions.ImageTooLargeError):
+        admission.estimate(tmp_path / "image.png", [manip], max_pixels=1600 * 1200 - 1)
+
+
+def test_budget(tmp_path):
+    """Test admitting renders against the shared budget"""
+    budget = admission.PixelBudget(tmp_path, 1000, 0)
+
+    with budget.admit(600):
+        # over budget while the first render is admitted
+        with pytest.raises(exceptions.RenderAdmissionError) as err:
+            with budget.admit(600):
+                pass
+        assert err.value.retry_after == 1
+
+        with budget.admit(400):
+            pass
+
+    # a render larger than the whole budget is admitted once nothing else is
+    with budget.admit(5000):
+        pass
+
+    assert json.loads(budget.ledger.read_text()) == {}
+
+
+def test_budget_dead_process(tmp_path):
+    """Test that reservations of processes that have exited are discarded"""
+    budget = admission.PixelBudget(tmp_path, 1000, 0)
+    budget.ledger.parent.mkdir(parents=True)
+    budget.ledger.write_text(json.dumps({"stale": [2**22 + 1, 1000]}))
+
+    with budget.admit(1000):
+        pass
+
+
+def test_estimate_pillow_limit(tmp_path, monkeypatch):
+    """Test that Pillow's decompression bomb check is kept in the requesting process"""
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    Image.new("RGB", (100, 100)).save(tmp_path / "image.png")
+    manip = configuration.ManipConfig("full")
+
+    with pytest.raises(exceptions.ImageTooLargeError) as err:
+        admission.estimate(tmp_path / "image.png", [manip])
+    assert err.value.status == 422
+
+    engine.RenderEngine(configuration.RenderConfig(workers=0), tmp_path)
+
+    assert Image.MAX_IMAGE_PIXELS == 1000
+    with pytest.raises(exceptions.ImageTooLargeError):
+        admission.estimate(tmp_path / "image.png", [manip], max_pixels=0)
+
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100 * 100)
+    assert admission.estimate(tmp_path / "image.png", [manip]) == 100 * 100
+    with pytest.raises(exceptions.ImageTooLargeError):
+        admission.estimate(tmp_path / "image.png", [manip], max_pixels=100 * 100 - 1)
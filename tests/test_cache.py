@@ -0,0 +1,105 @@
+from PIL import Image
+
+from kodak import cache
+
+
+def test_source_cache_evicts_least_recently_used():
+    """Test that the source cache is bounded by pixel bytes and evicts the oldest entry"""
+    image = Image.new("RGB", (10, 10))
+    sources = cache.SourceCache(cache.image_bytes(image) * 2)
+
+    sources.put("a", image, image.size)
+    sources.put("b", image, image.size)
+    assert sources.get("a") is not None
+
+    sources.put("c", image, image.size)
+
+    assert sources.get("b") is None
+    assert sources.get("a") is not None
+    assert sources.get("c") is not None
+
+    stats = sources.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (3, 1, 2)
+    assert stats.size <= stats.capacity
+
+
+def test_source_cache_minimum_size():
+    """Test that reduced resolution entries are only used when they are large enough"""
+    sources = cache.SourceCache(1 << 20)
+    sources.put("a", Image.new("RGB", (50, 50)), (100, 100))
+
+    assert sources.get("a") is None
+    assert sources.get("a", lambda size: (50, 50)) is not None
+    assert sources.get("a", lambda size: (60, 50)) is None
+
+
+def test_source_cache_disabled():
+    """Test that a zero capacity cache never stores anything"""
+    sources = cache.SourceCache(0)
+    sources.put("a", Image.new("L", (1, 1)), (1, 1))
+
+    assert sources.get("a") is None
+    assert sources.stats().entries == 0
+
+
+def test_record_cache_generation():
+    """Test that the record cache is discarded when the generation changes"""
+    generation = [0]
+    calls = []
+
+    def _generation():
+        calls.append(None)
+        return generation[0]
+
+    records = cache.RecordCache(2, 3600, _generation)
+
+    # records are not stored before the counter has been read
+    records.put("a", 1, None)
+    assert records.get("a") is None
+    current = records.generation()
+    records.put("a", 1, current)
+    records.put("b", 2, current)
+    records.put("c", 3, current)
+    assert records.get("a") is None
+    assert records.get("b") == 2
+    assert records.get("c") == 3
+    assert len(calls) == 1
+
+    # the counter is not read again until the interval has passed
+    generation[0] = 1
+    assert records.get("b") == 2
+    records.interval = 0
+    assert records.get("b") is None
+    assert len(calls) == 2
+
+    stats = records.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (3, 3, 0)
+    assert stats.ratio == 0.5
+
+
+def test_record_cache_stale_put():
+    """Test that a record read before the generation changed is not stored after it changed"""
+    generation = [0]
+    records = cache.RecordCache(2, 0, lambda: generation[0])
+
+    # a lookup misses and the record is read from the database under generation 0
+    current = records.generation()
+    assert records.get("a") is None
+
+    # an index build changes the record and another lookup observes the new generation
+    generation[0] = 1
+    assert records.get("b") is None
+
+    records.put("a", "stale", current)
+    assert records.get("a") is None
+
+    current = records.generation()
+    records.put("a", "fresh", current)
+    assert records.get("a") == "fresh"
+
+
+def test_record_cache_disabled():
+    """Test that a cache with no capacity never stores records or reads the counter"""
+    records = cache.RecordCache(0, 0, lambda: 1 / 0)
+    records.put("a", 1, records.generation())
+    assert records.get("a") is None
@@ -172,3 +172,82 @@ def test_conf_manip(monkeypatch):
     with mockenv(monkeypatch, {"KODAK_MANIP_TERRIBLE_CROP_ANCHOR": "ahoy"}):
         with pytest.raises(exceptions.ConfigurationError):
             configuration.load()
+
+
+def test_conf_manip_encoders(monkeypatch):
+    """Test the manipulation encoder config objects and env parsers"""
+
+    manip = configuration.ManipConfig(name="test")
+    assert manip.jpeg == configuration.ManipJpegConfig()
+    assert manip.png == configuration.ManipPngConfig()
+    assert manip.webp == configuration.ManipWebpConfig()
+
+    with mockenv(
+        monkeypatch,
+        {
+            "KODAK_MANIP_BIFF_FORMATS": "webp,jpeg",
+            "KODAK_MANIP_BIFF_JPEG_QUALITY": "85",
+            "KODAK_MANIP_BIFF_JPEG_PROGRESSIVE": "true",
+            "KODAK_MANIP_BIFF_JPEG_OPTIMIZE": "TRUE",
+            "KODAK_MANIP_BIFF_JPEG_SUBSAMPLING": "4:4:4",
+            "KODAK_MANIP_BIFF_PNG_COMPRESS_LEVEL": "9",
+            "KODAK_MANIP_BIFF_PNG_OPTIMIZE": "true",
+            "KODAK_MANIP_BIFF_WEBP_QUALITY": "60",
+            "KODAK_MANIP_BIFF_WEBP_LOSSLESS": "true",
+            "KODAK_MANIP_BIFF_WEBP_METHOD": "6",
+        },
+    ):
+        manip = configuration.load().manips["biff"]
+        assert manip.formats == {constants.ImageFormat.WEBP, constants.ImageFormat.JPEG}
+        assert manip.jpeg.quality == 85
+        assert manip.jpeg.progressive
+        assert manip.jpeg.optimize
+        assert manip.jpeg.subsampling == constants.ChromaSubsampling.NONE
+        assert manip.png.compress_level == 9
+        assert manip.png.optimize
+        assert manip.webp.quality == 60
+        assert manip.webp.lossless
+        assert manip.webp.method == 6
+
+    # bad subsampling value
+    with mockenv(monkeypatch, {"KODAK_MANIP_TERRIBLE_JPEG_SUBSAMPLING": "4:1:1"}):
+        with pytest.raises(exceptions.ConfigurationError):
+            configuration.load()
+
+
+def test_conf_manip_adjustments(monkeypatch):
+    """Test the manipulation color adjustment settings"""
+
+    with mockenv(
+        monkeypatch,
+        {
+            "KODAK_MANIP_BIFF_BRIGHTNESS": "-20",
+            "KODAK_MANIP_BIFF_CONTRAST": "100",
+            "KODAK_MANIP_BIFF_SEPIA": "true",
+        },
+    ):
+        manip = configuration.load().manips["biff"]
+        assert manip.brightness == -20
+        assert manip.contrast == 100
+        assert manip.sepia
+
+    # out of range values
+    for setting in ("BRIGHTNESS", "CONTRAST"):
+        with mockenv(monkeypatch, {f"KODAK_MANIP_TERRIBLE_{setting}": "101"}):
+            with pytest.raises(exceptions.ConfigurationError):
+                configuration.load()
+
+
+def test_conf_index_checksum(monkeypatch):
+    """Test the source image checksum algorithm setting"""
+
+    assert configuration.load().index.checksum == "sha256"
+
+    with mockenv(monkeypatch, {"KODAK_INDEX_CHECKSUM": "BLAKE2b"}):
+        assert configuration.load().index.checksum == "blake2b"
+
+    # unknown and variable length algorithms
+    for algorithm in ("crc32", "shake_128"):
+        with mockenv(monkeypatch, {"KODAK_INDEX_CHECKSUM": algorithm}):
+            with pytest.raises(exceptions.ConfigurationError):
+                configuration.load()
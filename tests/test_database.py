@@ -0,0 +1,482 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import peewee
+import pytest
+
+from kodak import configuration
+from kodak import constants
+from kodak import database
+from kodak import exceptions
+from kodak import locking
+
+
+@pytest.mark.parametrize("algorithm", ["sha256", "blake2b", "sha3_256", "md5"])
+def test_checksum_from_path(tmp_path, algorithm):
+    """Test checksumming a file with each supported algorithm"""
+    data = bytes(range(256)) * 5000
+    (tmp_path / "image.jpeg").write_bytes(data)
+
+    checksum = database.Checksum.from_path(
+        tmp_path / "image.jpeg", algorithm, buffer_size=4096
+    )
+
+    assert checksum == database.Checksum(
+        algorithm=algorithm, digest=hashlib.new(algorithm, data).hexdigest()
+    )
+
+
+@pytest.mark.parametrize(
+    "algorithm,header",
+    [
+        ("sha256", "sha-256"),
+        ("sha512", "sha-512"),
+        ("sha1", "sha"),
+        ("md5", "md5"),
+        ("blake2b", "blake2b"),
+        ("sha3_256", "sha3-256"),
+        ("sha512_256", "sha512-256"),
+    ],
+)
+def test_checksum_header(algorithm, header):
+    """Test the Content-Digest header key of each algorithm"""
+    assert database.Checksum(algorithm, "abc123").as_header() == f"{header}=abc123"
+
+
+def test_migrate_unique_manip(tmp_path):
+    """Test that duplicate manip records are removed before the unique index is added"""
+    config = configuration.KodakConfig()
+    config.database.sqlite.path = tmp_path / "kodak.db"
+
+    database.initialize(config)
+    parent = database.ImageRecord.create(
+        name="foo",
+        source="foo.jpg",
+        format_=constants.ImageFormat.JPEG,
+        checksum=database.Checksum("sha256", "abc123"),
+    )
+    manip = {
+        "parent": parent,
+        "name": "thumb",
+        "file": "foo/thumb.jpeg",
+        "format_": constants.ImageFormat.JPEG,
+        "checksum": database.Checksum("sha256", "def456"),
+    }
+    first = database.ManipRecord.create(**manip)
+
+    with pytest.raises(peewee.IntegrityError):
+        database.ManipRecord.create(**manip)
+
+    # emulate a table created before the unique index existed
+    database.interface.execute_sql('DROP INDEX "maniprecord_parent_id_name_format_"')
+    database.ManipRecord.create(**manip)
+    database.ManipRecord.create(**manip)
+    assert database.ManipRecord.select().count() == 3
+
+    database.initialize(config)
+
+    assert [item.id for item in database.ManipRecord.select()] == [first.id]
+    with pytest.raises(peewee.IntegrityError):
+        database.ManipRecord.create(**manip)
+
+    record = database.ManipRecord(**manip).insert_or_get()
+    assert record.id == first.id
+
+
+def test_migrate_indexes(tmp_path):
+    """Test that indexes are added to tables created before they were declared"""
+    config = configuration.KodakConfig()
+    config.database.sqlite.path = tmp_path / "kodak.db"
+
+    database.initialize(config)
+    indexes = {item.name for item in database.interface.get_indexes("imagerecord")} | {
+        item.name for item in database.interface.get_indexes("maniprecord")
+    }
+    assert {
+        "imagerecord_name",
+        "imagerecord_source",
+        "imagerecord_id_live",
+        "maniprecord_parent_id_name_format_",
+    } <= indexes
+
+    for name in ("imagerecord_name", "imagerecord_source", "imagerecord_id_live"):
+        database.interface.execute_sql(f'DROP INDEX "{name}"')
+
+    records = [
+        database.ImageRecord.create(
+            name="foo",
+            source=source,
+            format_=constants.ImageFormat.JPEG,
+            checksum=database.Checksum("sha256", "abc123"),
+        )
+        for source in ("foo.jpg", "foo.png")
+    ]
+    database.ManipRecord.create(
+        parent=records[1],
+        name="thumb",
+        file="foo/thumb.jpeg",
+        format_=constants.ImageFormat.JPEG,
+        checksum=database.Checksum("sha256", "def456"),
+    )
+
+    database.initialize(config)
+
+    assert {item.name for item in database.interface.get_indexes("imagerecord")} >= {
+        "imagerecord_name",
+        "imagerecord_source",
+        "imagerecord_id_live",
+    }
+    assert [item.id for item in database.ImageRecord.select()] == [records[0].id]
+    assert database.ManipRecord.select().count() == 0
+
+
+def test_migrate_live_duplicate(tmp_path):
+    """Test that a live image is kept over an older deleted duplicate and its manips removed"""
+    config = configuration.KodakConfig(content_dir=tmp_path / "content")
+    config.database.sqlite.path = tmp_path / "kodak.db"
+
+    database.initialize(config)
+    database.interface.execute_sql('DROP INDEX "imagerecord_name"')
+
+    deleted, live = [
+        database.ImageRecord.create(
+            name="foo",
+            source=source,
+            format_=constants.ImageFormat.JPEG,
+            checksum=database.Checksum("sha256", "abc123"),
+            deleted=source == "foo.png",
+        )
+        for source in ("foo.png", "foo.jpg")
+    ]
+    for parent, name in ((deleted, "thumb"), (deleted, "small"), (live, "thumb")):
+        database.ManipRecord.create(
+            parent=parent,
+            name=name,
+            file=f"foo/{name}.jpeg",
+            format_=constants.ImageFormat.JPEG,
+            checksum=database.Checksum("sha256", "def456"),
+        )
+    (config.content_dir / "foo").mkdir(parents=True)
+    (config.content_dir / "foo" / "thumb.jpeg").touch()
+    (config.content_dir / "foo" / "small.jpeg").touch()
+
+    database.initialize(config)
+
+    assert [item.id for item in database.ImageRecord.select()] == [live.id]
+    assert not database.ImageRecord.from_name("foo").deleted
+    assert database.ManipRecord.select().count() == 0
+    assert list((config.content_dir / "foo").iterdir()) == []
+
+
+def test_migrate_indexes_race(tmp_path, monkeypatch):
+    """Test that an index added by another process during the migration is tolerated"""
+    config = configuration.KodakConfig()
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    database.initialize(config)
+
+    # Every process sees the index as missing, but another process adds it first, on a backend
+    # that does not support "IF NOT EXISTS"
+    get_indexes = peewee.SqliteDatabase.get_indexes
+    seen = set()
+
+    def _get_indexes(self, table, schema=None):
+        if table in seen:
+            return get_indexes(self, table, schema)
+        seen.add(table)
+        return [
+            item
+            for item in get_indexes(self, table, schema)
+            if item.name != "imagerecord_source"
+        ]
+
+    monkeypatch.setattr(peewee.SqliteDatabase, "get_indexes", _get_indexes)
+    monkeypatch.setattr(peewee.SqliteDatabase, "safe_create_index", False)
+
+    database.initialize(config)
+
+    assert "imagerecord_source" in {
+        item.name for item in database.interface.get_indexes("imagerecord")
+    }
+
+
+def test_record_cache(tmp_path):
+    """Test that cached image records are served until the generation is bumped"""
+    config = configuration.KodakConfig()
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    config.database.cache_interval = 0
+    database.initialize(config)
+
+    record = database.ImageRecord.create(
+        name="foo",
+        source="foo.jpg",
+        format_=constants.ImageFormat.JPEG,
+        checksum=database.Checksum("sha256", "abc123"),
+    )
+    assert database.ImageRecord.from_name("foo").id == record.id
+
+    database.ImageRecord.update(name="bar").execute()
+    assert database.ImageRecord.from_name("foo").id == record.id
+
+    database.GenerationRecord.bump()
+    with pytest.raises(peewee.DoesNotExist):
+        database.ImageRecord.from_name("foo")
+    assert database.ImageRecord.from_name("bar").id == record.id
+
+
+def test_batcher_variables(tmp_path):
+    """Test that bulk writes are split only where the variable limit requires it"""
+    config = configuration.KodakConfig()
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    database.initialize(config)
+
+    assert database.Batcher.from_database(
+        database.interface.obj
+    ).variables == database.interface.connection().getlimit(
+        sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER
+    )
+
+    records = [
+        database.ImageRecord(
+            name=f"image{item}",
+            source=f"image{item}.jpg",
+            format_=constants.ImageFormat.JPEG,
+            checksum=database.Checksum("sha256", "abc123"),
+        )
+        for item in range(25)
+    ]
+    batcher = database.Batcher(variables=30)
+
+    # Each inserted record binds its two values and the defaults of three other columns
+    assert [
+        len(batch)
+        for batch in batcher.batches(
+            lambda batch: database.ImageRecord.insert_many(
+                [(record.name, record.source) for record in batch],
+                fields=[database.ImageRecord.name, database.ImageRecord.source],
+            ),
+            records,
+        )
+    ] == [6, 6, 6, 6, 1]
+
+    with database.interface.atomic():
+        batcher.bulk_create(database.ImageRecord, records)
+        records = list(database.ImageRecord.select())
+        for record in records:
+            record.deleted = True
+        assert (
+            batcher.bulk_update(
+                database.ImageRecord, records, fields=[database.ImageRecord.deleted]
+            )
+            == 25
+        )
+
+    assert database.ImageRecord.select().count() == 25
+    assert (
+        database.ImageRecord.select().where(database.ImageRecord.deleted).count() == 25
+    )
+
+
+def test_batcher_packet():
+    """Test that batches are split by the estimated size of their values"""
+    batcher = database.Batcher(packet=1000)
+
+    def statement(batch):
+        return database.ImageRecord.select().where(database.ImageRecord.name.in_(batch))
+
+    batches = list(batcher.batches(statement, ["a" * 100] * 30))
+
+    assert sum(len(batch) for batch in batches) == 30
+    assert all(1 < len(batch) < 10 for batch in batches)
+    assert list(batcher.batches(statement, ["a"] * 30)) == [["a"] * 30]
+
+
+def test_batcher_packet_update(tmp_path, monkeypatch):
+    """Test that every value bound by a bulk update counts towards the statement size"""
+    config = configuration.KodakConfig()
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    database.initialize(config)
+
+    with database.interface.atomic():
+        database.ImageRecord.insert_many(
+            [
+                {
+                    "name": f"image{item}",
+                    "source": f"image{item}.jpg",
+                    "format_": constants.ImageFormat.JPEG,
+                    "checksum": database.Checksum("sha256", "abc123"),
+                }
+                for item in range(50)
+            ]
+        ).execute()
+    records = list(database.ImageRecord.select())
+    for record in records:
+        record.source = f"{'album/' * 20}{record.source}"
+        record.checksum = database.Checksum("sha256", "def456")
+        record.deleted = True
+
+    statements = []
+    execute_sql = database.interface.obj.execute_sql
+
+    def _execute_sql(sql, params=None, *args, **kwargs):
+        if sql.startswith("UPDATE"):
+            statements.append(len(sql) + sum(len(str(value)) for value in params))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    monkeypatch.setattr(database.interface.obj, "execute_sql", _execute_sql)
+
+    batcher = database.Batcher(packet=4096)
+    with database.interface.atomic():
+        assert (
+            batcher.bulk_update(
+                database.ImageRecord,
+                records,
+                fields=[
+                    database.ImageRecord.source,
+                    database.ImageRecord.checksum,
+                    database.ImageRecord.deleted,
+                ],
+            )
+            == 50
+        )
+
+    assert len(statements) > 1
+    assert all(size <= 4096 for size in statements)
+    assert max(statements) > 4096 * 0.75
+    assert (
+        database.ImageRecord.select().where(database.ImageRecord.deleted).count() == 50
+    )
+
+
+def test_batcher_update_size(tmp_path, monkeypatch):
+    """Test that bulk updates are capped in size even when the database limits allow more"""
+    config = configuration.KodakConfig()
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    database.initialize(config)
+    monkeypatch.setattr(constants, "BULK_UPDATE_BATCH_SIZE", 20)
+
+    with database.interface.atomic():
+        database.ImageRecord.insert_many(
+            [
+                {
+                    "name": f"image{item}",
+                    "source": f"image{item}.jpg",
+                    "format_": constants.ImageFormat.JPEG,
+                    "checksum": database.Checksum("sha256", "abc123"),
+                }
+                for item in range(50)
+            ]
+        ).execute()
+    records = list(database.ImageRecord.select())
+    for record in records:
+        record.deleted = True
+
+    statements = []
+    execute_sql = database.interface.obj.execute_sql
+
+    def _execute_sql(sql, params=None, *args, **kwargs):
+        if sql.startswith("UPDATE"):
+            statements.append(sql.count("WHEN"))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    monkeypatch.setattr(database.interface.obj, "execute_sql", _execute_sql)
+
+    batcher = database.Batcher(variables=32766)
+    with database.interface.atomic():
+        assert (
+            batcher.bulk_update(
+                database.ImageRecord, records, fields=[database.ImageRecord.deleted]
+            )
+            == 50
+        )
+
+    assert statements == [20, 20, 10]
+    assert (
+        database.ImageRecord.select().where(database.ImageRecord.deleted).count() == 50
+    )
+
+
+def test_render_releases_connection(tmp_path, monkeypatch):
+    """Test that no database connection is held while a manip is rendered"""
+    config = configuration.KodakConfig(content_dir=tmp_path)
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    database.initialize(config)
+    parent = database.ImageRecord.create(
+        name="foo",
+        source="foo.jpg",
+        format_=constants.ImageFormat.JPEG,
+        checksum=database.Checksum("sha256", "abc123"),
+    )
+    manip = configuration.ManipConfig(name="small")
+
+    closed = []
+
+    def _from_parent_many(parent, config, variants, deadline=None):
+        closed.append(database.interface.is_closed())
+        return [
+            database.ManipRecord(
+                parent=parent,
+                name=manip.name,
+                file=f"foo/{manip.name}.{format_.name.lower()}",
+                format_=format_,
+                checksum=database.Checksum("sha256", "def456"),
+            )
+            for manip, format_ in variants
+        ]
+
+    monkeypatch.setattr(database.ManipRecord, "from_parent_many", _from_parent_many)
+
+    assert not database.interface.is_closed()
+    record = database.ManipRecord.get_or_render(
+        parent, config, manip, constants.ImageFormat.JPEG
+    )
+
+    assert closed == [True]
+    assert database.ManipRecord.get_by_id(record.id).name == "small"
+
+
+def test_render_lock_deadline(tmp_path):
+    """Test that waiting on the render locks of several manips shares one deadline"""
+    config = configuration.KodakConfig(content_dir=tmp_path)
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    config.render.timeout = 0.5
+    database.initialize(config)
+    parent = database.ImageRecord.create(
+        name="foo",
+        source="foo.jpg",
+        format_=constants.ImageFormat.JPEG,
+        checksum=database.Checksum("sha256", "abc123"),
+    )
+    variants = [
+        (configuration.ManipConfig(name=f"manip{item}"), constants.ImageFormat.JPEG)
+        for item in range(4)
+    ]
+
+    # Locks are taken in order of their paths
+    locks = [
+        locking.FileLock(path)
+        for path in sorted(
+            locking.lock_path(tmp_path, "foo", manip.name, format_.name)
+            for manip, format_ in variants
+        )
+    ]
+    for lock in locks:
+        lock.acquire()
+
+    # Each lock is released before a wait on it alone would time out, but not before the waits
+    # on every lock together would
+    timers = [
+        threading.Timer(0.3 * (item + 1), lock.release)
+        for item, lock in enumerate(locks)
+    ]
+    for timer in timers:
+        timer.start()
+
+    start = time.monotonic()
+    with pytest.raises(exceptions.LockTimeoutError):
+        database.ManipRecord.get_or_render_many(parent, config, variants)
+    assert time.monotonic() - start < 1.0
+
+    for timer in timers:
+        timer.join()
@@ -0,0 +1,81 @@
+import os
+import stat
+import time
+
+import pytest
+from PIL import Image
+
+from kodak import configuration
+from kodak import constants
+from kodak import engine
+from kodak import exceptions
+from kodak import locking
+
+
+@pytest.fixture(name="variants")
+def _variants(tmp_path):
+    Image.new("RGB", (10, 10)).save(tmp_path / "image.png")
+    return [
+        engine.Variant(
+            manip=configuration.ManipConfig("full"),
+            format_=constants.ImageFormat.PNG,
+            destination=tmp_path / "full.png",
+        )
+    ]
+
+
+def test_shared_workers(tmp_path, variants):
+    """Test that render workers are shared between processes and bounded by one deadline"""
+    renderer = engine.RenderEngine(
+        configuration.RenderConfig(workers=1, timeout=0.5), tmp_path
+    )
+    slot = locking.Semaphore(
+        tmp_path / constants.LOCK_DIRECTORY_NAME / "render-worker", 1
+    ).acquire(timeout=0)
+
+    start = time.monotonic()
+    with pytest.raises(exceptions.RenderTimeoutError):
+        renderer.render(tmp_path / "image.png", variants)
+    assert time.monotonic() - start < 1
+
+    slot.release()
+    try:
+        assert len(renderer.render(tmp_path / "image.png", variants)) == 1
+    finally:
+        renderer.shutdown()
+
+
+def test_shared_queue(tmp_path, variants):
+    """Test that the render queue is shared between processes"""
+    renderer = engine.RenderEngine(
+        configuration.RenderConfig(workers=0, queue_size=2, timeout=0.2), tmp_path
+    )
+    queue = locking.Semaphore(
+        tmp_path / constants.LOCK_DIRECTORY_NAME / "render-queue", 2
+    )
+    slots = [queue.acquire(timeout=0), queue.acquire(timeout=0)]
+    assert queue.acquire(timeout=0) is None
+
+    with pytest.raises(exceptions.RenderQueueFullError):
+        renderer.render(tmp_path / "image.png", variants)
+
+    slots[0].release()
+    assert len(renderer.render(tmp_path / "image.png", variants)) == 1
+    assert queue.acquire(timeout=0) is not None
+
+
+@pytest.mark.parametrize("umask,mode", [(0o022, 0o644), (0o027, 0o640)])
+def test_render_mode(tmp_path, variants, umask, mode):
+    """Test that rendered files are created with the permissions allowed by the umask"""
+    previous = os.umask(umask)
+    try:
+        engine.initialize(configuration.RenderConfig())
+    finally:
+        os.umask(previous)
+
+    try:
+        engine.render(tmp_path / "image.png", variants)
+    finally:
+        engine.initialize(configuration.RenderConfig())
+
+    assert stat.S_IMODE((tmp_path / "full.png").stat().st_mode) == mode
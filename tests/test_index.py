@@ -0,0 +1,214 @@
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+from kodak import configuration
+from kodak import constants
+from kodak import database
+from kodak import index
+
+
+@pytest.fixture(name="config")
+def _config(tmp_path):
+    config = configuration.KodakConfig(
+        source_dir=tmp_path / "pictures", content_dir=tmp_path / "content"
+    )
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    config.source_dir.mkdir()
+    config.content_dir.mkdir()
+    database.initialize(config)
+    return config
+
+
+def test_status_file(tmp_path):
+    """Test publishing and reading the shared index build status"""
+    shared = index.StatusFile(tmp_path)
+    assert shared.read() == index.IndexStatus()
+
+    status = index.IndexStatus(
+        building=True,
+        phase="refreshing",
+        processed=12,
+        started=datetime.datetime(2021, 11, 20, 19, 32, 7),
+    )
+    shared.write(status)
+    assert shared.read() == status
+
+    shared.path.write_text("garbage")
+    assert shared.read() == index.IndexStatus()
+
+
+def test_status_file_dead_leader(tmp_path):
+    """Test that a build abandoned by a process that exited is not reported as running"""
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+
+    shared = index.StatusFile(tmp_path)
+    shared.path.parent.mkdir()
+    shared.path.write_text(
+        json.dumps(
+            {
+                "pid": dead.pid,
+                "status": index.IndexStatus(building=True, phase="linking").as_dict(),
+            }
+        )
+    )
+
+    status = shared.read()
+    assert not status.building
+    assert status.phase is None
+    assert str(dead.pid) in status.error
+
+
+def test_start_follower(config):
+    """Test that only the process holding the leader lock builds the index"""
+    with index.leader(config):
+        index.start(config).join()
+
+    assert not (
+        config.content_dir / constants.LOCK_DIRECTORY_NAME / "index.json"
+    ).exists()
+    assert index.status(config) == index.IndexStatus()
+
+
+def test_start(config):
+    """Test building the index in a background thread"""
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.jpg")
+
+    thread = index.start(config)
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    status = index.status(config)
+    assert not status.building
+    assert status.completed is not None
+    assert database.ImageRecord.select().count() == 1
+
+    # the index is not built again by a process started before the build completed
+    (config.source_dir / "bar.jpg").write_bytes(
+        (config.source_dir / "foo.jpg").read_bytes()
+    )
+    index.start(config).join(timeout=10)
+    assert index.status(config).completed == status.completed
+    assert database.ImageRecord.select().count() == 1
+
+
+def test_start_retry(config, monkeypatch):
+    """Test that a failed background build is retried until it completes"""
+    monkeypatch.setattr(constants, "INDEX_RETRY_INTERVAL", 0.01)
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.jpg")
+    build = index._build
+    failures = []
+
+    def _build(*args):
+        if len(failures) < 2:
+            failures.append(args)
+            raise RuntimeError("Database went away")
+        build(*args)
+
+    monkeypatch.setattr(index, "_build", _build)
+    thread = index.start(config)
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert len(failures) == 2
+    status = index.status(config)
+    assert status.completed is not None
+    assert status.error is None
+    assert database.ImageRecord.select().count() == 1
+
+
+def test_identify_name_conflict(config):
+    """Test that files whose image name is already taken are not indexed"""
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.jpg")
+    index.build(config)
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.png")
+    index.build(config)
+    index.update(config, [config.source_dir / "foo.png"])
+
+    assert [str(item.source) for item in database.ImageRecord.select()] == ["foo.jpg"]
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_identify_reuse_deleted_name(config, incremental):
+    """Test that a new file takes over the image name of a deleted file"""
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.jpg")
+    index.build(config)
+    parent = database.ImageRecord.get()
+    database.ManipRecord.create(
+        parent=parent,
+        name="thumb",
+        file="foo/thumb.jpeg",
+        format_=constants.ImageFormat.JPEG,
+        checksum=database.Checksum("sha256", "abc123"),
+    )
+    (config.source_dir / "foo.jpg").unlink()
+    index.build(config)
+    assert database.ImageRecord.get().deleted
+
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.png")
+    if incremental:
+        index.update(config, [config.source_dir / "foo.png"])
+    else:
+        index.build(config)
+
+    record = database.ImageRecord.get()
+    assert record.id == parent.id
+    assert not record.deleted
+    assert str(record.source) == "foo.png"
+    assert record.format_ == constants.ImageFormat.PNG
+    assert record.checksum == database.Checksum.from_path(config.source_dir / "foo.png")
+    assert database.ManipRecord.select().count() == 0
+
+
+def test_update_rename_extension(config):
+    """Test that a file renamed to another extension keeps its image name"""
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.jpg")
+    config.expose_source = True
+    index.build(config)
+
+    (config.source_dir / "foo.jpg").rename(config.source_dir / "foo.jpeg")
+    index.update(
+        config, [config.source_dir / "foo.jpg", config.source_dir / "foo.jpeg"]
+    )
+
+    assert [
+        (str(item.source), item.deleted) for item in database.ImageRecord.select()
+    ] == [("foo.jpeg", False)]
+    assert index.scan_links(config) == {"foo": config.source_dir / "foo.jpeg"}
+
+
+def test_link(config):
+    """Test that only the changes to the source links are applied"""
+    for name in ("foo", "bar", "baz"):
+        Image.new("RGB", (10, 10)).save(config.source_dir / f"{name}.jpg")
+    index.build(config)
+    assert index.scan_links(config) == {}
+
+    config.expose_source = True
+    assert index.link(config) == 3
+    assert index.scan_links(config) == {
+        name: config.source_dir / f"{name}.jpg" for name in ("foo", "bar", "baz")
+    }
+    assert index.link(config) == 0
+
+    # retargeted, stray, and removed links
+    (config.content_dir / "foo" / "original").unlink()
+    (config.content_dir / "foo" / "original").symlink_to(config.source_dir)
+    (config.content_dir / "bar" / "original").unlink()
+    (config.content_dir / "stray").mkdir()
+    (config.content_dir / "stray" / "original").symlink_to(config.source_dir)
+    assert index.link(config) == 3
+    assert index.scan_links(config) == {
+        name: config.source_dir / f"{name}.jpg" for name in ("foo", "bar", "baz")
+    }
+
+    config.expose_source = False
+    assert index.link(config) == 3
+    assert index.scan_links(config) == {}
+    assert os.listdir(config.content_dir / "foo") == []
@@ -0,0 +1,43 @@
+import threading
+import time
+
+from kodak import locking
+
+
+def test_transient(tmp_path):
+    """Test that a transient lock removes its file without breaking the lock for waiters"""
+    path = locking.lock_path(tmp_path, "foo", "thumb", "JPEG")
+    first = locking.FileLock(path, transient=True)
+    assert first.acquire()
+
+    acquired = []
+    waiting = locking.FileLock(path, timeout=5, transient=True)
+    thread = threading.Thread(target=lambda: acquired.append(waiting.acquire()))
+    thread.start()
+    time.sleep(0.2)
+
+    first.release()
+    assert not path.exists()
+    thread.join()
+    assert acquired == [True]
+
+    # the waiter holds the lock on the file now at the path, so no one else can take it
+    assert path.exists()
+    assert not locking.FileLock(path).acquire(blocking=False)
+    waiting.release()
+    assert not path.exists()
+
+
+def test_prune(tmp_path):
+    """Test that only keyed lock files that are not held are removed"""
+    held = locking.FileLock(locking.lock_path(tmp_path, "foo"))
+    held.acquire()
+    locking.FileLock(locking.lock_path(tmp_path, "bar")).acquire()
+    stale = locking.lock_path(tmp_path, "baz")
+    stale.write_text("")
+    (stale.parent / "index.lock").write_text("")
+
+    assert locking.prune(tmp_path) == 1
+    assert not stale.exists()
+    assert locking.lock_path(tmp_path, "foo").exists()
+    assert (stale.parent / "index.lock").exists()
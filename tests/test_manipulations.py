@@ -0,0 +1,264 @@
+from typing import Tuple
+
+import pytest
+from PIL import Image
+
+from kodak import configuration
+from kodak import constants
+from kodak import manipulations
+
+
+SOURCE_SIZE = (640, 480)
+
+ANCHOR_OFFSETS = {
+    constants.CropAnchor.TL: (0, 0),
+    constants.CropAnchor.TC: (0.5, 0),
+    constants.CropAnchor.TR: (1, 0),
+    constants.CropAnchor.CL: (0, 0.5),
+    constants.CropAnchor.C: (0.5, 0.5),
+    constants.CropAnchor.CR: (1, 0.5),
+    constants.CropAnchor.BL: (0, 1),
+    constants.CropAnchor.BC: (0.5, 1),
+    constants.CropAnchor.BR: (1, 1),
+}
+
+SCALES = (
+    configuration.ManipScaleConfig(
+        horizontal=320, strategy=constants.ScaleStrategy.ABSOLUTE
+    ),
+    configuration.ManipScaleConfig(
+        vertical=120, strategy=constants.ScaleStrategy.ABSOLUTE
+    ),
+    configuration.ManipScaleConfig(
+        horizontal=300, vertical=200, strategy=constants.ScaleStrategy.ABSOLUTE
+    ),
+    configuration.ManipScaleConfig(
+        horizontal=0.5, strategy=constants.ScaleStrategy.RELATIVE
+    ),
+    configuration.ManipScaleConfig(
+        horizontal=0.5, vertical=0.25, strategy=constants.ScaleStrategy.RELATIVE
+    ),
+)
+
+
+def _quadrants() -> Image.Image:
+    """Build a test image with a distinct solid color in each quadrant"""
+    image = Image.new("RGB", SOURCE_SIZE)
+    width, height = SOURCE_SIZE
+    image.paste((255, 0, 0), (0, 0, width // 2, height // 2))
+    image.paste((0, 255, 0), (width // 2, 0, width, height // 2))
+    image.paste((0, 0, 255), (0, height // 2, width // 2, height))
+    image.paste((255, 255, 0), (width // 2, height // 2, width, height))
+    return image
+
+
+def _two_pass(image: Image.Image, config: configuration.ManipConfig) -> Image.Image:
+    """Reference implementation of the separate scale-then-crop passes"""
+    if config.scale.horizontal is None or config.scale.vertical is None:
+        if config.scale.strategy == constants.ScaleStrategy.ABSOLUTE:
+            box = (
+                config.scale.horizontal or image.width,
+                config.scale.vertical or image.height,
+            )
+        else:
+            box = (
+                (config.scale.horizontal or 1) * image.width,
+                (config.scale.vertical or 1) * image.height,
+            )
+        image = image.copy()
+        image.thumbnail(box, Image.LANCZOS)
+    elif config.scale.strategy == constants.ScaleStrategy.ABSOLUTE:
+        image = image.resize((config.scale.horizontal, config.scale.vertical))
+    else:
+        image = image.resize(
+            (
+                round(config.scale.horizontal * image.width),
+                round(config.scale.vertical * image.height),
+            )
+        )
+
+    width = config.crop.horizontal or image.width
+    height = config.crop.vertical or image.height
+    x_offset, y_offset = ANCHOR_OFFSETS[config.crop.anchor]
+    x_1 = int((image.width - width) * x_offset)
+    y_1 = int((image.height - height) * y_offset)
+    return image.crop((x_1, y_1, x_1 + width, y_1 + height))
+
+
+def _corners(image: Image.Image) -> Tuple[Tuple[int, ...], ...]:
+    """Sample pixels just inside each corner of an image"""
+    return tuple(
+        image.getpixel((x, y))
+        for x in (2, image.width - 3)
+        for y in (2, image.height - 3)
+    )
+
+
+@pytest.mark.parametrize("anchor", list(constants.CropAnchor))
+@pytest.mark.parametrize("scale", SCALES)
+def test_plan_matches_two_pass(anchor, scale):
+    """Test that the fused transform matches separate scale and crop passes"""
+    config = configuration.ManipConfig(
+        name="test",
+        scale=scale,
+        crop=configuration.ManipCropConfig(horizontal=100, vertical=40, anchor=anchor),
+    )
+
+    image = _quadrants()
+    expected = _two_pass(image, config)
+
+    geometry = manipulations.plan(image.size, config)
+    result = manipulations.transform(image, geometry)
+
+    assert geometry.size == expected.size == (100, 40)
+    assert result.size == expected.size
+    assert _corners(result) == _corners(expected)
+
+
+@pytest.mark.parametrize("scale", SCALES)
+def test_plan_scale_only(scale):
+    """Test that scale-only manipulations sample the whole source image"""
+    config = configuration.ManipConfig(name="test", scale=scale)
+
+    image = _quadrants()
+    geometry = manipulations.plan(image.size, config)
+
+    assert geometry.box == (0, 0) + SOURCE_SIZE
+    assert geometry.size == _two_pass(image, config).size
+    assert manipulations.transform(image, geometry).size == geometry.size
+
+
+@pytest.mark.parametrize("anchor", list(constants.CropAnchor))
+def test_plan_crop_only(anchor):
+    """Test that crop-only manipulations do not resample the image"""
+    config = configuration.ManipConfig(
+        name="test",
+        crop=configuration.ManipCropConfig(horizontal=200, vertical=100, anchor=anchor),
+    )
+
+    image = _quadrants()
+    geometry = manipulations.plan(image.size, config)
+    x_offset, y_offset = ANCHOR_OFFSETS[anchor]
+
+    assert geometry.size == (200, 100)
+    assert geometry.box[:2] == (440 * x_offset, 380 * y_offset)
+    assert list(manipulations.transform(image, geometry).getdata()) == list(
+        _two_pass(image, config).getdata()
+    )
+
+
+def test_plan_clamps_crop():
+    """Test that crop dimensions larger than the scaled image are clamped"""
+    config = configuration.ManipConfig(
+        name="test",
+        scale=configuration.ManipScaleConfig(
+            horizontal=320, strategy=constants.ScaleStrategy.ABSOLUTE
+        ),
+        crop=configuration.ManipCropConfig(horizontal=1000, vertical=100),
+    )
+
+    geometry = manipulations.plan(SOURCE_SIZE, config)
+
+    assert geometry.size == (320, 100)
+    assert geometry.box == (0, 140, 640, 340)
+
+
+def test_transform_drafted():
+    """Test that a transform planned at full resolution applies to a reduced image"""
+    config = configuration.ManipConfig(
+        name="test",
+        scale=configuration.ManipScaleConfig(
+            horizontal=80, strategy=constants.ScaleStrategy.ABSOLUTE
+        ),
+        crop=configuration.ManipCropConfig(
+            horizontal=40, vertical=40, anchor=constants.CropAnchor.BR
+        ),
+    )
+
+    image = _quadrants()
+    geometry = manipulations.plan(image.size, config)
+    reduced = image.reduce(4)
+
+    result = manipulations.transform(reduced, geometry, image.size)
+
+    assert result.size == (40, 40)
+    assert _corners(result) == _corners(
+        manipulations.transform(image, geometry, image.size)
+    )
+
+
+def test_reuse():
+    """Test that a smaller manip can be derived from the output of a larger one"""
+    large = configuration.ManipConfig(
+        name="large",
+        scale=configuration.ManipScaleConfig(
+            horizontal=400, strategy=constants.ScaleStrategy.ABSOLUTE
+        ),
+    )
+    small = configuration.ManipConfig(
+        name="small",
+        scale=configuration.ManipScaleConfig(
+            horizontal=100, strategy=constants.ScaleStrategy.ABSOLUTE
+        ),
+        crop=configuration.ManipCropConfig(
+            horizontal=50, vertical=50, anchor=constants.CropAnchor.TR
+        ),
+    )
+
+    image = _quadrants()
+    large_geometry = manipulations.plan(image.size, large)
+    small_geometry = manipulations.plan(image.size, small)
+
+    assert manipulations.reuse(large_geometry, small_geometry) is None
+
+    reused = manipulations.reuse(small_geometry, large_geometry)
+    assert reused is not None
+    assert reused.size == small_geometry.size
+    assert reused.box == (200, 0, 400, 200)
+
+    intermediate = manipulations.transform(image, large_geometry)
+    assert _corners(manipulations.transform(intermediate, reused)) == _corners(
+        manipulations.transform(image, small_geometry)
+    )
+
+
+def test_adjust_identity():
+    """Test that manipulations without color adjustments leave the image untouched"""
+    image = _quadrants()
+    assert manipulations.adjust(image, configuration.ManipConfig(name="test")) is image
+
+
+def test_adjust_black_and_white():
+    """Test that black and white matches a plain luminance conversion"""
+    image = _quadrants()
+    result = manipulations.adjust(
+        image, configuration.ManipConfig(name="test", black_and_white=True)
+    )
+
+    assert result.mode == "L"
+    assert list(result.getdata()) == list(image.convert("L").getdata())
+
+
+def test_adjust_brightness_contrast():
+    """Test that brightness and contrast are applied in sequence in a single pass"""
+    image = Image.new("RGBA", (1, 1), (100, 128, 200, 50))
+    config = configuration.ManipConfig(name="test", brightness=10, contrast=50)
+
+    result = manipulations.adjust(image, config)
+
+    # brightness adds 25.5 to each channel, contrast then scales the distance from 128 by 1.5
+    assert result.getpixel((0, 0)) == (124, 166, 255, 50)
+
+
+def test_adjust_sepia():
+    """Test that sepia tones the luminance of the image"""
+    image = Image.new("RGB", (1, 1), (100, 100, 100))
+
+    result = manipulations.adjust(
+        image, configuration.ManipConfig(name="test", sepia=True, brightness=-10)
+    )
+
+    assert result.mode == "RGB"
+    assert result.getpixel((0, 0)) == tuple(
+        round(74 * weight) for weight in constants.SEPIA_TONE
+    )
@@ -0,0 +1,58 @@
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from kodak import constants
+from kodak.resources.manip import negotiate
+
+
+FORMATS = {
+    constants.ImageFormat.JPEG,
+    constants.ImageFormat.PNG,
+    constants.ImageFormat.WEBP,
+}
+
+
+@pytest.mark.parametrize(
+    "header,rendered,expected",
+    [
+        # no header or wildcards fall back to the most compatible format
+        (None, {}, constants.ImageFormat.JPEG),
+        ("*/*", {constants.ImageFormat.WEBP: 10}, constants.ImageFormat.JPEG),
+        ("image/*", {}, constants.ImageFormat.JPEG),
+        # explicitly named formats win over wildcard matches
+        ("image/avif,image/webp,*/*", {}, constants.ImageFormat.WEBP),
+        ("image/png,*/*;q=0.8", {}, constants.ImageFormat.PNG),
+        # quality values are respected
+        ("image/webp;q=0.5,image/png", {}, constants.ImageFormat.PNG),
+        # equally ranked explicit formats prefer the smallest rendered variant
+        (
+            "image/png,image/jpeg",
+            {constants.ImageFormat.PNG: 50, constants.ImageFormat.JPEG: 100},
+            constants.ImageFormat.PNG,
+        ),
+        (
+            "image/png,image/jpeg,image/webp",
+            {constants.ImageFormat.PNG: 50, constants.ImageFormat.WEBP: 10},
+            constants.ImageFormat.WEBP,
+        ),
+        # then the order the client listed them in
+        ("image/png,image/jpeg", {}, constants.ImageFormat.PNG),
+        # nothing acceptable
+        ("text/html", {}, None),
+        ("image/gif", {}, None),
+    ],
+)
+def test_negotiate(header, rendered, expected):
+    """Test selection of the format to send based on the accept header"""
+    accept = parse_accept_header(header, MIMEAccept)
+    assert negotiate(accept, FORMATS, rendered) == expected
+
+
+def test_negotiate_restricted_formats():
+    """Test that only formats the manip supports are selected"""
+    accept = parse_accept_header("image/webp,*/*", MIMEAccept)
+    assert (
+        negotiate(accept, {constants.ImageFormat.PNG}, {}) == constants.ImageFormat.PNG
+    )
+    assert negotiate(accept, set(), {}) is None
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import flask_restful
+from PIL import Image
+from playhouse import pool
+
+from kodak import _server
+from kodak import database
+from kodak import index
+from kodak import resources
+
+
+def test_request_connection(monkeypatch, tmp_path):
+    """Test that requests check a database connection out of the pool on first use and back in"""
+    monkeypatch.setenv("KODAK_DATABASE_SQLITE_PATH", str(tmp_path / "kodak.db"))
+
+    app = _server.KodakFlask(__name__)
+    app.before_first_request(_server.initialize_database)
+
+    connections = []
+
+    @app.route("/connection")
+    def _connection():  # pylint: disable=unused-variable
+        assert database.interface.is_closed()
+        database.ImageRecord.select().count()
+        assert not database.interface.is_closed()
+        connections.append(id(database.interface.connection()))
+        return "ok"
+
+    @app.route("/noop")
+    def _noop():  # pylint: disable=unused-variable
+        return "ok"
+
+    client = app.test_client()
+    for _ in range(3):
+        assert client.get("/connection").status_code == 200
+        assert client.get("/noop").status_code == 200
+
+        pool = database.interface.obj
+        assert database.interface.is_closed()
+        assert not pool._in_use  # pylint: disable=protected-access
+        assert len(pool._connections) == 1  # pylint: disable=protected-access
+
+    # the pooled connection is reused by every request
+    assert len(set(connections)) == 1
+
+
+def test_pool_exhausted(monkeypatch, tmp_path):
+    """Test that running out of pooled database connections is reported as a retryable error"""
+    monkeypatch.setenv("KODAK_DATABASE_SQLITE_PATH", str(tmp_path / "kodak.db"))
+
+    app = _server.KodakFlask(__name__)
+    app.appconfig.database.mariadb.pool_timeout = 2.5
+    api = _server.KodakApi(app, errors=_server.make_api_errors())
+
+    class _Exhausted(flask_restful.Resource):
+        def get(self):  # pylint: disable=no-self-use
+            raise pool.MaxConnectionsExceeded("Exceeded maximum connections.")
+
+    api.add_resource(_Exhausted, "/exhausted")
+
+    response = app.test_client().get("/exhausted")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+
+
+def test_heartbeat_ready(monkeypatch, tmp_path):
+    """Test that readiness is only reported once the background index build completes"""
+    (tmp_path / "pictures").mkdir()
+    (tmp_path / "content").mkdir()
+    monkeypatch.setenv("KODAK_SOURCE_DIR", str(tmp_path / "pictures"))
+    monkeypatch.setenv("KODAK_CONTENT_DIR", str(tmp_path / "content"))
+    monkeypatch.setenv("KODAK_DATABASE_SQLITE_PATH", str(tmp_path / "kodak.db"))
+    Image.new("RGB", (10, 10)).save(tmp_path / "pictures" / "foo.jpg")
+
+    building = threading.Event()
+    finish = threading.Event()
+    build = index._build
+
+    def _build(config, progress):
+        progress("identifying", 0)
+        building.set()
+        finish.wait(timeout=10)
+        build(config, progress)
+
+    monkeypatch.setattr(index, "_build", _build)
+
+    app = _server.KodakFlask(__name__)
+    api = _server.KodakApi(app, errors=_server.make_api_errors())
+    api.add_resource(resources.Heartbeat, *resources.Heartbeat.routes)
+    app.before_first_request(_server.initialize_database)
+    app.before_first_request(_server.start_index)
+    client = app.test_client()
+
+    assert client.get("/heartbeat").status_code == 200
+    assert building.wait(timeout=10)
+
+    response = client.get("/heartbeat?ready")
+    assert response.status_code == 503
+    assert response.json["index"]["building"]
+    assert response.json["index"]["phase"] == "identifying"
+    assert response.json["index"]["completed"] is None
+
+    finish.set()
+    deadline = time.monotonic() + 10
+    while index.status(app.appconfig).building and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    response = client.get("/heartbeat?ready")
+    assert response.status_code == 200
+    assert not response.json["index"]["building"]
+    assert response.json["index"]["completed"] is not None
+    assert set(response.json["cache"]) == {
+        "hits",
+        "misses",
+        "entries",
+        "capacity",
+        "ratio",
+    }
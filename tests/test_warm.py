@@ -0,0 +1,35 @@
+from kodak import configuration
+from kodak import constants
+from kodak import database
+from kodak import warm
+
+
+def test_warm_counts(tmp_path, monkeypatch):
+    """Test that rendered, skipped, and failed manips are counted separately"""
+    config = configuration.KodakConfig(content_dir=tmp_path)
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    config.render.workers = 1
+    config.manips = {
+        "thumb": configuration.ManipConfig(
+            name="thumb",
+            formats={constants.ImageFormat.JPEG, constants.ImageFormat.PNG},
+        )
+    }
+    database.initialize(config)
+    for name in ("foo", "bar"):
+        database.ImageRecord.create(
+            name=name,
+            source=f"{name}.jpg",
+            format_=constants.ImageFormat.JPEG,
+            checksum=database.Checksum("sha256", "abc123"),
+        )
+
+    def _get_or_render_many(parent, config, variants, on_render=None):
+        if parent.name == "bar":
+            raise OSError("Source file is unreadable")
+        # one of the variants was rendered by another worker in the meantime
+        on_render(len(variants) - 1)
+
+    monkeypatch.setattr(database.ManipRecord, "get_or_render_many", _get_or_render_many)
+
+    assert warm.warm(config) == (1, 2)
@@ -0,0 +1,161 @@
+import peewee
+import pytest
+from PIL import Image
+
+from kodak import configuration
+from kodak import database
+from kodak import watch
+from kodak.watch import InotifyFlag
+
+
+@pytest.fixture(name="config")
+def _config(tmp_path):
+    config = configuration.KodakConfig(
+        source_dir=tmp_path / "pictures", content_dir=tmp_path / "content"
+    )
+    config.database.sqlite.path = tmp_path / "kodak.db"
+    config.source_dir.mkdir()
+    config.content_dir.mkdir()
+    database.initialize(config)
+    return config
+
+
+def _events(inotify: watch.Inotify):
+    events = set()
+    while True:
+        batch = list(inotify.read(timeout=0.2))
+        if not batch:
+            return events
+        events.update(batch)
+
+
+def test_inotify(tmp_path):
+    """Test reading events for a watched directory and a link to it"""
+    (tmp_path / "pictures").mkdir()
+    (tmp_path / "link").symlink_to(tmp_path / "pictures")
+
+    with watch.Inotify() as inotify:
+        inotify.add(tmp_path / "pictures")
+        inotify.add(tmp_path / "link")
+        assert inotify.watches == {tmp_path / "pictures", tmp_path / "link"}
+
+        (tmp_path / "pictures" / "foo.jpg").write_bytes(b"foo")
+        (tmp_path / "pictures" / "foo.jpg").unlink()
+
+        events = _events(inotify)
+        for path in (tmp_path / "pictures" / "foo.jpg", tmp_path / "link" / "foo.jpg"):
+            assert watch.Event(path, InotifyFlag.CREATE) in events
+            assert watch.Event(path, InotifyFlag.CLOSE_WRITE) in events
+            assert watch.Event(path, InotifyFlag.DELETE) in events
+
+
+def test_watch_tree(config, tmp_path):
+    """Test that linked directories are watched once, as they are indexed"""
+    (config.source_dir / "album").mkdir()
+    (tmp_path / "outside").mkdir()
+    (config.source_dir / "linked").symlink_to(tmp_path / "outside")
+    (config.source_dir / "album" / "again").symlink_to(tmp_path / "outside")
+    (config.source_dir / "album" / "cycle").symlink_to(config.source_dir)
+
+    watcher = watch.Watcher(config)
+    root = config.source_dir.stat()
+    watcher._visited = {(root.st_dev, root.st_ino)}
+    with watch.Inotify() as inotify:
+        watcher._watch_tree(inotify, config.source_dir)
+
+        assert len(inotify.watches) == 3
+        assert config.source_dir in inotify.watches
+        assert config.source_dir / "album" in inotify.watches
+        assert inotify.watches & {
+            config.source_dir / "linked",
+            config.source_dir / "album" / "again",
+        }
+
+
+def test_handle(config, tmp_path):
+    """Test collecting changes and detecting events that require a rebuild"""
+    watcher = watch.Watcher(config)
+    source = config.source_dir
+
+    with watch.Inotify() as inotify:
+        assert not watcher._handle(
+            inotify, watch.Event(source / "foo.jpg", InotifyFlag.CLOSE_WRITE)
+        )
+        assert not watcher._handle(
+            inotify, watch.Event(source / "foo.jpg", InotifyFlag.IGNORED)
+        )
+        assert watcher._pending == {source / "foo.jpg"}
+
+        (source / "album").mkdir()
+        Image.new("RGB", (10, 10)).save(source / "album" / "bar.jpg")
+        assert not watcher._handle(
+            inotify,
+            watch.Event(source / "album", InotifyFlag.CREATE | InotifyFlag.ISDIR),
+        )
+        assert source / "album" in inotify.watches
+
+        (tmp_path / "outside").mkdir()
+        Image.new("RGB", (10, 10)).save(tmp_path / "outside" / "baz.jpg")
+        (source / "linked").symlink_to(tmp_path / "outside")
+        assert not watcher._handle(
+            inotify, watch.Event(source / "linked", InotifyFlag.CREATE)
+        )
+        assert source / "linked" in inotify.watches
+        assert watcher._pending == {
+            source / "foo.jpg",
+            source / "album" / "bar.jpg",
+            source / "linked" / "baz.jpg",
+        }
+
+        assert watcher._handle(inotify, watch.Event(source, InotifyFlag.Q_OVERFLOW))
+        assert watcher._handle(
+            inotify,
+            watch.Event(source / "album", InotifyFlag.MOVED_FROM | InotifyFlag.ISDIR),
+        )
+        assert watcher._handle(inotify, watch.Event(source, InotifyFlag.DELETE_SELF))
+        assert not watcher._handle(
+            inotify, watch.Event(source / "album", InotifyFlag.DELETE_SELF)
+        )
+
+
+def test_flush(config):
+    """Test applying the collected changes to the index"""
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.jpg")
+    Image.new("RGB", (10, 10)).save(config.source_dir / "bar.jpg")
+
+    watcher = watch.Watcher(config)
+    watcher._pending = {config.source_dir / "foo.jpg", config.source_dir / "baz.jpg"}
+    watcher._first_event = watcher._last_event = 0.0
+    assert watcher._due()
+
+    watcher._flush()
+
+    assert [str(item.source) for item in database.ImageRecord.select()] == ["foo.jpg"]
+    assert watcher._pending == set()
+    assert watcher._first_event is None
+    assert not watcher._due()
+
+
+def test_flush_error(config, monkeypatch):
+    """Test that changes which fail to apply are kept to be retried"""
+    Image.new("RGB", (10, 10)).save(config.source_dir / "foo.jpg")
+
+    def _update(*_, **__):
+        raise peewee.OperationalError("database is locked")
+
+    watcher = watch.Watcher(config)
+    watcher._pending = {config.source_dir / "foo.jpg"}
+    watcher._first_event = watcher._last_event = 0.0
+
+    with monkeypatch.context() as context:
+        context.setattr(watch.index, "update", _update)
+        watcher._flush()
+
+    assert watcher._pending == {config.source_dir / "foo.jpg"}
+    assert not watcher._due()
+
+    watcher._first_event = watcher._last_event = 0.0
+    watcher._flush()
+
+    assert [str(item.source) for item in database.ImageRecord.select()] == ["foo.jpg"]
+    assert watcher._pending == set()